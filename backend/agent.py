@@ -3,14 +3,16 @@ import os
 from dotenv import load_dotenv
 from langchain.agents import create_openai_tools_agent, AgentExecutor
 from langchain.chains import SequentialChain, LLMChain
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import SystemMessage
 from langchain_core.tools import Tool
-from langchain_openai import OpenAI, ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from base.tools import search_question
 from base.prompt_template import InterviewPromptTemplate
+from base.struct_resume import ResumeLoader
+from base.struct_metrics import track_stage
+from base.struct_router import get_model_router
+import config
 
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("AZ_API_KEY")
@@ -31,16 +33,18 @@ class AgentMasterChat():
 
     def __init__(self):
         # 初始化MasterChat类
-        # todo 目前使用openai 后续可以根据需求更改
-        self.chat_model = ChatOpenAI(temperature=0, streaming=True)
+        # agent需要绑定工具，使用生成问题环节的首选模型（须为chat类型），不参与路由
+        self.router = get_model_router()
+        self.chat_model = self.router.model(self.router.routes["question_generation"][0])
         self.template = InterviewPromptTemplate()
+        self.resume_loader = ResumeLoader(config.RESUME_CACHE_DIR, config.RESUME_MAX_TOKENS)
         # 设置聊天历史记录的键名
         self.MEMORY_KEY = "chat_history"
         # 工具列表初始化为空
         self.tools = [Tool(
             name="search_question",
-            func=search_question,
-            description="返回当前的时间"
+            func=search_question.func,
+            description="根据技术关键词从题库中检索面试题和参考答案，多个关键词用逗号分隔"
         )]
 
         self.prompt = None
@@ -98,8 +102,7 @@ class AgentMasterChat():
         """
         使用顺序连 分析简历 -> 分析职位要求 -> 生成问题
         """
-        interview = PyPDFLoader(db["file_location"])
-        model = OpenAI(temperature=0, max_tokens=512)
+        model = self.router.completion_model()
 
         interview_chain = LLMChain(
             llm=model,
@@ -121,25 +124,27 @@ class AgentMasterChat():
             verbose=True,
         )
 
-        result = sequential_chain.invoke({
-            "interview": interview.load()[0].page_content,
-            "job_description": db["job_description"],
-        })
+        # 顺序链在一次调用中完成，两步都按简历分析环节路由
+        with track_stage("resume_analysis"):
+            result = sequential_chain.invoke({
+                "interview": self.resume_loader.load(db["file_location"]),
+                "job_description": db["job_description"],
+            })
         db['new_interview_keywords'] = result
 
     def analyze_resume(self, db: dict):
         """
         使用顺序连 分析简历 -> 生成问题
         """
-        interview = PyPDFLoader(db["file_location"])
-        model = OpenAI(temperature=0, max_tokens=512)
+        model = self.router.completion_model()
 
         chain = self.template.analyze_prompt | model
 
         # 使用callbacks记录日志
         # result = chain.invoke({"interview": interview.load()[0].page_content},
         #                       config={"callbacks":[StdOutCallbackHandler(), file_handler]})
-        result = chain.invoke({"interview": interview.load()[0].page_content})
+        with track_stage("resume_analysis"):
+            result = chain.invoke({"interview": self.resume_loader.load(db["file_location"])})
         db['new_interview_keywords'] = result
 
 
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import logging
 import os
 import config
 from datetime import datetime
@@ -6,31 +8,73 @@ from datetime import datetime
 from dotenv import load_dotenv
 from langchain.chains import SequentialChain, LLMChain
 from langchain.schema.runnable import RunnablePassthrough, RunnableLambda
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.callbacks import AsyncCallbackManager
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, HumanMessagePromptTemplate
-from langchain_core.messages import SystemMessage, AIMessage
-from langchain_openai import OpenAI, ChatOpenAI
+from langchain_core.messages import SystemMessage, AIMessage, messages_from_dict, messages_to_dict
 
-from base.struct_chain import CustomLLMChain
-from base.struct_callback import HistoryCallback
+from base.struct_chain import CustomLLMChain, repair_json, arepair_json
+from base.struct_callback import HistoryCallback, TokenBufferCallback
 from base.struct_memory import EnhanceConversationMemory
-from base.utils import load_json
+from base.struct_resume import ResumeLoader
+from base.struct_rule import AnswerRuleEngine, keyword_matcher
+from base.struct_score import LexicalScorer
+from base.struct_bank import get_question_bank
+from base.struct_metrics import track_stage, record_parse_failure, get_metrics
+from base.struct_router import get_model_router
+from base.struct_scheduler import LLMBusyError
+from base.utils import load_json, validate_json, count_tokens
 from base.prompt_template import InterviewPromptTemplate
 
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("AZ_API_KEY")
 os.environ["OPENAI_API_BASE"] = os.getenv("POLO_API_BASE")
 
+# 各路关键词提取对应的面试环节，用于指标统计
+KEYWORD_STAGES = {"interview": "resume_analysis", "job": "jd_parsing", "job_title": "title_expansion"}
+# 未指定题库时使用进程内共享的题库，与显式传入None（不使用题库）区分
+_DEFAULT = object()
+
+
+class _Speculation:
+    """
+    推测执行中的一次问题生成：预测的提问方式、生成问题的任务、缓存的流式输出和提示词token数
+    """
+
+    def __init__(self, decision: str):
+        self.decision = decision
+        self.buffer = TokenBufferCallback()
+        self.prompt_tokens = 0
+        self.task = None
+
 
 class ChainMasterChat:
     """
     主聊天
     """
+    # 所有会话共享的推测执行统计
+    speculation_stats = {"committed": 0, "discarded": 0, "wasted_tokens": 0}
+    # 所有会话共享的回答评估统计：llm评估次数、本地评分代替llm的次数、llm输出补问后仍不完整由本地评分补全的次数，
+    # 以及各条规则直接给出结果的次数
+    scoring_stats = {"llm": 0, "local": 0, "fallback": 0, "rule": {}}
+    # 所有会话共享的题库使用统计：直接使用题库题目的次数、附带题库参考生成问题的次数
+    question_bank_stats = {"served": 0, "context": 0}
 
-    def __init__(self):
-        self.chat_model = ChatOpenAI(temperature=0, streaming=True, model='gpt-4o-mini-2024-07-18', max_tokens=512)
-        self.model = OpenAI(temperature=0, max_tokens=512, model='gpt-3.5-turbo-instruct')
-        self.template = InterviewPromptTemplate()
+    def __init__(self, chat_model=None, model=None, template=None, keyword_cache=None, resume_loader=None,
+                 scorer=None, question_bank=_DEFAULT):
+        # 模型客户端和提示词模板是无状态的，可以由多个面试会话共享
+        # 未指定时按面试环节路由模型：生成问题、回答应聘者问题使用聊天模型，提取关键词、评估回答使用补全模型
+        self.chat_model = chat_model or get_model_router().chat_model()
+        self.model = model or get_model_router().completion_model()
+        self.template = template or InterviewPromptTemplate()
+        # 关键词提取结果缓存，为None时不使用缓存
+        self.keyword_cache = keyword_cache
+        self.resume_loader = resume_loader or ResumeLoader(config.RESUME_CACHE_DIR, config.RESUME_MAX_TOKENS)
+        # 本地评分，文档频率在所有会话之间累计
+        self.scorer = scorer or LexicalScorer(config.SCORE_FULL_SIMILARITY)
+        # 已经计入本地评分文档频率的参考答案对应的轮次，每轮只计入一次
+        self._observed_turn = 0
+        # 题库，未指定时使用共享的题库，为None时问题全部由llm生成
+        self.question_bank = get_question_bank() if question_bank is _DEFAULT else question_bank
         self.callbacks = [HistoryCallback()]
         self.MEMORY_KEY = "chat_history"
         # 移除tools，因为我们不需要工具调用
@@ -48,16 +92,31 @@ class ChainMasterChat:
             return_messages=True,
             memory_key=self.MEMORY_KEY,
             output_key="ai",
+            max_token_limit=config.MEMORY_MAX_TOKENS or None,
+            keep_turns=config.MEMORY_KEEP_TURNS,
+            summary_prompt=self.template.summary_template,
             verbose=True
         )
         self.analyze_chain_bad_num = 0
         self.analyze_chain_num = 0
         self.chain_result = {"finished": False, 'current_stage':  'start'}
+        # 合并后的关键词，用于恢复会话时重建提示词
+        self.keywords = None
+        # 关键词匹配器和在llm之前评估回答的规则，init_prompt时按关键词创建
+        self.keyword_matcher = None
+        self.rule_engine = None
+        # 同一场面试的请求需要串行处理
+        self.lock = asyncio.Lock()
 
     def init_prompt(self, keywords: dict):
         """
         初始化提示词prompt
         """
+        self.keywords = keywords['new_interview_keywords']
+        self.keyword_matcher = keyword_matcher(self.keywords)
+        if config.RULE_ENGINE_ENABLED:
+            self.rule_engine = AnswerRuleEngine(self.keyword_matcher, min_length=config.RULE_MIN_ANSWER_LENGTH,
+                                                short_length=config.RULE_SHORT_ANSWER_LENGTH)
         system_chat_template = self.template.chat_template.format(
             target_keyword=json.dumps(keywords['new_interview_keywords'], ensure_ascii=False)
         )
@@ -81,18 +140,21 @@ class ChainMasterChat:
             prompt=self.prompt,
             memory=self.memory,
             # callbacks=self.callbacks,
+            output_fields=self.template.chat_schema,
+            repair_prompt=self.template.repair_template,
             verbose=True
         )
-        # 用于分析应聘者的回答情况
-        load_memory = self.memory.load_memory_variables({}).get('chat_history', [])
-        memory = RunnablePassthrough.assign(history=RunnableLambda(lambda x: load_memory))
+        # 用于分析应聘者的回答情况，每次调用时读取最新的对话记录
+        memory = RunnablePassthrough.assign(history=RunnableLambda(lambda x: self.memory.buffer))
         self.analyze_chain = memory | self.template.answer_template | self.model
         # 用于回答应聘者问题
         # self.answer_chain = self.template.interview_template | self.chat_model | StrOutputParser
-        self.answer_chain = LLMChain(
+        self.answer_chain = CustomLLMChain(
             llm=self.chat_model,
             prompt=self.template.interview_template,
             memory=self.memory,
+            output_fields=self.template.interview_schema,
+            repair_prompt=self.template.repair_template,
             verbose=True
         )
 
@@ -100,46 +162,354 @@ class ChainMasterChat:
         """
         运行聊天
         """
-        self.chain_result['current'] = user_reply if user_reply != "" else "请生成问题和答案吧！"
         # 控制面试状态
-        if self.chain_result['current_stage'] == "asking":
-            self.memory.chat_memory.messages.append(AIMessage(content=self.chain_result['current']))
-            self.memory.full_history[-1].update({'reply': user_reply, 'current': self.chain_result['current']})
-            # 评估应聘者回答
-            self.chain_result.update(self.analyze_candidate_responses())
+        if self._start_turn(user_reply):
+            # 评估应聘者回答，规则或本地评分能直接给出结果时不调用llm
+            with track_stage("answer_scoring"):
+                fast_result = self._fast_result()
+                self.chain_result.update(fast_result if fast_result is not None else self.analyze_candidate_responses())
         print(self.chain_result)
         # 根据状态选择如何使用llm
-        if not self.chain_result['finished'] and self.chain_result['current_stage'] == "start":
-            self.chain_result.update(self.chain.invoke({"human": self.chain_result['current']}))
+        if not self.chain_result['finished'] and self.chain_result['current_stage'] in ("start", "asking"):
+            with track_stage("question_generation"):
+                bank_output = self._bank_question()
+                if bank_output is not None:
+                    self.chain_result.update(self.chain.prep_outputs(*bank_output))
+                else:
+                    self.chain_result.update(self.chain.invoke(self._question_inputs()))
             self.chain_result['current_stage'] = "asking"
-        elif not self.chain_result['finished'] and self.chain_result['current_stage'] == "asking":
-            self.chain_result.update(self.chain.invoke({"human": self.chain_result['current']}))
         elif not self.chain_result['finished'] and self.chain_result['current_stage'] == "replying":
             if self.chain_result['current'] == "我的提问结束了，请问你有什么想问我的吗？":
                 self.chain_result['human'] = self.chain_result['current']
                 return self.chain_result
-            self.chain_result = self.answer_candidate_questions(self.chain_result['reply'])
+            self.chain_result.update(self.answer_candidate_questions(self.chain_result['current']))
         else:
             self.chain_result['ai'] = "面试结束"
             self.chain_result['finished'] = True
+        self._end_turn()
+        return self.chain_result
+
+    async def arun_chain(self, user_reply: str = "", callbacks: list = None) -> dict:
+        """
+        异步运行聊天，逻辑与run_chain一致
+        开启推测执行时，按本地评分预测提问方式，评估回答的同时提前生成下一个问题
+        评估结果的提问方式与预测一致时采用并重放缓存的流式输出，否则丢弃
+        被取消或超时时回滚本轮对会话状态的修改，方便客户端重试
+        """
+        snapshot = self._snapshot()
+        speculation = None
+        try:
+            if self._start_turn(user_reply):
+                with track_stage("answer_scoring"):
+                    fast_result = self._fast_result()
+                    if fast_result is not None:
+                        self.chain_result.update(fast_result)
+                    else:
+                        if config.SPECULATIVE_QUESTION:
+                            speculation = self._start_speculation()
+                        self.chain_result.update(await self.aanalyze_candidate_responses())
+            print(self.chain_result)
+            run_config = {"callbacks": callbacks} if callbacks else None
+            if not self.chain_result['finished'] and self.chain_result['current_stage'] in ("start", "asking"):
+                with track_stage("question_generation"):
+                    bank_output = self._bank_question()
+                    if bank_output is not None:
+                        self.chain_result.update(await self.chain.aprep_outputs(*bank_output))
+                    elif speculation is not None and speculation.decision == self.chain_result['current']:
+                        self.chain_result.update(await self._acommit_speculation(speculation, callbacks))
+                        speculation = None
+                    else:
+                        self.chain_result.update(await self.chain.ainvoke(self._question_inputs(), run_config))
+                self.chain_result['current_stage'] = "asking"
+            elif not self.chain_result['finished'] and self.chain_result['current_stage'] == "replying":
+                if self.chain_result['current'] == "我的提问结束了，请问你有什么想问我的吗？":
+                    self.chain_result['human'] = self.chain_result['current']
+                    return self.chain_result
+                self.chain_result.update(
+                    await self.aanswer_candidate_questions(self.chain_result['current'], callbacks=callbacks))
+            else:
+                self.chain_result['ai'] = "面试结束"
+                self.chain_result['finished'] = True
+        except BaseException:
+            self._restore(snapshot)
+            raise
+        finally:
+            if speculation is not None:
+                self._discard_speculation(speculation)
+        self._end_turn()
+        return self.chain_result
+
+    def _start_speculation(self) -> _Speculation:
+        """
+        按本地评分预测评估结果中的提问方式，并开始推测生成下一个问题
+        """
+        score = self._local_score()
+        speculation = _Speculation("请继续深入提问" if score['scoring'] >= config.SCORE_PASS_LINE else "换一个问题继续提问")
+        speculation.task = asyncio.ensure_future(self._aspeculate_question(speculation))
+        return speculation
+
+    async def _aspeculate_question(self, speculation: _Speculation) -> tuple[dict, dict]:
+        """
+        推测执行：在评估结果返回前生成下一个问题，结果暂不写入记忆，流式输出先缓存起来
+        """
+        # 推测任务复制了评估回答时的上下文，llm调用需要重新归类到生成问题
+        with track_stage("question_generation"):
+            inputs = await self.chain.aprep_inputs(self._question_inputs(speculation.decision))
+            prompt = self.chain.prompt.format(**{k: inputs[k] for k in self.chain.prompt.input_variables})
+            speculation.prompt_tokens = count_tokens(prompt)
+            manager = AsyncCallbackManager.configure([speculation.buffer])
+            run_manager = await manager.on_chain_start(None, inputs, name="speculative_question")
+            outputs = await self.chain._acall(inputs, run_manager=run_manager)
+            await run_manager.on_chain_end(outputs)
+        return inputs, outputs
+
+    async def _acommit_speculation(self, speculation: _Speculation, callbacks: list = None) -> dict:
+        """
+        采用推测生成的问题，向客户端重放缓存的流式输出后写入记忆
+        """
+        try:
+            inputs, outputs = await speculation.task
+        except Exception as e:
+            logging.error(f"推测生成问题失败，重新生成: {e}")
+            run_config = {"callbacks": callbacks} if callbacks else None
+            return await self.chain.ainvoke(self._question_inputs(), run_config)
+        if callbacks:
+            await speculation.buffer.replay(callbacks)
+        self.speculation_stats['committed'] += 1
+        get_metrics().inc("speculation_questions_total", "committed")
+        return await self.chain.aprep_outputs(inputs, outputs)
+
+    def _discard_speculation(self, speculation: _Speculation):
+        """
+        丢弃推测生成的问题，已发出的llm调用计入浪费的token数：
+        已完成的按提示词和完整输出计算，中途取消的按提示词和已经输出的部分计算
+        """
+        self.speculation_stats['discarded'] += 1
+        get_metrics().inc("speculation_questions_total", "discarded")
+        task = speculation.task
+        if not task.done():
+            task.cancel()
+            output = speculation.buffer.text()
+        elif not task.cancelled() and task.exception() is None:
+            output = task.result()[1]['text']
+        else:
+            output = speculation.buffer.text()
+        wasted = speculation.prompt_tokens + count_tokens(output) if speculation.buffer.started else 0
+        self.speculation_stats['wasted_tokens'] += wasted
+        get_metrics().inc("speculation_wasted_tokens_total", value=wasted)
+
+    def _wants_new_question(self) -> bool:
+        """
+        是否需要一个新问题（第一个问题或换一个问题），深入提问需要由llm结合上下文生成
+        """
+        return self.chain_result['current_stage'] == "start" or self.chain_result['current'] == "换一个问题继续提问"
+
+    def _bank_questions(self, limit: int) -> list:
+        """
+        按关键词优先级从题库中检索本场面试还没有问过的题目
+        """
+        if self.question_bank is None or not self.keywords:
+            return []
+        asked = [i['human_input'] for i in self.memory.full_history]
+        return self.question_bank.search(self.keywords, limit=limit, exclude=asked)
+
+    def _bank_question(self):
+        """
+        直接使用题库中的题目作为下一个问题，返回chain的(输入, 输出)，题库中没有合适的题目时返回None
+        """
+        if not self._wants_new_question():
+            return None
+        use_bank = config.QUESTION_BANK_FIRST if self.chain_result['current_stage'] == "start" \
+            else config.QUESTION_BANK_FOLLOWING
+        records = self._bank_questions(1) if use_bank else []
+        if not records:
+            return None
+        question, answer = records[0]['human'], records[0]['ai']
+        self.question_bank_stats['served'] += 1
+        return {"human": question}, {"text": json.dumps({"human": question, "ai": answer}, ensure_ascii=False),
+                                     "ai": answer}
+
+    def _question_inputs(self, decision: str = None) -> dict:
+        """
+        生成问题的输入，需要新问题时附上题库中检索到的题目作为参考
+        decision为推测执行预测的提问方式，默认使用评估结果
+        """
+        human = self.chain_result['current'] if decision is None else decision
+        wants_new = self._wants_new_question() if decision is None else decision == "换一个问题继续提问"
+        records = self._bank_questions(config.QUESTION_BANK_CONTEXT) if wants_new else []
+        if records:
+            self.question_bank_stats['context'] += 1
+            references = "\n".join(f"{i + 1}. 问题：{r['human']} 答案：{r['ai']}" for i, r in enumerate(records))
+            human = f"{human}\n\n**题库参考**（参考题目的考察方向和难度，不要原样重复）：\n{references}"
+        return {"human": human}
+
+    def _start_turn(self, user_reply: str) -> bool:
+        """
+        记录应聘者本轮的回答，返回是否需要评估回答
+        """
+        self.chain_result['current'] = user_reply if user_reply != "" else "请生成问题和答案吧！"
+        if self.chain_result['current_stage'] != "asking":
+            return False
+        self.memory.chat_memory.messages.append(AIMessage(content=self.chain_result['current']))
+        self.memory.full_history[-1].update({'reply': user_reply, 'current': self.chain_result['current']})
+        return True
+
+    def _end_turn(self):
         print("--------------------")
         print(self.memory.full_history)
         print(self.memory.buffer)
-        return self.chain_result
+
+    def _snapshot(self) -> dict:
+        """
+        保存一轮对话开始前的会话状态
+        """
+        return {
+            "messages": len(self.memory.chat_memory.messages),
+            "full_history": [dict(i) for i in self.memory.full_history],
+            "summary": (self.memory.moving_summary_buffer, self.memory._summarized),
+            "chain_result": dict(self.chain_result),
+            "analyze_chain_num": self.analyze_chain_num,
+            "analyze_chain_bad_num": self.analyze_chain_bad_num,
+        }
+
+    def _restore(self, snapshot: dict):
+        """
+        回滚到一轮对话开始前的会话状态
+        """
+        del self.memory.chat_memory.messages[snapshot['messages']:]
+        self.memory.full_history = snapshot['full_history']
+        self.memory.moving_summary_buffer, self.memory._summarized = snapshot['summary']
+        self.chain_result = snapshot['chain_result']
+        self.analyze_chain_num = snapshot['analyze_chain_num']
+        self.analyze_chain_bad_num = snapshot['analyze_chain_bad_num']
+
+    def dump_state(self) -> dict:
+        """
+        导出可序列化的会话状态，任意worker都可以通过load_state恢复会话
+        """
+        return {
+            "messages": messages_to_dict(self.memory.chat_memory.messages),
+            "full_history": self.memory.full_history,
+            "summary": [self.memory.moving_summary_buffer, self.memory._summarized],
+            # chain的输出中包含记忆中的消息，无需重复保存
+            "chain_result": {k: v for k, v in self.chain_result.items() if k != self.MEMORY_KEY},
+            "analyze_chain_num": self.analyze_chain_num,
+            "analyze_chain_bad_num": self.analyze_chain_bad_num,
+            "keywords": self.keywords,
+        }
+
+    def load_state(self, state: dict):
+        """
+        从dump_state导出的状态恢复会话，并重建提示词和chain
+        """
+        self.memory.chat_memory.messages = messages_from_dict(state['messages'])
+        self.memory.full_history = state['full_history']
+        self.memory.moving_summary_buffer, self.memory._summarized = state['summary']
+        self.chain_result = state['chain_result']
+        self.analyze_chain_num = state['analyze_chain_num']
+        self.analyze_chain_bad_num = state['analyze_chain_bad_num']
+        self.init_prompt({"new_interview_keywords": state['keywords']})
+        self.init_chain()
 
     def analyze_candidate_responses(self) -> dict:
         """
         1. 通过llm解析判断应聘者的回答适用于的场景（深入提问、换一个问题、结束提问、由ai回答问题、结束面试）
         2. 对应聘者的回答进行ai打分、分析应聘者的回答
         """
-        memory = RunnablePassthrough.assign(history=RunnableLambda(lambda x: self.memory.buffer))
-        self.analyze_chain.steps[0] = memory
-        result = self.analyze_chain.invoke({
+        result = self.analyze_chain.invoke(self._analyze_inputs())
+        self.scoring_stats['llm'] += 1
+        data, invalid = repair_json(self.model, self.template.repair_template, result, self.template.answer_schema)
+        return self._handle_analyze_result(self._complete_analyze_result(data, invalid))
+
+    async def aanalyze_candidate_responses(self) -> dict:
+        """
+        analyze_candidate_responses的异步版本
+        """
+        result = await self.analyze_chain.ainvoke(self._analyze_inputs())
+        self.scoring_stats['llm'] += 1
+        data, invalid = await arepair_json(self.model, self.template.repair_template, result,
+                                           self.template.answer_schema)
+        return self._handle_analyze_result(self._complete_analyze_result(data, invalid))
+
+    def _complete_analyze_result(self, data: dict, invalid: list) -> dict:
+        """
+        补问后仍然缺失的字段：评分和评语由本地评分给出，提问环节默认继续提问
+        """
+        if not invalid:
+            return data
+        self.scoring_stats['fallback'] += 1
+        if 'current_stage' in invalid:
+            data['current_stage'] = "asking"
+        if 'current' in invalid:
+            data['current'] = "换一个问题继续提问"
+        if 'ai_scoring' in invalid or 'ai_comment' in invalid:
+            score = self._local_score()
+            if 'ai_scoring' in invalid:
+                data['ai_scoring'] = score['scoring']
+            if 'ai_comment' in invalid:
+                data['ai_comment'] = self._local_comment(score)
+        return data
+
+    def _fast_result(self):
+        """
+        不调用llm评估应聘者回答：先按规则评估，cheap模式下再用本地评分代替llm，都不适用时返回None
+        """
+        reply, correct_answer = self.memory.full_history[-1]['reply'], self.memory.full_history[-1]['ai_output']
+        result = self.rule_engine.evaluate(reply, correct_answer) if self.rule_engine is not None else None
+        if result is not None:
+            rule = result.pop('rule')
+            self.scoring_stats['rule'][rule] = self.scoring_stats['rule'].get(rule, 0) + 1
+            return self._handle_analyze_result(result)
+        if config.SCORING_MODE != "cheap":
+            return None
+        score = self._local_score()
+        self.scoring_stats['local'] += 1
+        return self._handle_analyze_result({
+            "current_stage": "asking",
+            "current": "请继续深入提问" if score['scoring'] >= config.SCORE_PASS_LINE else "换一个问题继续提问",
+            "ai_scoring": score['scoring'],
+            "ai_comment": self._local_comment(score)
+        })
+
+    def _local_score(self) -> dict:
+        """
+        计算应聘者回答与参考答案的本地评分
+        同一轮可能多次评分（推测执行、hint模式、llm评估失败后的兜底），参考答案只计入一次文档频率
+        """
+        correct_answer = self.memory.full_history[-1]['ai_output']
+        if self._observed_turn != len(self.memory.full_history):
+            self.scorer.observe(correct_answer)
+            self._observed_turn = len(self.memory.full_history)
+        return self.scorer.score(self.memory.full_history[-1]['reply'], correct_answer, self.keyword_matcher)
+
+    @staticmethod
+    def _local_comment(score: dict) -> str:
+        comment = f"与参考答案的相似度为{score['similarity']:.2f}"
+        if score['expected']:
+            comment += f"，覆盖关键词{len(score['covered'])}/{len(score['expected'])}"
+            missing = [w for w in score['expected'] if w not in score['covered']]
+            if missing:
+                comment += f"，未提到{'、'.join(missing[:3])}"
+        return comment
+
+    def _analyze_inputs(self) -> dict:
+        local_hint = ""
+        if config.SCORING_MODE == "hint":
+            score = self._local_score()
+            local_hint = f"**本地预评分**（仅供参考）：{score['scoring']}分，{self._local_comment(score)}"
+        return {
             "answer": self.memory.full_history[-1]['reply'],
             "correct_answer": self.memory.full_history[-1]['ai_output'],
-            "current_stage": self.chain_result['current_stage']
-        })
-        result_result = load_json(result)
+            "current_stage": self.chain_result['current_stage'],
+            "local_hint": local_hint
+        }
+
+    def _handle_analyze_result(self, result_result: dict) -> dict:
+        """
+        根据评估结果更新计数，并按规则判断是否结束提问
+        """
+        if result_result.get('finished'):
+            return result_result
         self.analyze_chain_num += 1
         self.analyze_chain_bad_num = self.analyze_chain_bad_num + 1 if int(
             result_result['ai_scoring']) < 55 else self.analyze_chain_bad_num
@@ -147,55 +517,180 @@ class ChainMasterChat:
             result_result.update({"current": "我的提问结束了，请问你有什么想问我的吗？", "current_stage": "replying"})
         if 'ai_scoring' in result_result:
             self.memory.chat_memory.messages[-1].additional_kwargs['ai_scoring'] = result_result['ai_scoring']
+            self.memory.full_history[-1]['ai_scoring'] = result_result['ai_scoring']
         if 'ai_comment' in result_result:
             self.memory.chat_memory.messages[-1].additional_kwargs['ai_comment'] = result_result['ai_comment']
+            self.memory.full_history[-1]['ai_comment'] = result_result['ai_comment']
         return result_result
 
     def answer_candidate_questions(self, question: str = "我没有什么问题"):
         """
         回答应聘者问题
         """
-        answer_result = self.answer_chain.invoke({"question": question})
+        with track_stage("candidate_qa"):
+            answer_result = self.answer_chain.invoke({"question": question})
+        self.memory.full_history[-1]['stage'] = "replying"
+        print(answer_result)
+        return self._answer_result(answer_result['text'])
+
+    async def aanswer_candidate_questions(self, question: str = "我没有什么问题", callbacks: list = None):
+        """
+        answer_candidate_questions的异步版本
+        """
+        run_config = {"callbacks": callbacks} if callbacks else None
+        with track_stage("candidate_qa"):
+            answer_result = await self.answer_chain.ainvoke({"question": question}, run_config)
+        self.memory.full_history[-1]['stage'] = "replying"
         print(answer_result)
-        result = load_json(answer_result['text'])
+        return self._answer_result(answer_result['text'])
+
+    def _answer_result(self, text: str) -> dict:
+        """
+        解析回答应聘者问题的输出，补问后仍然无法解析时结束问答环节
+        """
+        result, invalid = validate_json(load_json(text), self.template.interview_schema)
+        if invalid:
+            logging.error(f"回答应聘者问题的输出缺少字段{invalid}: {text}")
+            result.setdefault('human', "")
+            if 'ai' in invalid:
+                result['ai'] = "抱歉，这个问题我暂时无法回答。"
+            if 'finished' in invalid:
+                result['finished'] = True
         return result
 
     def analyze_resume(self, db: dict):
         """
         使用顺序连 分析简历 -> 生成问题
         """
-        keywords_out = []
         interview_words_list, job_words_list, keywords_list, job_title_list = set(), set(), set(), set()
         # 对简历进行提取关键词
         if db["file_location"] is not None:
-            interview = PyPDFLoader(db["file_location"])
-            interview_chain = self.template.analyze_prompt | self.model
-            interview_words = interview_chain.invoke({"interview": interview.load()[0].page_content})
-            words_json = load_json(interview_words)
-            interview_words_list = set([o for i in words_json.values() for o in i])
+            with track_stage(KEYWORD_STAGES['interview']):
+                interview_words_list = self._keywords(self.template.analyze_prompt, {
+                    "interview": self.resume_loader.load(db["file_location"], db.get("resume_hash"))})
 
         if db['job_description'] != "":
-            description_chain = self.template.requirement_prompt | self.model
-            job_words = description_chain.invoke({"job_description": db['job_description']})
-            words_json = load_json(job_words)
-            job_words_list = set([o for i in words_json.values() for o in i])
+            with track_stage(KEYWORD_STAGES['job']):
+                job_words_list = self._keywords(self.template.requirement_prompt,
+                                                {"job_description": db['job_description']})
 
         if db['keywords'] != "":
-            keywords_list = set(db['keywords'].split(",") if "," in db['keywords'] else db['keywords'].split("，"))
+            keywords_list = self._split_keywords(db['keywords'])
 
         if db['job_title'] != "":
-            job_chain = self.template.general_template | self.model
-            job_words = job_chain.invoke({"job_title": db['job_title']})
-            words_json = load_json(job_words)
-            job_title_list = set([o for i in words_json.values() for o in i])
-
-        keywords_out.extend(keywords_list)
-        keywords_out.extend(job_words_list & interview_words_list)
-        keywords_out.extend(interview_words_list - job_words_list)
-        keywords_out.extend(job_title_list)
-        keywords_out.extend(job_words_list - interview_words_list)
-
-        db['new_interview_keywords'] = keywords_out
+            with track_stage(KEYWORD_STAGES['job_title']):
+                job_title_list = self._keywords(self.template.general_template, {"job_title": db['job_title']})
+
+        db['new_interview_keywords'] = self._merge_keywords(
+            interview_words_list, job_words_list, keywords_list, job_title_list)
+
+    async def aanalyze_resume(self, db: dict):
+        """
+        analyze_resume的异步版本：简历、岗位要求、岗位名称三路关键词提取并发执行
+        每一路单独超时，超时或出错时该路关键词为空，不影响生成第一个问题
+        """
+        branches = {}
+        if db["file_location"] is not None:
+            branches['interview'] = self._aresume_keywords(db["file_location"], db.get("resume_hash"))
+        if db['job_description'] != "":
+            branches['job'] = self._akeywords(self.template.requirement_prompt,
+                                              {"job_description": db['job_description']})
+        if db['job_title'] != "":
+            branches['job_title'] = self._akeywords(self.template.general_template, {"job_title": db['job_title']})
+        tasks = [asyncio.ensure_future(self._akeywords_branch(name, coro)) for name, coro in branches.items()]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # 一路因排队已满失败或请求被取消时，取消其余几路，释放llm调用名额
+            for task in tasks:
+                task.cancel()
+            raise
+        words = dict(zip(branches.keys(), results))
+
+        keywords_list = self._split_keywords(db['keywords']) if db['keywords'] != "" else set()
+        db['new_interview_keywords'] = self._merge_keywords(
+            words.get('interview', set()), words.get('job', set()), keywords_list, words.get('job_title', set()))
+
+    async def _aresume_keywords(self, file_location: str, file_hash: str = None) -> set:
+        # pdf解析在线程池中执行，避免阻塞事件循环
+        resume = await asyncio.to_thread(self.resume_loader.load, file_location, file_hash)
+        return await self._akeywords(self.template.analyze_prompt, {"interview": resume})
+
+    def _keywords(self, prompt, inputs: dict) -> set:
+        """
+        调用llm提取关键词，相同输入优先从缓存读取
+        """
+        key = self._keywords_cache_key(prompt, inputs)
+        if key is not None:
+            cached = self.keyword_cache.get(key)
+            if cached is not None:
+                return set(cached)
+        words = self._keywords_set((prompt | self.model).invoke(inputs))
+        if key is not None:
+            self.keyword_cache.put(key, sorted(words))
+        return words
+
+    async def _akeywords(self, prompt, inputs: dict) -> set:
+        key = self._keywords_cache_key(prompt, inputs)
+        if key is not None:
+            cached = await asyncio.to_thread(self.keyword_cache.get, key)
+            if cached is not None:
+                return set(cached)
+        words = self._keywords_set(await (prompt | self.model).ainvoke(inputs))
+        if key is not None:
+            await asyncio.to_thread(self.keyword_cache.put, key, sorted(words))
+        return words
+
+    def _keywords_cache_key(self, prompt, inputs: dict):
+        if self.keyword_cache is None:
+            return None
+        model_name = getattr(self.model, "model_name", type(self.model).__name__)
+        return self.keyword_cache.make_key(json.dumps(inputs, ensure_ascii=False, sort_keys=True),
+                                           prompt.template, model_name)
+
+    @staticmethod
+    async def _akeywords_branch(name: str, coro) -> set:
+        """
+        执行一路关键词提取，超时或失败时降级为空集合
+        llm调用排队已满时向上抛出，由接口返回429，不以缺少关键词的状态开始面试
+        """
+        try:
+            with track_stage(KEYWORD_STAGES.get(name, name)):
+                return await asyncio.wait_for(coro, config.KEYWORD_BRANCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"关键词提取超时，已跳过: {name}")
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            logging.error(f"关键词提取失败，已跳过: {name} {e}")
+        return set()
+
+    @staticmethod
+    def _keywords_set(words: str) -> set:
+        words_json = load_json(words)
+        if not isinstance(words_json, dict):
+            record_parse_failure()
+            return set()
+        return set([o for i in words_json.values() if isinstance(i, list) for o in i])
+
+    @staticmethod
+    def _split_keywords(keywords: str) -> set:
+        return set(keywords.split(",") if "," in keywords else keywords.split("，"))
+
+    @staticmethod
+    def _merge_keywords(interview_words_list: set, job_words_list: set, keywords_list: set,
+                        job_title_list: set) -> list:
+        """
+        合并关键词：用户关键词 -> 简历与岗位要求交集 -> 仅简历 -> 岗位名称 -> 仅岗位要求
+        同一组内排序，集合的迭代顺序随进程变化，排序后相同输入在任意进程中得到相同的提示词，磁带可以跨进程回放
+        """
+        keywords_out = []
+        keywords_out.extend(sorted(keywords_list))
+        keywords_out.extend(sorted(job_words_list & interview_words_list))
+        keywords_out.extend(sorted(interview_words_list - job_words_list))
+        keywords_out.extend(sorted(job_title_list))
+        keywords_out.extend(sorted(job_words_list - interview_words_list))
+        return keywords_out
 
 
 if __name__ == "__main__":
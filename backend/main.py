@@ -1,21 +1,54 @@
+import asyncio
 import os
-from typing import List, Dict
+from contextlib import asynccontextmanager, nullcontext
+from typing import Optional
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse
 
 from chain import ChainMasterChat
+from session import SessionManager
+from upload import save_upload, UploadSizeLimitMiddleware
+from report import ReportJobQueue
+from pregenerate import pregenerate
+from base.struct_callback import StreamingFieldCallback
+from base.struct_chain import LLMOutputError
+from base.struct_store import create_store, SessionConflictError
+from base.struct_metrics import get_metrics
+from base.struct_http import pool_stats, close_http_clients
+from base.struct_scheduler import get_llm_scheduler, llm_priority, LLMBusyError, PRIORITY_EXTRACTION
 import uuid
-import shutil
 from datetime import datetime
 import config
 import uvicorn
 
-chat = ChainMasterChat()
-app = FastAPI(title="AI面试助手", description="智能面试解决方案")
-# 模拟数据库存储
-interviews_db = {}
-reports_db = {}
+# 面试信息、对话记录、会话状态和报告信息的存储，多个worker共享
+store = create_store()
+sessions = SessionManager(store)
+
+
+def save_report(job: dict):
+    """
+    报告任务状态变化时保存报告信息
+    """
+    store.put_report(job['report_id'], job)
+
+
+report_jobs = ReportJobQueue(on_update=save_report)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 等待正在生成的报告，并写入缓冲区中的数据
+    report_jobs.shutdown()
+    store.close()
+    await close_http_clients()
+
+
+app = FastAPI(title="AI面试助手", description="智能面试解决方案", lifespan=lifespan)
+# 保存后台任务的引用，避免任务在完成前被回收
+background_tasks = set()
 
 # 创建必要的目录
 os.makedirs(config.UPLOAD_DIR, exist_ok=True)
@@ -26,6 +59,74 @@ os.makedirs(config.REPORT_DIR, exist_ok=True)
 # app.mount("/frontend", StaticFiles(directory="../frontend"), name="frontend")
 
 
+# 在解析表单之前拒绝超过大小限制的简历上传，包括没有Content-Length的分块传输
+app.add_middleware(UploadSizeLimitMiddleware)
+
+
+@app.exception_handler(LLMBusyError)
+async def llm_busy_handler(request: Request, exc: LLMBusyError):
+    """
+    llm调用排队已满或排队超时时返回429，客户端按Retry-After稍后重试
+    """
+    return JSONResponse({"detail": f"服务繁忙，请稍后再试（{exc}）", "retry_after": exc.retry_after},
+                        status_code=429, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(LLMOutputError)
+async def llm_output_handler(request: Request, exc: LLMOutputError):
+    """
+    llm输出补问后仍然缺少问题等必需字段时返回502，本轮对话已回滚，客户端可以重新提交
+    """
+    return JSONResponse({"detail": f"大模型输出不完整，请重试（{exc}）"}, status_code=502)
+
+
+@app.exception_handler(SessionConflictError)
+async def session_conflict_handler(request: Request, exc: SessionConflictError):
+    """
+    同一场面试的请求同时在其他worker上处理并先保存时返回409，本地会话已丢弃，客户端重试时从存储恢复
+    """
+    return JSONResponse({"detail": "面试会话已被其他请求更新，请重试"}, status_code=409)
+
+
+async def run_llm_request(request: Request, coro, timeout: float = config.LLM_TIMEOUT):
+    """
+    在独立任务中执行大模型调用：超时返回504，客户端断开连接时取消调用
+    """
+    task = asyncio.ensure_future(coro)
+
+    async def watch_disconnect():
+        while not task.done():
+            if await request.is_disconnected():
+                task.cancel()
+                return
+            await asyncio.sleep(config.DISCONNECT_POLL_INTERVAL)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        return await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="大模型响应超时")
+    except asyncio.CancelledError:
+        # 只处理客户端断开导致的取消，服务自身被取消时继续向上抛出
+        if asyncio.current_task().cancelling():
+            raise
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
+    finally:
+        watcher.cancel()
+
+
+async def start_chat(chat, interviews: dict) -> dict:
+    """
+    分析简历并生成第一个问题
+    新面试的llm调用排在进行中面试的对话之后
+    """
+    with llm_priority(PRIORITY_EXTRACTION):
+        await chat.aanalyze_resume(interviews)
+        chat.init_prompt(interviews)
+        chat.init_chain()
+        return await chat.arun_chain()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
     """主页面路由，返回前端HTML"""
@@ -36,33 +137,42 @@ async def read_root():
 
 @app.post("/api/start-interview")
 async def start_interview(
+        request: Request,
         resume: UploadFile = File(None),  # 改为可选
         job_description: str = Form(""),  # 改为默认空字符串
         keywords: str = Form(""),  # 新增关键词参数
         job_title: str = Form("")  # 新增岗位名称参数
 ):
     """仅分析简历，不生成问题"""
+    # llm调用排队已满时直接返回429，不保存简历
+    get_llm_scheduler().admit(PRIORITY_EXTRACTION)
     interview_id = str(uuid.uuid4())
 
     # 检查是否有文件上传
-    file_location = None
+    file_location, resume_hash = None, None
     if resume and resume.filename:
-        file_location = f"{config.UPLOAD_DIR}/{interview_id}_{resume.filename}"
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(resume.file, file_object)
+        file_location, resume_hash = await save_upload(resume)
 
-    interviews_db[interview_id] = {
+    interviews = {
         "file_location": file_location,
+        "resume_hash": resume_hash,
         "job_description": job_description,
         "keywords": keywords,
         "job_title": job_title,
+        "created_at": datetime.now().isoformat(),
         # "status": "analyzed"
     }
-    interviews = interviews_db[interview_id]
-    chat.analyze_resume(interviews)
-    chat.init_prompt(interviews)
-    chat.init_chain()
-    questions = chat.run_chain()
+    chat = sessions.create(interview_id)
+    try:
+        async with chat.lock:
+            questions = await run_llm_request(request, start_chat(chat, interviews))
+    except Exception:
+        # 任何原因失败都释放会话，避免留下没有面试记录的会话
+        sessions.remove(interview_id)
+        raise
+    # 保存面试信息（包含提取的关键词）、第一个问题和会话状态
+    store.put_interview(interview_id, interviews)
+    sessions.save(interview_id, chat)
     print(questions)
     return JSONResponse({
         "success": True,
@@ -71,20 +181,42 @@ async def start_interview(
     })
 
 
+@app.post("/api/pregenerate")
+async def pregenerate_questions(request: dict, http_request: Request):
+    """
+    针对岗位批量预生成关键词和面试题，同一岗位之后的面试只需要分析简历
+    题库写入时持有文件锁，多个worker可以同时预生成；系统不支持文件锁时多worker部署下拒绝请求
+    """
+    question_bank = sessions.shared["question_bank"]
+    if config.WORKERS > 1 and question_bank is not None and not question_bank.multiprocess_writable:
+        raise HTTPException(status_code=409, detail="当前系统不支持多进程写入题库，请使用pregenerate.py命令行预生成")
+    job_description = request.get("job_description", "")
+    job_title = request.get("job_title", "")
+    if not job_description and not job_title:
+        raise HTTPException(status_code=400, detail="缺少岗位要求或岗位名称")
+    result = await run_llm_request(http_request, pregenerate(sessions.shared, job_description, job_title),
+                                   config.PREGENERATE_TIMEOUT)
+    return JSONResponse({"success": True, **result})
+
+
 @app.post("/api/submit-answer")
-async def submit_answer(request: dict):
+async def submit_answer(request: dict, http_request: Request):
     """提交面试问题的答案"""
     interview_id = request.get("interview_id")
     question = request.get("question")
     reply = request.get("answer")
     print(interview_id, question, reply)
     """提交面试问题的答案"""
-    if interview_id not in interviews_db:
+    if store.get_interview(interview_id) is None:
         raise HTTPException(status_code=404, detail="面试记录不存在")
+    chat = sessions.get(interview_id)
+    if chat is None:
+        raise HTTPException(status_code=410, detail="面试会话已过期")
 
-    # interviews = interviews_db[interview_id]
     print(interview_id)
-    questions = chat.run_chain(user_reply=reply)
+    async with chat.lock:
+        questions = await run_llm_request(http_request, chat.arun_chain(user_reply=reply))
+        sessions.save(interview_id, chat)
     if reply == "结束":
         questions['finished'] = True
 
@@ -107,45 +239,51 @@ async def finish_interview(request: dict):
             raise HTTPException(status_code=400, detail="缺少面试ID")
 
         # 验证面试记录是否存在
-        if interview_id not in interviews_db:
+        interviews = store.get_interview(interview_id)
+        if interviews is None:
             raise HTTPException(status_code=404, detail="面试记录不存在")
 
-        # 检查是否已经完成
-        if interviews_db[interview_id].get("status") == "completed":
-            return JSONResponse({
-                "success": True,
-                "message": "面试已完成"
-            })
-
-        # 更新状态
-        interviews_db[interview_id]["status"] = "completed"
-        interviews_db[interview_id]["completed_at"] = datetime.now().isoformat()
-
-        # 生成报告ID
-        report_id = str(uuid.uuid4())
-        report_path = f"{config.REPORT_DIR}/{report_id}.pdf"
-
-        # 在实际应用中，这里会生成真实的PDF报告
-        # 现在我们只是创建一个空文件作为示例
-        chat_history: List[Dict[str, str]] = chat.make_pdf(report_path, report_id)
-
-        # 存储报告信息
-        reports_db[report_id] = {
-            "interview_id": interview_id,
-            "report_path": report_path,
-            "created_at": datetime.now().isoformat(),
-            "conversation_history": chat_history
-        }
-
-        # 更新面试记录中的报告ID
-        interviews_db[interview_id]["report_id"] = report_id
+        chat = sessions.get(interview_id)
+        # 持有会话锁，等待进行中的回答处理完成，报告包含最后一轮对话，也不会在回答过程中释放会话
+        async with chat.lock if chat is not None else nullcontext():
+            # 等待期间其他请求可能已经结束了面试
+            interviews = store.get_interview(interview_id) or interviews
+            # 检查是否已经完成
+            if interviews.get("status") == "completed":
+                return JSONResponse({
+                    "success": True,
+                    "message": "面试已完成"
+                })
+            # 会话已释放时使用存储中的对话记录
+            full_history = [dict(i) for i in chat.memory.full_history] if chat else store.get_turns(interview_id)
+            if not full_history:
+                raise HTTPException(status_code=410, detail="面试会话已过期")
+
+            # 生成报告ID
+            report_id = str(uuid.uuid4())
+            report_path = f"{config.REPORT_DIR}/{report_id}.pdf"
+
+            # 在后台生成PDF报告，接口立即返回
+            job = report_jobs.submit(report_id, interview_id, full_history, report_path)
+
+            # 更新状态和面试记录中的报告ID，已完成的面试到期后自动删除
+            interviews["status"] = "completed"
+            interviews["completed_at"] = datetime.now().isoformat()
+            interviews["report_id"] = report_id
+            store.put_interview(interview_id, interviews)
+            store.put_turns(interview_id, full_history)
+            # 报告生成后释放会话占用的内存
+            sessions.remove(interview_id)
 
         return JSONResponse({
             "success": True,
             "message": "面试已完成，报告生成中",
             "report_id": report_id,
+            "status": job['status'],
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -158,20 +296,23 @@ async def get_report(request: dict):
         report_id = request.get("new_interviewId")
 
         # 检查报告是否存在
-        if report_id not in reports_db:
+        report_info = store.get_report(report_id)
+        if report_info is None:
             raise HTTPException(status_code=404, detail="报告不存在")
 
-        report_info = reports_db[report_id]
-
-        # 返回报告数据，包含对话历史和总体评价
+        # 返回报告数据，包含对话历史和总体评价，status为done时可以下载PDF
         return JSONResponse({
             "success": True,
+            "status": report_info["status"],
+            "error": report_info["error"],
             "report": {
                 "conversation_history": report_info.get("conversation_history", []),
                 "overall_feedback": "这是总体评价，根据实际面试表现生成"
             }
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -182,6 +323,11 @@ async def download_report(interview_id: str):
     下载面试报告的PDF文件
     """
     try:
+        # 报告仍在后台生成中
+        report_info = store.get_report(interview_id)
+        if report_info is not None and report_info["status"] in ("queued", "rendering"):
+            raise HTTPException(status_code=409, detail="报告生成中，请稍后再试")
+
         # 构建PDF文件路径
         filename = f"{interview_id}.pdf"
         filepath = os.path.join(config.REPORT_DIR, filename)
@@ -211,20 +357,134 @@ async def service_status():
     return JSONResponse({
         "status": "running",
         "version": "1.0.0",
+        "sessions": len(sessions),
+        "keyword_cache": sessions.shared["keyword_cache"].stats() if sessions.shared["keyword_cache"] else None,
+        "speculation": ChainMasterChat.speculation_stats,
+        "scoring": ChainMasterChat.scoring_stats,
+        "question_bank": dict(ChainMasterChat.question_bank_stats, size=len(sessions.shared["question_bank"])),
+        "prompt_cache": sessions.prompt_cache.stats(),
+        "cassette": sessions.cassette.stats() if sessions.cassette else None,
+        "router": sessions.router.stats(),
+        "http_pool": pool_stats(),
+        "llm_scheduler": get_llm_scheduler().stats(),
         "timestamp": datetime.now().isoformat()
     })
 
 
+@app.get("/api/metrics")
+async def service_metrics():
+    """各面试环节耗时、llm调用耗时和token数等指标，Prometheus文本格式"""
+    return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket端点"""
+    """
+    WebSocket端点
+    客户端发送 {"type": "answer", "interview_id": "...", "answer": "..."}
+    服务端逐段推送下一个问题 {"type": "token", "delta": "..."}，最后推送 {"type": "question", ...}
+    客户端发送 {"type": "subscribe_report", "report_id": "..."}
+    报告生成完成或失败时服务端推送 {"type": "report", "report_id": "...", "status": "...", "error": ...}
+    """
     await websocket.accept()
+    # 正在生成的下一个问题，客户端断开时取消，不再占用llm调用名额
+    answers = set()
     try:
         while True:
-            data = await websocket.receive_text()
-            await websocket.send_text(f"Message text was: {data}")
+            message = await websocket.receive_json()
+            if message.get("type") == "answer":
+                # 在独立任务中生成，接收循环能及时发现客户端断开；同一场面试的回答由会话锁保证按顺序处理
+                task = asyncio.create_task(stream_answer(websocket, message))
+                answers.add(task)
+                task.add_done_callback(answers.discard)
+            elif message.get("type") == "subscribe_report":
+                task = asyncio.create_task(notify_report(websocket, message.get("report_id")))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+            else:
+                await websocket.send_json({"type": "error", "detail": f"不支持的消息类型: {message.get('type')}"})
     except WebSocketDisconnect:
         print("WebSocket disconnected")
+    finally:
+        for task in answers:
+            task.cancel()
+
+
+async def wait_report(report_id: str) -> Optional[dict]:
+    """
+    等待报告生成结束，返回报告信息
+    本worker提交的任务直接等待结果；其他worker提交的任务只能从存储中读取状态，轮询直到生成结束或超时
+    """
+    job = await report_jobs.wait(report_id)
+    if job is not None:
+        return job
+    deadline = asyncio.get_running_loop().time() + config.REPORT_WAIT_TIMEOUT
+    while True:
+        job = store.get_report(report_id)
+        if job is None or job["status"] in ("done", "failed") or asyncio.get_running_loop().time() >= deadline:
+            return job
+        await asyncio.sleep(config.REPORT_POLL_INTERVAL)
+
+
+async def notify_report(websocket: WebSocket, report_id: str):
+    """
+    等待报告生成结束后通知客户端
+    """
+    job = await wait_report(report_id)
+    try:
+        if job is None:
+            await websocket.send_json({"type": "error", "report_id": report_id, "detail": "报告不存在"})
+        else:
+            await websocket.send_json(
+                {"type": "report", "report_id": report_id, "status": job["status"], "error": job["error"]})
+    except Exception as e:
+        print(f"推送报告状态失败: {str(e)}")
+
+
+async def stream_answer(websocket: WebSocket, message: dict):
+    """
+    提交面试问题的答案，并流式返回下一个问题
+    """
+    interview_id = message.get("interview_id")
+    reply = message.get("answer", "")
+    chat = sessions.get(interview_id) if store.get_interview(interview_id) is not None else None
+    if chat is None:
+        await websocket.send_json({"type": "error", "interview_id": interview_id, "detail": "面试记录不存在"})
+        return
+
+    async def send_token(delta: str):
+        await websocket.send_json({"type": "token", "interview_id": interview_id, "delta": delta})
+
+    callback = StreamingFieldCallback(send_token, field="human")
+    try:
+        async with chat.lock:
+            questions = await asyncio.wait_for(chat.arun_chain(user_reply=reply, callbacks=[callback]),
+                                               config.LLM_TIMEOUT)
+            sessions.save(interview_id, chat)
+    except asyncio.TimeoutError:
+        await websocket.send_json({"type": "error", "interview_id": interview_id, "detail": "大模型响应超时"})
+        return
+    except LLMBusyError as e:
+        await websocket.send_json({"type": "error", "interview_id": interview_id,
+                                   "detail": f"服务繁忙，请稍后再试（{e}）", "retry_after": e.retry_after})
+        return
+    except Exception as e:
+        # 大模型调用或解析出错时通知客户端，连接保持打开，客户端可以重新提交
+        print(f"生成下一个问题失败: {interview_id} {str(e)}")
+        try:
+            await websocket.send_json({"type": "error", "interview_id": interview_id,
+                                       "detail": f"生成下一个问题失败: {str(e)}"})
+        except Exception:
+            pass
+        return
+    if reply == "结束":
+        questions['finished'] = True
+    await websocket.send_json({
+        "type": "question",
+        "interview_id": interview_id,
+        "next_question": questions['human'],
+        "finished": questions['finished']
+    })
 
 
 if __name__ == "__main__":
@@ -233,5 +493,5 @@ if __name__ == "__main__":
         host=config.HOST,
         port=config.PORT,
         # reload=config.DEBUG,
-        # workers=config.WORKERS
+        workers=config.WORKERS
     )
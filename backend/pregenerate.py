@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import logging
+
+import config
+from chain import ChainMasterChat
+from base.struct_metrics import track_stage
+from base.struct_scheduler import llm_priority, PRIORITY_BACKGROUND
+from base.utils import load_json
+
+
+async def pregenerate(shared: dict, job_description: str = "", job_title: str = "",
+                      max_keywords: int = config.PREGENERATE_MAX_KEYWORDS,
+                      concurrency: int = config.PREGENERATE_CONCURRENCY) -> dict:
+    """
+    针对一个岗位批量预生成：
+    1. 提取岗位要求、岗位名称的关键词，结果写入关键词缓存，之后的面试只需要分析简历
+    2. 为每个关键词生成面试题和参考答案并收录到题库，之后的面试第一个问题直接从题库中选取
+    llm调用的并发数不超过concurrency，并以后台任务的优先级排队，不影响进行中的面试
+    """
+    with llm_priority(PRIORITY_BACKGROUND):
+        return await _pregenerate(shared, job_description, job_title, max_keywords, concurrency)
+
+
+async def _pregenerate(shared: dict, job_description: str, job_title: str, max_keywords: int,
+                       concurrency: int) -> dict:
+    chat = ChainMasterChat(**shared)
+    if chat.keyword_cache is None:
+        logging.warning("关键词缓存未开启，预生成的关键词不会被之后的面试复用")
+
+    branches = {}
+    if job_description != "":
+        branches['job'] = chat._akeywords(chat.template.requirement_prompt, {"job_description": job_description})
+    if job_title != "":
+        branches['job_title'] = chat._akeywords(chat.template.general_template, {"job_title": job_title})
+    results = await asyncio.gather(*(chat._akeywords_branch(name, coro) for name, coro in branches.items()))
+    words = dict(zip(branches.keys(), results))
+    # 与面试时的关键词顺序一致：岗位名称在前，岗位要求在后
+    keywords = list(dict.fromkeys(sorted(words.get('job_title', set())) + sorted(words.get('job', set()))))
+    keywords = keywords[:max_keywords]
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(keyword: str):
+        async with semaphore:
+            # 使用面试时的提示词，只给出一个关键词，生成的问题与面试时的问题风格一致
+            keyword_chat = ChainMasterChat(**shared)
+            keyword_chat.init_prompt({"new_interview_keywords": [keyword]})
+            try:
+                with track_stage("question_generation"):
+                    message = await asyncio.wait_for(
+                        (keyword_chat.prompt | keyword_chat.chat_model).ainvoke(
+                            {"human": "请生成问题和答案吧！", "chat_history": []}),
+                        config.LLM_TIMEOUT)
+                result = load_json(message.content)
+                return {"keywords": [keyword], "human": result['human'], "ai": result['ai']}
+            except Exception as e:
+                logging.error(f"预生成面试题失败: {keyword} {e}")
+                return None
+
+    records = await asyncio.gather(*(generate(keyword) for keyword in keywords))
+    records = [r for r in records if r is not None]
+    added = await asyncio.to_thread(chat.question_bank.add_many, records) if chat.question_bank is not None else 0
+    return {
+        "keywords": keywords,
+        "generated": len(records),
+        "failed": len(keywords) - len(records),
+        "added": added,
+    }
+
+
+if __name__ == "__main__":
+    # 示例：python pregenerate.py --job-title "Python后端工程师" --job-description-file jd.txt
+    from session import SessionManager
+    from base.struct_store import MemoryStore
+
+    parser = argparse.ArgumentParser(description="针对岗位批量预生成关键词和面试题")
+    parser.add_argument("--job-title", default="")
+    parser.add_argument("--job-description-file", default=None)
+    parser.add_argument("--max-keywords", type=int, default=config.PREGENERATE_MAX_KEYWORDS)
+    parser.add_argument("--concurrency", type=int, default=config.PREGENERATE_CONCURRENCY)
+    args = parser.parse_args()
+
+    job_description = ""
+    if args.job_description_file:
+        with open(args.job_description_file, "r", encoding="utf-8") as f:
+            job_description = f.read()
+    sessions = SessionManager(MemoryStore())
+    print(asyncio.run(pregenerate(sessions.shared, job_description, args.job_title,
+                                  args.max_keywords, args.concurrency)))
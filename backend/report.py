@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from datetime import datetime
+from typing import Callable, Optional
+
+import config
+from base.struct_metrics import track_stage
+from base.struct_report import prepare_render, render_report, report_history
+
+
+class ReportJobQueue:
+    """
+    后台生成面试报告pdf
+    任务状态：queued（排队中） -> rendering（生成中） -> done（已完成）/ failed（失败）
+    每次状态变化都会调用on_update，用于保存报告信息
+    ReportLab渲染是纯Python计算，在进程池中生成，不占用接口所在进程的GIL；
+    同样数量的线程负责排队、更新状态和等待渲染结果，保证rendering状态时已经有空闲的渲染进程
+    """
+
+    def __init__(self, max_workers: int = config.REPORT_WORKERS, on_update: Optional[Callable[[dict], None]] = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report")
+        self._processes = ProcessPoolExecutor(max_workers=max_workers)
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.on_update = on_update
+        # 启动渲染进程并预先注册字体和样式，避免第一份报告承担启动进程和加载字体的开销
+        self._processes.submit(prepare_render)
+
+    def submit(self, report_id: str, interview_id: str, full_history: list, report_path: str) -> dict:
+        """
+        提交报告生成任务，立即返回任务信息
+        """
+        job = {
+            "report_id": report_id,
+            "interview_id": interview_id,
+            "report_path": report_path,
+            "status": "queued",
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+            "conversation_history": report_history(full_history),
+        }
+        self._update(job)
+        with self._lock:
+            future = self._executor.submit(self._render, job, full_history)
+            self._futures[report_id] = future
+        future.add_done_callback(lambda _: self._forget(report_id))
+        return job
+
+    def _render(self, job: dict, full_history: list) -> dict:
+        job = dict(job, status="rendering")
+        self._update(job)
+        try:
+            with track_stage("pdf_render"):
+                self._processes.submit(render_report, job['report_path'], job['interview_id'], full_history).result()
+            job = dict(job, status="done", finished_at=datetime.now().isoformat())
+        except Exception as e:
+            logging.error(f"生成面试报告失败: {job['report_id']} {e}")
+            job = dict(job, status="failed", error=str(e), finished_at=datetime.now().isoformat())
+        self._update(job)
+        return job
+
+    def _update(self, job: dict):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _forget(self, report_id: str):
+        with self._lock:
+            self._futures.pop(report_id, None)
+
+    async def wait(self, report_id: str) -> Optional[dict]:
+        """
+        等待报告生成完成，任务不在队列中（已完成或不存在）时返回None
+        """
+        with self._lock:
+            future = self._futures.get(report_id)
+        if future is None:
+            return None
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self._processes.shutdown(wait=True)
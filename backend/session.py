@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import config
+from base.prompt_template import InterviewPromptTemplate
+from base.struct_callback import PromptCacheCallback
+from base.struct_metrics import StageMetricsCallback
+from base.struct_cache import KeywordCache
+from base.struct_cassette import get_cassette
+from base.struct_router import get_model_router
+from base.struct_resume import ResumeLoader
+from base.struct_score import LexicalScorer
+from base.struct_bank import get_question_bank
+from base.struct_store import InterviewStore, SessionConflictError
+from chain import ChainMasterChat
+
+
+class SessionManager:
+    """
+    面试会话管理：每个interview_id对应一个独立的ChainMasterChat
+    1. 模型客户端和提示词模板在所有会话之间共享，只创建一次
+    2. 会话数量超过上限时淘汰最近最少使用的会话，空闲超过ttl的会话自动过期
+    3. 每轮对话后会话状态保存到共享存储，本地会话不存在或版本落后时从存储恢复，
+       同一场面试的请求可以由任意worker处理，被淘汰的会话也可以恢复
+    """
+
+    def __init__(self, store: InterviewStore, max_sessions: int = config.SESSION_MAX_NUM,
+                 ttl: int = config.SESSION_TTL):
+        self.store = store
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        # 提示词前缀缓存命中统计
+        self.prompt_cache = PromptCacheCallback()
+        # 各面试环节llm调用的耗时和token数
+        callbacks = [self.prompt_cache, StageMetricsCallback()]
+        # 录制或回放llm调用，用于离线复现真实面试
+        self.cassette = get_cassette()
+        # 按面试环节选择模型，首选模型变慢时自动降级；所有调用在进程内共享的调度器中按优先级排队
+        # 与agent等其他入口共用进程内的模型路由，耗时统计和降级状态只有一份
+        self.router = get_model_router()
+        self.shared = {
+            "chat_model": self.router.chat_model(callbacks=callbacks),
+            "model": self.router.completion_model(callbacks=callbacks),
+            "template": InterviewPromptTemplate(),
+            "keyword_cache": KeywordCache(config.KEYWORD_CACHE_PATH, config.KEYWORD_CACHE_MAX_ENTRIES,
+                                          config.KEYWORD_CACHE_MAX_BYTES) if config.KEYWORD_CACHE_ENABLED else None,
+            "resume_loader": ResumeLoader(config.RESUME_CACHE_DIR, config.RESUME_MAX_TOKENS,
+                                          config.RESUME_CACHE_MAX_NUM),
+            "scorer": LexicalScorer(config.SCORE_FULL_SIMILARITY),
+            "question_bank": get_question_bank(),
+        }
+        # interview_id -> (最后访问时间, 会话, 会话状态版本号)
+        self._sessions: OrderedDict[str, tuple[float, ChainMasterChat, Optional[int]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, interview_id: str) -> ChainMasterChat:
+        """
+        为新的面试创建会话
+        """
+        chat = ChainMasterChat(**self.shared)
+        self._put(interview_id, chat, None)
+        return chat
+
+    def get(self, interview_id: str) -> Optional[ChainMasterChat]:
+        """
+        获取面试会话，不存在或已过期时返回None
+        本地会话的版本与存储中的版本一致时直接使用，否则从存储恢复
+        """
+        version = self.store.get_session_version(interview_id)
+        with self._lock:
+            item = self._sessions.get(interview_id)
+            if item is not None:
+                now = time.monotonic()
+                if now - item[0] > self.ttl:
+                    del self._sessions[interview_id]
+                    return None
+                if version is None or version == item[2]:
+                    self._sessions[interview_id] = (now, item[1], item[2])
+                    self._sessions.move_to_end(interview_id)
+                    return item[1]
+        return self._restore(interview_id)
+
+    def _restore(self, interview_id: str) -> Optional[ChainMasterChat]:
+        """
+        从存储中恢复会话
+        """
+        item = self.store.get_session(interview_id)
+        if item is None:
+            return None
+        version, state = item
+        if time.time() - state['updated_at'] > self.ttl:
+            return None
+        chat = ChainMasterChat(**self.shared)
+        chat.load_state(state)
+        self._put(interview_id, chat, version)
+        return chat
+
+    def save(self, interview_id: str, chat: ChainMasterChat):
+        """
+        一轮对话结束后保存对话记录和会话状态
+        会话在其他worker上已经更新时抛出SessionConflictError，并丢弃本地会话，下次访问时从存储恢复
+        """
+        with self._lock:
+            item = self._sessions.get(interview_id)
+        expected = item[2] if item is not None and item[1] is chat else None
+        try:
+            version = self.store.put_session(interview_id, dict(chat.dump_state(), updated_at=time.time()), expected)
+        except SessionConflictError:
+            with self._lock:
+                if interview_id in self._sessions and self._sessions[interview_id][1] is chat:
+                    del self._sessions[interview_id]
+            raise
+        self.store.put_turns(interview_id, chat.memory.full_history)
+        self._put(interview_id, chat, version)
+
+    def remove(self, interview_id: str) -> Optional[ChainMasterChat]:
+        """
+        主动释放面试会话
+        """
+        with self._lock:
+            item = self._sessions.pop(interview_id, None)
+        self.store.delete_session(interview_id)
+        return item[1] if item else None
+
+    def _put(self, interview_id: str, chat: ChainMasterChat, version: Optional[int]):
+        with self._lock:
+            self._sessions[interview_id] = (time.monotonic(), chat, version)
+            self._sessions.move_to_end(interview_id)
+            self._evict()
+
+    def _evict(self):
+        """
+        淘汰过期会话，再按LRU淘汰超出上限的会话（调用方需持有锁）
+        """
+        now = time.monotonic()
+        while self._sessions:
+            interview_id, (last_access, _, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[interview_id]
+
+    def __len__(self):
+        return len(self._sessions)
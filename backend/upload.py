@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import os
+import uuid
+
+from fastapi import UploadFile, HTTPException
+from fastapi.responses import JSONResponse
+
+import config
+
+# pdf文件头
+PDF_MAGIC = b"%PDF-"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    在解析表单之前限制简历上传请求的大小，FastAPI会先把整个表单写入临时文件，save_upload中的检查无法提前中止
+    1. 带Content-Length的请求超过限制时直接返回413，不读取请求体
+    2. 分块传输（没有Content-Length）的请求边接收边统计，超过限制时中止接收并返回413
+    """
+
+    def __init__(self, app, path: str = "/api/start-interview",
+                 max_size: int = config.MAX_FILE_SIZE + config.MAX_FORM_OVERHEAD):
+        self.app = app
+        self.path = path
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            await JSONResponse({"detail": "简历文件过大"}, status_code=413)(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # FastAPI解析请求体时会原样抛出HTTPException，由异常处理返回413
+                    raise HTTPException(status_code=413, detail="简历文件过大")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def save_upload(upload: UploadFile) -> tuple[str, str]:
+    """
+    分块保存上传的简历，返回(文件路径, sha256)
+    1. 写入过程中校验文件类型（文件头）和大小，不合法时中止并删除已写入的部分
+    2. 按内容哈希命名，相同的简历只保存一份
+    此时FastAPI已经接收完整个表单，请求大小的限制由UploadSizeLimitMiddleware在接收时完成
+    """
+    if upload.content_type not in config.ALLOWED_FILE_TYPES:
+        raise HTTPException(status_code=415, detail="仅支持PDF格式的简历")
+
+    tmp_path = os.path.join(config.UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    sha256 = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        while chunk := await upload.read(config.UPLOAD_CHUNK_SIZE):
+            if size == 0 and not chunk.startswith(PDF_MAGIC):
+                raise HTTPException(status_code=415, detail="仅支持PDF格式的简历")
+            size += len(chunk)
+            if size > config.MAX_FILE_SIZE:
+                raise HTTPException(status_code=413, detail="简历文件过大")
+            sha256.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="简历文件为空")
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.remove, tmp_path)
+        raise
+    await asyncio.to_thread(f.close)
+
+    digest = sha256.hexdigest()
+    file_location = os.path.join(config.UPLOAD_DIR, f"{digest}.pdf")
+    if await asyncio.to_thread(os.path.exists, file_location):
+        await asyncio.to_thread(os.remove, tmp_path)
+    else:
+        await asyncio.to_thread(os.replace, tmp_path, file_location)
+    return file_location, digest
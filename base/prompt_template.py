@@ -4,6 +4,10 @@ from langchain_core.messages import SystemMessage, HumanMessage
 
 
 class InterviewPromptTemplate:
+    """
+    提示词模板：固定的指令在前，简历、关键词、历史记录、回答等变化的内容统一放在末尾，
+    使不同面试、同一面试的不同轮次之间共享尽可能长的相同前缀，命中服务端的提示词前缀缓存
+    """
     def __init__(self):
         # 处理简历提示词模板
         self.analyze_template = ""
@@ -18,6 +22,11 @@ class InterviewPromptTemplate:
         # 通用模板
         self.general_template = ""
 
+    # 各提示词输出json的字段及类型，用于校验llm输出，缺失的字段通过repair_template单独补问
+    chat_schema = {"human": str, "ai": str}
+    answer_schema = {"current_stage": ("asking", "replying"), "current": str, "ai_scoring": int, "ai_comment": str}
+    interview_schema = {"human": str, "ai": str, "finished": bool}
+
     @property
     def analyze_prompt(self):
         analyze_template = """
@@ -36,14 +45,14 @@ class InterviewPromptTemplate:
           "硬技能": ["Linux基础", "SQL查询"]
         }}
         
-        **简历内容**：  
-        {interview}
-        
         **要求**：  
         - 直接输出JSON，不添加任何额外文本
         - 关键词必须完全来自简历原文
         - 同类关键词去重（如"Python"和"python"视为重复）
         - 使用示例输出，不使用示例的关键词
+        
+        **简历内容**：  
+        {interview}
         """
         return PromptTemplate(template=analyze_template, input_variables=["interview"])
 
@@ -56,9 +65,6 @@ class InterviewPromptTemplate:
         requirement_template = """
         你是一名AI面试策略引擎，请根据招聘要求生成可提问关键词：
         
-        **招聘要求**：  
-        {job_description}
-        
         **处理规则**：  
         1. **需求解析**：从招聘要求中提取所有关键词
         2. **关键词数量**：至少30个关键词
@@ -72,6 +78,9 @@ class InterviewPromptTemplate:
         - 直接输出JSON，不添加任何额外文本
         - 同类关键词去重（如"Python"和"python"视为重复）
         - 使用示例格式输出的时候，不使用示例自带的关键词
+        
+        **招聘要求**：  
+        {job_description}
         """
         return PromptTemplate(template=requirement_template, input_variables=["job_description", "resume_keywords_json"])
 
@@ -89,9 +98,6 @@ class InterviewPromptTemplate:
             - 严格按照指定的JSON格式输出，不包含任何额外文本
             - 确保问题和答案具有技术深度且专业准确
             
-            **关键词**：  
-            {target_keyword}
-            
             **操作规则**：
             1. **指令响应**：
                - 当收到"深入提问"指令时，基于当前关键词生成更深入的技术问题
@@ -116,6 +122,9 @@ class InterviewPromptTemplate:
             }}
             
             **注意**：只输出JSON格式内容，不添加任何解释性或介绍性文字
+            
+            **关键词**：  
+            {target_keyword}
         """
         return chat_template
 
@@ -162,18 +171,6 @@ class InterviewPromptTemplate:
                     "ai_scoring": "评分",
                     "ai_comment": "评语"
                 }}
-            
-            **历史记录**：
-            {history}
-
-            **应聘者回答**：  
-            {answer}
-
-            **正确答案**：
-            {correct_answer}
-            
-            **面试环节**
-            {current_stage}
 
             **评价规则**：  
             1. **回答质量**：回答是否准确、全面、深入，是否体现了应聘者的技术深度和广度
@@ -181,8 +178,23 @@ class InterviewPromptTemplate:
             3. **问题匹配**：回答是否与提问的关键词相关，是否能够回答出问题的本质
             4. **回答正确性**： 与正确答案是否相似
             4. **综合评价**：给出综合评价
+            
+            **面试环节**
+            {current_stage}
+            
+            **历史记录**：
+            {history}
+
+            **正确答案**：
+            {correct_answer}
+
+            **应聘者回答**：  
+            {answer}
+
+            {local_hint}
         """
-        return PromptTemplate(template=template, input_variables=["answer", "correct_answer", "question_num", "current_stage"])
+        return PromptTemplate(template=template,
+                              input_variables=["answer", "correct_answer", "question_num", "current_stage", "local_hint"])
 
 
     @answer_template.setter
@@ -193,9 +205,6 @@ class InterviewPromptTemplate:
     def interview_template(self):
         template = """
             你是一名资深技术面试官，你可以以成都当地的互联网科技公司的标准水平对应聘者提出的问题作出答复：  
-            **应聘者问题**：  
-            {question}
-            
             **输出规则**：  
             1. **输出格式**：输出格式必须是严格的JSON格式，可被json.loads解析，不添加任何额外文本
             2. 如果应聘者表示没有问题了、不想提问了则finished字段改为True
@@ -205,6 +214,9 @@ class InterviewPromptTemplate:
                 "ai": "你的回答",
                 "finished": false
             }}
+            
+            **应聘者问题**：  
+            {question}
        """
         return PromptTemplate(template=template, input_variables=["question"])
 
@@ -217,16 +229,48 @@ class InterviewPromptTemplate:
         general_template = """
             你是一个面试官，你可以根据招聘岗位生成至少15个适合该岗位的技术关键词。
             
-            **招聘岗位**：
-            {job_title}
-            
             **输出**：  
             {{
                 "keywords": ["关键词1", "关键词2", "关键词3", ...]
             }}
+            
+            **招聘岗位**：
+            {job_title}
         """
         return PromptTemplate(template=general_template, input_variables=["job_title"])
 
     @general_template.setter
     def general_template(self, template):
-        self._general_template = template
\ No newline at end of file
+        self._general_template = template
+
+    @property
+    def summary_template(self):
+        summary_template = """
+            请将面试对话逐步总结为摘要：在已有摘要的基础上补充新的对话内容，返回新的摘要。
+            摘要需要保留已提问的技术关键词、应聘者回答的要点和回答质量，字数控制在300字以内。
+
+            **已有摘要**：
+            {summary}
+
+            **新的对话**：
+            {new_lines}
+
+            **新的摘要**：
+        """
+        return PromptTemplate(template=summary_template, input_variables=["summary", "new_lines"])
+
+    @property
+    def repair_template(self):
+        repair_template = """
+            你之前输出的JSON缺少部分字段或字段值不合法，请只补全下列字段。
+            **输出规则**：
+            1. 输出格式必须是严格的JSON格式，可被json.loads解析，不添加任何额外文本
+            2. 只输出需要补全的字段，字段含义与原输出保持一致
+
+            **需要补全的字段**：
+            {fields}
+
+            **原输出**：
+            {output}
+        """
+        return PromptTemplate(template=repair_template, input_variables=["fields", "output"])
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import config
+
+try:
+    import fcntl
+except ImportError:
+    # Windows下没有fcntl，只能由单个进程写入题库
+    fcntl = None
+
+
+class QuestionBank:
+    """
+    题库：技术关键词 -> 面试题和参考答案的倒排索引
+    1. 题目记录按行追加写入questions.dat，读取时通过mmap按偏移量访问，只有用到的页面才会载入内存
+    2. 倒排索引保存在index.json中，记录每个关键词对应题目的(偏移量, 长度)
+    3. 其他进程更新题库后，按index.json的修改时间自动重新加载
+    4. 写入时持有题库目录下.lock文件的排他锁，多个进程可以同时写入；不支持fcntl的系统只能由单个进程写入
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_path = os.path.join(path, "questions.dat")
+        self.index_path = os.path.join(path, "index.json")
+        self.lock_path = os.path.join(path, ".lock")
+        # 关键词（小写） -> [(偏移量, 长度)]
+        self._index: dict[str, list] = {}
+        # 已收录题目的哈希，用于去重
+        self._hashes: set = set()
+        self._mmap: Optional[mmap.mmap] = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._reload()
+
+    def _reload(self):
+        """
+        重新加载倒排索引并映射题目文件（调用方需持有锁，或在初始化时调用）
+        """
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._index = {k: [tuple(i) for i in v] for k, v in index['keywords'].items()}
+        self._hashes = set(index['hashes'])
+        self._remap()
+        self._mtime = mtime
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) > 0:
+            with open(self.data_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def multiprocess_writable(self) -> bool:
+        return fcntl is not None
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        进程间的写锁，持有期间其他进程不会追加题目或替换索引
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(question: str) -> str:
+        return hashlib.sha256(question.strip().encode("utf-8")).hexdigest()[:16]
+
+    def add_many(self, records: Iterable[dict]) -> int:
+        """
+        批量收录题目，记录格式为{"keywords": [...], "human": "问题", "ai": "参考答案"}，返回新收录的题目数
+        """
+        added = 0
+        with self._lock, self._write_lock():
+            # 持有写锁后重新加载，基于其他进程最新写入的索引追加
+            self._reload()
+            with open(self.data_path, "ab") as f:
+                for record in records:
+                    question_hash = self._hash(record['human'])
+                    keywords = {k.strip().lower() for k in record['keywords'] if k.strip()}
+                    if question_hash in self._hashes or not keywords:
+                        continue
+                    data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                    offset = f.tell()
+                    f.write(data)
+                    for keyword in keywords:
+                        self._index.setdefault(keyword, []).append((offset, len(data)))
+                    self._hashes.add(question_hash)
+                    added += 1
+            if added:
+                # 先写临时文件再替换，避免其他进程读到不完整的索引
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"keywords": self._index, "hashes": sorted(self._hashes)}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.index_path)
+                self._remap()
+                self._mtime = os.stat(self.index_path).st_mtime_ns
+        return added
+
+    def search(self, keywords: Iterable[str], limit: int = 1, exclude: Iterable[str] = ()) -> list:
+        """
+        按关键词顺序检索题目，跳过exclude中已经问过的问题，最多返回limit道
+        """
+        exclude_hashes = {self._hash(q) for q in exclude}
+        results, seen = [], set()
+        with self._lock:
+            self._reload()
+            if self._mmap is None:
+                return results
+            for keyword in keywords:
+                for offset, length in self._index.get(keyword.strip().lower(), ()):
+                    if offset in seen:
+                        continue
+                    seen.add(offset)
+                    record = json.loads(self._mmap[offset:offset + length])
+                    if self._hash(record['human']) in exclude_hashes:
+                        continue
+                    results.append(record)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+@lru_cache(maxsize=None)
+def get_question_bank() -> QuestionBank:
+    """
+    进程内共享的题库
+    """
+    return QuestionBank(config.QUESTION_BANK_DIR)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class KeywordCache:
+    """
+    关键词提取结果的持久化缓存（SQLite）
+    1. 以规范化后的输入文本、提示词版本、模型名称的哈希作为键，相同输入直接命中，不再调用llm
+    2. 超过条目数或总字节数上限时，按最近最少使用淘汰
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS keyword_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_keyword_cache_access ON keyword_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, prompt_template: str, model_name: str) -> str:
+        """
+        生成缓存键，提示词模板的内容作为提示词版本，修改提示词后旧缓存自动失效
+        """
+        normalized = re.sub(r"\s+", " ", text.replace("\r\n", "\n")).strip()
+        prompt_version = hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+        raw = "\0".join([normalized, prompt_version, model_name])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[list]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM keyword_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE keyword_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, keywords: list):
+        value = json.dumps(keywords, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO keyword_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        按最近访问时间淘汰超出上限的条目（调用方需持有锁）
+        """
+        entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM keyword_cache").fetchone()
+        while entries > self.max_entries or total > self.max_bytes:
+            # 每次淘汰超出部分，至少淘汰一条
+            num = max(entries - self.max_entries, 1)
+            rows = self._conn.execute(
+                "SELECT key, size FROM keyword_cache ORDER BY last_access LIMIT ?", (num,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM keyword_cache WHERE key = ?", [(k,) for k, _ in rows])
+            entries -= len(rows)
+            total -= sum(size for _, size in rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM keyword_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
@@ -1,12 +1,134 @@
+import threading
+from typing import Any, Awaitable, Callable
+
 from langchain.memory import ConversationBufferMemory
-from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.base import BaseCallbackHandler, AsyncCallbackHandler
+from langchain_core.callbacks import AsyncCallbackManager
+from langchain_core.outputs import Generation, LLMResult
+
+from base.utils import JsonFieldStreamer
 
 
 class HistoryCallback(BaseCallbackHandler):
+    """
+    记录llm的每次输入和输出
+    """
 
     def __init__(self):
         self.full_history = []
 
-    def on_llm_start(self, ooutputs, **kwargs):
-        if 'response' in ooutputs:
-            self.full_history.append(ooutputs['response'])
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.full_history.extend({"prompt": prompt} for prompt in prompts)
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        self.full_history.extend({"response": g.text} for generations in response.generations for g in generations)
+
+
+class StreamingFieldCallback(AsyncCallbackHandler):
+    """
+    将llm流式输出中指定json字段的内容实时推送给客户端
+    """
+    # 推送失败（如客户端断开）时中断llm调用
+    raise_error = True
+
+    def __init__(self, send: Callable[[str], Awaitable[Any]], field: str = "human"):
+        self.send = send
+        self.field = field
+        self.streamer = JsonFieldStreamer(field)
+
+    async def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.streamer = JsonFieldStreamer(self.field)
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.streamer = JsonFieldStreamer(self.field)
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        delta = self.streamer.feed(token)
+        if delta:
+            await self.send(delta)
+
+
+class TokenBufferCallback(AsyncCallbackHandler):
+    """
+    缓存llm流式输出的token，确定采用输出后再通过replay推送给其他回调
+    """
+
+    def __init__(self):
+        # 每次llm调用输出的token
+        self.runs: list[list[str]] = []
+
+    async def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.runs.append([])
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.runs.append([])
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.runs[-1].append(token)
+
+    @property
+    def started(self) -> bool:
+        return bool(self.runs)
+
+    def text(self) -> str:
+        return "".join(token for tokens in self.runs for token in tokens)
+
+    async def replay(self, callbacks: list):
+        """
+        按原来的顺序把缓存的每次llm调用和token推送给callbacks
+        """
+        manager = AsyncCallbackManager.configure(callbacks)
+        for tokens in self.runs:
+            run_manager, = await manager.on_llm_start({}, [""])
+            for token in tokens:
+                await run_manager.on_llm_new_token(token)
+            await run_manager.on_llm_end(LLMResult(generations=[[Generation(text="".join(tokens))]]))
+
+
+class PromptCacheCallback(BaseCallbackHandler):
+    """
+    统计提示词token数和命中服务端前缀缓存的token数
+    聊天模型流式输出时需要开启stream_usage才能拿到用量信息
+    """
+    # 只做计数，直接在调用线程中执行
+    run_inline = True
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        prompt_tokens, cached_tokens = self._usage(response)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    @staticmethod
+    def _usage(response: LLMResult) -> tuple[int, int]:
+        prompt_tokens, cached_tokens, found = 0, 0, False
+        # 聊天模型的用量在消息的usage_metadata中
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    found = True
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+        if found:
+            return prompt_tokens, cached_tokens
+        # 补全模型的用量在llm_output中
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        return usage.get("prompt_tokens", 0), cached_tokens or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "hit_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            }
@@ -0,0 +1,363 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, Generation, LLMResult
+
+import config
+
+# 计算提示词哈希前合并连续的空白，模板缩进、换行的变化不影响匹配
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class CassetteMissError(KeyError):
+    """
+    回放模式下磁带中没有对应的提示词
+    """
+
+
+class Cassette:
+    """
+    llm调用的录制磁带：每次调用的提示词哈希、输出、耗时、首个token的耗时、流式输出的分段和用量
+    以gzip压缩的json lines保存，录制时逐条追加；同一提示词录制多次时按录制顺序回放
+    录制应由单个进程完成，回放可以多个进程同时读取
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # 提示词哈希 -> [录制记录]
+        self._records: dict[str, list] = {}
+        # 提示词哈希 -> 下一次回放的序号
+        self._cursor: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.recorded = 0
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records.setdefault(record['key'], []).append(record)
+
+    @staticmethod
+    def make_key(kind: str, prompt: str) -> str:
+        normalized = WHITESPACE_PATTERN.sub(" ", prompt).strip()
+        return hashlib.sha256(f"{kind}\n{normalized}".encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        按录制顺序取出记录，回放次数超过录制次数时重复使用最后一条
+        """
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                self.misses += 1
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            self.hits += 1
+            return records[min(index, len(records) - 1)]
+
+    def put(self, key: str, text: str, elapsed: float, first_token: Optional[float] = None,
+            chunks: int = 1, usage: Optional[dict] = None, splits: Optional[list] = None):
+        """
+        splits为流式输出每个片段的长度，回放时按原来的分段输出
+        """
+        record = {"key": key, "text": text, "elapsed": round(elapsed, 4), "chunks": chunks}
+        if splits:
+            record['splits'] = splits
+        if first_token is not None:
+            record['first_token'] = round(first_token, 4)
+        if usage:
+            record['usage'] = usage
+        with self._lock:
+            self._records.setdefault(key, []).append(record)
+            self.recorded += 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # gzip支持多段拼接，追加写入的每一段都能被完整读取
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": sum(len(v) for v in self._records.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+            }
+
+    def __len__(self):
+        return len(self._records)
+
+
+def _split(text: str, chunks: int) -> list:
+    size = max(1, -(-len(text) // max(chunks, 1)))
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _pieces(record: dict) -> list:
+    """
+    按录制时的分段切分输出，没有分段信息的记录按片段数平均切分
+    """
+    splits = record.get('splits')
+    if not splits:
+        return _split(record['text'], record['chunks'])
+    pieces, start = [], 0
+    for size in splits:
+        pieces.append(record['text'][start:start + size])
+        start += size
+    if start < len(record['text']):
+        pieces.append(record['text'][start:])
+    return pieces
+
+
+class _CassetteMixin:
+    """
+    录制模式调用被包装的模型并写入磁带；回放模式从磁带读取输出，按time_scale缩放原始耗时
+    回放时磁带中没有的提示词：strict为True时抛出CassetteMissError，否则调用被包装的模型
+    """
+
+    def _replay_delays(self, record: dict) -> tuple[float, float]:
+        """
+        返回(首个token前的等待时间, 之后每个片段的间隔)
+        """
+        first_token = record.get('first_token', record['elapsed']) * self.time_scale
+        rest = max(record['elapsed'] * self.time_scale - first_token, 0.0)
+        return first_token, rest / max(record['chunks'] - 1, 1)
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        if self.mode != "replay":
+            return None
+        record = self.cassette.get(key)
+        if record is None and (self.strict or self.inner is None):
+            raise CassetteMissError(f"磁带中没有对应的llm调用: {key}")
+        return record
+
+    @property
+    def model_name(self) -> str:
+        # 关键词缓存等按模型名区分结果，与被包装的模型保持一致
+        return getattr(self.inner, "model_name", None) or self._llm_type
+
+
+class CassetteChatModel(_CassetteMixin, BaseChatModel):
+    """
+    可录制、回放的聊天模型，包装ChatOpenAI等聊天模型
+    streaming为True时invoke也走流式输出：录制真实的分段和首个token的耗时，回放时逐段触发on_llm_new_token
+    """
+    inner: Optional[BaseChatModel] = None
+    cassette: Any = None
+    mode: str = "replay"
+    time_scale: float = 1.0
+    strict: bool = True
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-chat"
+
+    @staticmethod
+    def _key(messages: List[BaseMessage]) -> str:
+        return Cassette.make_key("chat", "\n".join(f"{m.type}: {m.content}" for m in messages))
+
+    @staticmethod
+    def _message(record: dict, chunk: bool = False, text: Optional[str] = None):
+        cls = AIMessageChunk if chunk else AIMessage
+        return cls(content=record['text'] if text is None else text, usage_metadata=record.get('usage'))
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            chunks = []
+            for chunk in self._stream(messages, stop=stop, **kwargs):
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                chunks.append(chunk)
+            return generate_from_stream(iter(chunks))
+        key = self._key(messages)
+        record = self._lookup(key)
+        if record is not None:
+            time.sleep(record['elapsed'] * self.time_scale)
+            return ChatResult(generations=[ChatGeneration(message=self._message(record))])
+        start = time.perf_counter()
+        result = self.inner._generate(messages, stop=stop, **kwargs)
+        if self.mode == "record":
+            message = result.generations[0].message
+            self.cassette.put(key, message.content, time.perf_counter() - start,
+                              usage=getattr(message, "usage_metadata", None))
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            chunks = []
+            async for chunk in self._astream(messages, stop=stop, **kwargs):
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                chunks.append(chunk)
+            return generate_from_stream(iter(chunks))
+        key = self._key(messages)
+        record = self._lookup(key)
+        if record is not None:
+            await asyncio.sleep(record['elapsed'] * self.time_scale)
+            return ChatResult(generations=[ChatGeneration(message=self._message(record))])
+        start = time.perf_counter()
+        result = await self.inner._agenerate(messages, stop=stop, **kwargs)
+        if self.mode == "record":
+            message = result.generations[0].message
+            self.cassette.put(key, message.content, time.perf_counter() - start,
+                              usage=getattr(message, "usage_metadata", None))
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        key = self._key(messages)
+        record = self._lookup(key)
+        if record is not None:
+            first_token, interval = self._replay_delays(record)
+            pieces = _pieces(record)
+            time.sleep(first_token)
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(interval)
+                last = i == len(pieces) - 1
+                yield ChatGenerationChunk(message=AIMessageChunk(
+                    content=piece, usage_metadata=record.get('usage') if last else None))
+            return
+        start, first_token, parts, usage = time.perf_counter(), None, [], None
+        for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+            if first_token is None and chunk.text:
+                first_token = time.perf_counter() - start
+            parts.append(chunk.text)
+            usage = getattr(chunk.message, "usage_metadata", None) or usage
+            yield chunk
+        if self.mode == "record":
+            splits = [len(p) for p in parts if p]
+            self.cassette.put(key, "".join(parts), time.perf_counter() - start, first_token, len(splits), usage,
+                              splits)
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._key(messages)
+        record = self._lookup(key)
+        if record is not None:
+            first_token, interval = self._replay_delays(record)
+            pieces = _pieces(record)
+            await asyncio.sleep(first_token)
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(interval)
+                last = i == len(pieces) - 1
+                yield ChatGenerationChunk(message=AIMessageChunk(
+                    content=piece, usage_metadata=record.get('usage') if last else None))
+            return
+        start, first_token, parts, usage = time.perf_counter(), None, [], None
+        async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+            if first_token is None and chunk.text:
+                first_token = time.perf_counter() - start
+            parts.append(chunk.text)
+            usage = getattr(chunk.message, "usage_metadata", None) or usage
+            yield chunk
+        if self.mode == "record":
+            splits = [len(p) for p in parts if p]
+            self.cassette.put(key, "".join(parts), time.perf_counter() - start, first_token, len(splits), usage,
+                              splits)
+
+
+class CassetteLLM(_CassetteMixin, BaseLLM):
+    """
+    可录制、回放的补全模型，包装OpenAI等补全模型
+    """
+    inner: Optional[BaseLLM] = None
+    cassette: Any = None
+    mode: str = "replay"
+    time_scale: float = 1.0
+    strict: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-llm"
+
+    def _generate(self, prompts: List[str], stop=None, run_manager=None, **kwargs: Any) -> LLMResult:
+        generations, usage = [], {}
+        for prompt in prompts:
+            key = Cassette.make_key("llm", prompt)
+            record = self._lookup(key)
+            if record is not None:
+                time.sleep(record['elapsed'] * self.time_scale)
+            else:
+                start = time.perf_counter()
+                result = self.inner._generate([prompt], stop=stop, **kwargs)
+                record = self._record(key, result, time.perf_counter() - start)
+            generations.append([Generation(text=record['text'])])
+            self._add_usage(usage, record.get('usage'))
+        return LLMResult(generations=generations, llm_output={"token_usage": usage} if usage else None)
+
+    async def _agenerate(self, prompts: List[str], stop=None, run_manager=None, **kwargs: Any) -> LLMResult:
+        generations, usage = [], {}
+        for prompt in prompts:
+            key = Cassette.make_key("llm", prompt)
+            record = self._lookup(key)
+            if record is not None:
+                await asyncio.sleep(record['elapsed'] * self.time_scale)
+            else:
+                start = time.perf_counter()
+                result = await self.inner._agenerate([prompt], stop=stop, **kwargs)
+                record = self._record(key, result, time.perf_counter() - start)
+            generations.append([Generation(text=record['text'])])
+            self._add_usage(usage, record.get('usage'))
+        return LLMResult(generations=generations, llm_output={"token_usage": usage} if usage else None)
+
+    def _record(self, key: str, result: LLMResult, elapsed: float) -> dict:
+        text = result.generations[0][0].text
+        usage = (result.llm_output or {}).get("token_usage") or None
+        if self.mode == "record":
+            self.cassette.put(key, text, elapsed, usage=usage)
+        return {"text": text, "usage": usage}
+
+    @staticmethod
+    def _add_usage(total: dict, usage: Optional[dict]):
+        for name, value in (usage or {}).items():
+            if isinstance(value, (int, float)):
+                total[name] = total.get(name, 0) + value
+
+
+def wrap_cassette(model, cassette: Cassette, mode: str, time_scale: float = 1.0, strict: bool = True):
+    """
+    用磁带包装模型，mode为off时原样返回
+    回调转移到包装后的模型上，避免录制时提示词缓存、指标等回调被重复触发
+    """
+    if mode == "off":
+        return model
+    inner = model.model_copy(update={"callbacks": None})
+    if isinstance(model, BaseChatModel):
+        return CassetteChatModel(inner=inner, cassette=cassette, mode=mode, time_scale=time_scale, strict=strict,
+                                 streaming=getattr(model, "streaming", False), callbacks=model.callbacks)
+    return CassetteLLM(inner=inner, cassette=cassette, mode=mode, time_scale=time_scale, strict=strict,
+                       callbacks=model.callbacks)
+
+
+@lru_cache(maxsize=None)
+def get_cassette() -> Optional[Cassette]:
+    """
+    进程内共享的磁带，CASSETTE_MODE为off时返回None
+    """
+    return Cassette(config.CASSETTE_PATH) if config.CASSETTE_MODE != "off" else None
+
+
+def apply_cassette(model):
+    """
+    按config中的配置用共享的磁带包装模型，未开启录制/回放时原样返回
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return model
+    return wrap_cassette(model, cassette, config.CASSETTE_MODE, config.CASSETTE_TIME_SCALE, config.CASSETTE_STRICT)
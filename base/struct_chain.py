@@ -1,26 +1,133 @@
+import asyncio
+import json
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from langchain.chains.llm import LLMChain
+from langchain_core.prompts import PromptTemplate
 
-from base.utils import load_json
+from base.struct_metrics import record_parse_failure
+from base.struct_scheduler import LLMBusyError
+from base.utils import load_json, validate_json
+
+# schema中的类型在补问提示词中的说明
+SCHEMA_TYPE_NAMES = {str: "字符串", int: "整数", bool: "布尔值true/false"}
+# 写入记忆必需的字段：human为问题，ai为参考答案或回答
+MEMORY_FIELDS = ("human", "ai")
+
+
+class LLMOutputError(Exception):
+    """
+    llm输出补问后仍然缺少必需的字段，invalid为缺失的字段
+    """
+
+    def __init__(self, message: str, invalid: list):
+        super().__init__(message)
+        self.invalid = invalid
+
+
+def _repair_inputs(output: str, schema: dict, invalid: list) -> dict:
+    fields = []
+    for field in invalid:
+        expected = schema[field]
+        if isinstance(expected, tuple):
+            fields.append(f"{field}: {'、'.join(expected)}中的一个")
+        else:
+            fields.append(f"{field}: {SCHEMA_TYPE_NAMES.get(expected, expected.__name__)}")
+    return {"fields": "\n".join(fields), "output": output}
+
+
+def _merge_repair(data: dict, content, schema: dict, invalid: list) -> tuple[dict, list]:
+    # 只采用补问得到的缺失字段，已经合法的字段保持不变
+    repaired = load_json(getattr(content, "content", content)) or {}
+    data = dict(data, **{k: repaired[k] for k in invalid if k in repaired})
+    return validate_json(data, schema)
+
+
+def repair_json(llm, template: PromptTemplate, output: str, schema: dict) -> tuple[dict, list]:
+    """
+    解析并校验llm输出的json，缺失或不合法的字段单独补问一次llm，只输出这几个字段
+    返回(数据, 补问后仍然缺失的字段)
+    """
+    data, invalid = validate_json(load_json(output), schema)
+    if not invalid:
+        return data, invalid
+    record_parse_failure()
+    logging.warning(f"llm输出缺少字段{invalid}，重新询问：{output}")
+    try:
+        content = (template | llm).invoke(_repair_inputs(output, schema, invalid))
+    except LLMBusyError:
+        # 排队已满时直接返回429，不当作补问失败
+        raise
+    except Exception as e:
+        logging.error(f"补全llm输出字段失败: {e}")
+        return data, invalid
+    return _merge_repair(data, content, schema, invalid)
+
+
+async def arepair_json(llm, template: PromptTemplate, output: str, schema: dict) -> tuple[dict, list]:
+    """
+    repair_json的异步版本
+    """
+    data, invalid = validate_json(load_json(output), schema)
+    if not invalid:
+        return data, invalid
+    record_parse_failure()
+    logging.warning(f"llm输出缺少字段{invalid}，重新询问：{output}")
+    try:
+        content = await (template | llm).ainvoke(_repair_inputs(output, schema, invalid))
+    except (LLMBusyError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        logging.error(f"补全llm输出字段失败: {e}")
+        return data, invalid
+    return _merge_repair(data, content, schema, invalid)
 
 
 class CustomLLMChain(LLMChain):
-    """自定义LLMChain，允许在保存到内存前修改输出"""
+    """
+    自定义LLMChain，允许在保存到内存前修改输出
+    设置output_fields和repair_prompt时，按schema校验输出，缺失的字段单独补问llm后再写回输出
+    补问后仍然缺少human或ai字段时抛出LLMOutputError，不写入记忆，其余字段由调用方补全
+    """
 
-    def _call(self, inputs: Dict[str, Any]) -> Dict[str, str]:
+    output_fields: Optional[dict] = None
+    repair_prompt: Optional[PromptTemplate] = None
+
+    def _call(self, inputs: Dict[str, Any], run_manager=None) -> Dict[str, str]:
         # 调用父类方法获取原始输出
-        result = super()._call(inputs)
+        result = super()._call(inputs, run_manager=run_manager)
+        if self.output_fields is not None and self.repair_prompt is not None:
+            data, invalid = repair_json(self.llm, self.repair_prompt, result[self.output_key], self.output_fields)
+            self._check_invalid(invalid, result)
+            result[self.output_key] = json.dumps(data, ensure_ascii=False)
+        return self._update_output(inputs, result)
+
+    async def _acall(self, inputs: Dict[str, Any], run_manager=None) -> Dict[str, str]:
+        result = await super()._acall(inputs, run_manager=run_manager)
+        if self.output_fields is not None and self.repair_prompt is not None:
+            data, invalid = await arepair_json(self.llm, self.repair_prompt, result[self.output_key],
+                                               self.output_fields)
+            self._check_invalid(invalid, result)
+            result[self.output_key] = json.dumps(data, ensure_ascii=False)
+        return self._update_output(inputs, result)
 
+    def _check_invalid(self, invalid: list, result: Dict[str, str]):
+        missing = [field for field in invalid if field in MEMORY_FIELDS]
+        if missing:
+            logging.error(f"对话模型补问后仍然缺少字段{missing}: {result}")
+            raise LLMOutputError(f"大模型输出缺少字段{missing}", missing)
+
+    def _update_output(self, inputs: Dict[str, Any], result: Dict[str, str]) -> Dict[str, str]:
         # 修改输出结果
         modified_output = self.modify_output(result[self.output_key])
-        try:
-            # 使用修改后的输出更新结果
-            inputs['human'] = modified_output['human']
-            result['ai'] = modified_output['ai']
-        except Exception as e:
-            logging.error(f"对话模型生成问题错误: {result}")
+        if not isinstance(modified_output, dict):
+            modified_output = {}
+        # 缺少问题时不能把输入的提问指令当作问题写入记忆
+        self._check_invalid([field for field in MEMORY_FIELDS if field not in modified_output], result)
+        # 使用修改后的输出更新结果
+        inputs['human'] = modified_output['human']
+        result['ai'] = modified_output['ai']
         return result
 
     def modify_output(self, output: str) -> str:
@@ -34,4 +141,3 @@ class CustomLLMChain(LLMChain):
             return json_data
         except Exception as e:
             logging.error(f"对话模型缺少关键词导致输出错误！！！{output}")
-
@@ -0,0 +1,132 @@
+import importlib.util
+import logging
+import time
+from functools import lru_cache
+
+import httpx
+
+import config
+from base.struct_metrics import get_metrics
+
+
+def _pool_state(transport) -> dict:
+    """
+    读取连接池中活跃、空闲的连接数和等待连接的请求数
+    """
+    pool = getattr(transport, "_pool", None)
+    if pool is None:
+        return {}
+    connections = list(getattr(pool, "connections", ()))
+    idle = sum(1 for c in connections if c.is_idle())
+    queued = sum(1 for r in list(getattr(pool, "_requests", ())) if r.is_queued())
+    return {"active": len(connections) - idle, "idle": idle, "queued": queued}
+
+
+class _PoolTracer:
+    """
+    通过httpcore的trace扩展记录从发出请求到拿到连接的等待时间：
+    复用连接时第一个事件是发送请求头，新建连接时第一个事件是建立TCP连接
+    """
+
+    def __init__(self, client: str, previous=None):
+        self.client = client
+        self.previous = previous
+        self.start = time.perf_counter()
+        self.acquired = False
+
+    def _event(self, name: str):
+        if not self.acquired:
+            self.acquired = True
+            get_metrics().observe("http_pool_wait_seconds", time.perf_counter() - self.start, self.client)
+        if name == "connection.connect_tcp.started":
+            get_metrics().inc("http_connections_opened_total", self.client)
+
+    def __call__(self, name: str, info: dict):
+        self._event(name)
+        if self.previous is not None:
+            self.previous(name, info)
+
+
+class _AsyncPoolTracer(_PoolTracer):
+
+    async def __call__(self, name: str, info: dict):
+        self._event(name)
+        if self.previous is not None:
+            await self.previous(name, info)
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """
+    记录连接池等待时间和新建连接数的同步传输层
+    """
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = _PoolTracer("sync", request.extensions.get("trace"))
+        return super().handle_request(request)
+
+
+class AsyncPooledTransport(httpx.AsyncHTTPTransport):
+    """
+    记录连接池等待时间和新建连接数的异步传输层
+    """
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = _AsyncPoolTracer("async", request.extensions.get("trace"))
+        return await super().handle_async_request(request)
+
+
+def http2_available() -> bool:
+    # HTTP/2需要安装h2（pip install httpx[http2]），未安装时使用HTTP/1.1
+    return config.HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+
+@lru_cache(maxsize=None)
+def get_http_clients() -> tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    进程内共享的同步、异步http客户端，所有llm客户端复用同一个连接池，避免每次调用重新建立连接和TLS握手
+    异步客户端的连接绑定在创建它们的事件循环上，服务进程内只有一个事件循环
+    """
+    limits = httpx.Limits(max_connections=config.HTTP_MAX_CONNECTIONS,
+                          max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                          keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY)
+    http2 = http2_available()
+    if config.HTTP2_ENABLED and not http2:
+        logging.info("未安装h2，llm客户端使用HTTP/1.1")
+    timeout = httpx.Timeout(config.LLM_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+    sync_transport = PooledTransport(limits=limits, http2=http2)
+    async_transport = AsyncPooledTransport(limits=limits, http2=http2)
+    clients = (httpx.Client(transport=sync_transport, timeout=timeout),
+               httpx.AsyncClient(transport=async_transport, timeout=timeout))
+    get_metrics().gauge("http_pool_connections", "llm客户端连接池的连接数和等待连接的请求数", ("client", "state"),
+                        lambda: {(name, state): value
+                                 for name, transport in (("sync", sync_transport), ("async", async_transport))
+                                 for state, value in _pool_state(transport).items()})
+    get_metrics().gauge("http_pool_max_connections", "llm客户端连接池的最大连接数", (),
+                        lambda: {(): config.HTTP_MAX_CONNECTIONS})
+    return clients
+
+
+def pool_stats() -> dict:
+    """
+    连接池当前状态，未创建共享客户端时返回空字典
+    """
+    if get_http_clients.cache_info().currsize == 0:
+        return {}
+    sync_client, async_client = get_http_clients()
+    return {
+        "http2": http2_available(),
+        "max_connections": config.HTTP_MAX_CONNECTIONS,
+        "sync": _pool_state(sync_client._transport),
+        "async": _pool_state(async_client._transport),
+    }
+
+
+async def close_http_clients():
+    """
+    关闭共享的http客户端，服务退出时调用
+    """
+    if get_http_clients.cache_info().currsize == 0:
+        return
+    sync_client, async_client = get_http_clients()
+    sync_client.close()
+    await async_client.aclose()
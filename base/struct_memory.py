@@ -1,127 +1,160 @@
-from datetime import datetime
-from typing import Any
+import asyncio
+import contextvars
+import logging
+from typing import Any, Optional
 
 from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryMemory, ConversationBufferMemory
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import BasePromptTemplate
 
-import config
+from base.struct_metrics import track_stage
+from base.struct_report import render_report
+from base.struct_scheduler import llm_priority, PRIORITY_BACKGROUND
+from base.utils import count_tokens
 
 
 class EnhanceConversationMemory(ConversationBufferMemory):
+    """
+    对话记忆：chat_history用于提示词，full_history保存完整的问答记录用于生成报告
+    设置max_token_limit后，chat_history超出token预算时将较早的对话折叠为摘要，
+    最近keep_turns轮问答始终原样保留
+    异步保存时摘要在后台生成，不占用本轮对话的耗时，生成完成前提示词中暂时保留未折叠的消息
+    """
+    llm: Optional[BaseLanguageModel] = None
+    max_token_limit: Optional[int] = None
+    keep_turns: int = 2
+    summary_prompt: Optional[BasePromptTemplate] = None
+    moving_summary_buffer: str = ""
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._full_history: list = list()
+        # chat_memory.messages中已折叠进摘要的消息数
+        self._summarized: int = 0
+        # 后台生成摘要的任务
+        self._summary_task: Optional[asyncio.Task] = None
+
+    def _get_input_output(self, inputs: dict[str, Any], outputs: dict[str, str]) -> tuple[str, str]:
+        # 对话链的输入为human，回答应聘者问题的链输入为question
+        human_input = inputs.get("human", inputs.get("question", ""))
+        ai_output = outputs.get(self.output_key, outputs.get("text", ""))
+        return human_input, ai_output
 
     def save_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
+        # 同步调用（脚本、离线任务）直接生成摘要
+        pending = self._prepare_summary(inputs, outputs)
+        if pending is not None:
+            end, summary_inputs = pending
+            self._apply_summary(end, self._summary_chain().invoke(summary_inputs))
+
+    async def asave_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
+        # 与同步版本写入记忆的方式一致，摘要在后台生成；上一次摘要还没有完成时等下一轮再折叠
+        if self._summary_task is not None and not self._summary_task.done():
+            self._save_context(inputs, outputs)
+            return
+        pending = self._prepare_summary(inputs, outputs)
+        if pending is not None:
+            end, summary_inputs = pending
+            # 不继承本轮对话的回调和优先级，避免摘要的输出推送给客户端
+            self._summary_task = asyncio.get_running_loop().create_task(
+                self._asummarize(self._summarized, end, summary_inputs), context=contextvars.Context())
+
+    async def _asummarize(self, start: int, end: int, summary_inputs: dict):
+        folded = self.chat_memory.messages[start:end]
+        try:
+            with track_stage("memory_summary"), llm_priority(PRIORITY_BACKGROUND):
+                summary = await self._summary_chain().ainvoke(summary_inputs)
+        except Exception as e:
+            logging.error(f"生成对话摘要失败，下一轮重新折叠: {e}")
+            return
+        # 生成期间本轮对话被回滚或已经折叠过时，丢弃这次摘要
+        current = self.chat_memory.messages[start:end]
+        if self._summarized == start and len(current) == len(folded) and all(
+                a is b for a, b in zip(current, folded)):
+            self._apply_summary(end, summary)
+
+    def _prepare_summary(self, inputs: dict[str, Any], outputs: dict[str, str]) -> Optional[tuple[int, dict]]:
+        """
+        保存本轮对话，超出token预算时返回(折叠后第一条保留消息的下标, 生成摘要的输入)，不需要折叠时返回None
+        """
+        self._save_context(inputs, outputs)
+        end = self._summarize_end()
+        if end <= self._summarized:
+            return None
+        new_lines = self._buffer_as_str(self.chat_memory.messages[self._summarized:end])
+        return end, {"summary": self.moving_summary_buffer, "new_lines": new_lines}
+
+    def _apply_summary(self, end: int, summary: str):
+        self.moving_summary_buffer = summary
+        self._summarized = end
+
+    def _save_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
         super().save_context(inputs, outputs)
 
         # 同时保存到完整历史
-        human_input = list(inputs.values())[0] if inputs else ""
-        ai_output = list(outputs.values())[1] if outputs else ""
+        human_input, ai_output = self._get_input_output(inputs, outputs)
 
         self._full_history.append({"human_input": human_input, "ai_output": ai_output})
         del self.chat_memory.messages[-1]
 
+    def _summarize_end(self) -> int:
+        """
+        计算需要折叠进摘要的消息范围，返回折叠后第一条保留消息的下标
+        """
+        messages = self.chat_memory.messages
+        if not self.max_token_limit or self.llm is None:
+            return self._summarized
+        tokens = sum(count_tokens(m.content) for m in messages[self._summarized:])
+        # 每一轮从面试官的消息开始，不一定有应聘者的回答（如末尾尚未回答的问题、回答应聘者问题的环节），
+        # 按消息类型划分轮次；最近keep_turns轮和末尾尚未回答的消息原样保留
+        starts = [i for i in range(self._summarized, len(messages)) if messages[i].type == "human"]
+        keep = self.keep_turns + (1 if messages and messages[-1].type == "human" else 0)
+        if not keep:
+            keep_from = len(messages)
+        else:
+            keep_from = starts[-keep] if len(starts) >= keep else self._summarized
+        end = self._summarized
+        while tokens > self.max_token_limit and end < keep_from:
+            tokens -= count_tokens(messages[end].content)
+            end += 1
+            # 不拆开同一轮的消息
+            while end < keep_from and messages[end].type != "human":
+                tokens -= count_tokens(messages[end].content)
+                end += 1
+        return end
+
+    def _summary_chain(self):
+        return self.summary_prompt | self.llm | StrOutputParser()
+
+    def _visible_messages(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """
+        用于提示词的对话记录：摘要 + 未折叠的消息
+        """
+        if not self.moving_summary_buffer:
+            return messages
+        return [SystemMessage(content=f"此前的面试摘要：{self.moving_summary_buffer}")] + messages[self._summarized:]
+
+    @property
+    def buffer_as_str(self) -> str:
+        return self._buffer_as_str(self._visible_messages(self.chat_memory.messages))
+
+    async def abuffer_as_str(self) -> str:
+        return self._buffer_as_str(self._visible_messages(await self.chat_memory.aget_messages()))
+
+    @property
+    def buffer_as_messages(self) -> list[BaseMessage]:
+        return self._visible_messages(self.chat_memory.messages)
+
+    async def abuffer_as_messages(self) -> list[BaseMessage]:
+        return self._visible_messages(await self.chat_memory.aget_messages())
+
     def save_history(self, path: str, interview_id=None):
         """
         把历史记录存入pdf中
         """
-        try:
-            # 注册中文字体
-            # 请确保系统中有SimHei.ttf或其他中文字体文件
-            # 如果没有，可以从Windows系统复制或下载中文字体文件
-            pdfmetrics.registerFont(TTFont('微软雅黑', config.TTF_FILE))
-            pdfmetrics.registerFont(TTFont('SimHei', 'SimHei.ttf'))
-
-            # 获取聊天历史
-            chat_history = self.memory.full_history
-
-            # 创建PDF文档
-            doc = SimpleDocTemplate(
-                path,
-                pagesize=letter,
-                rightMargin=72,
-                leftMargin=72,
-                topMargin=72,
-                bottomMargin=18
-            )
-
-            # 获取样式
-            styles = getSampleStyleSheet()
-            # 修改标题样式
-            styles['Title'].fontName = 'SimHei'
-            styles['Title'].fontSize = 16
-            styles['Title'].spaceAfter = 20
-            styles['Title'].alignment = 1  # 居中
-
-            # 修改一级标题样式
-            styles['Heading1'].fontName = 'SimHei'
-            styles['Heading1'].fontSize = 14
-            styles['Heading1'].spaceAfter = 12
-            styles['Heading1'].spaceBefore = 12
-
-            styles.add(ParagraphStyle(
-                name='Custom',
-                parent=styles['Normal'],
-                fontName='SimHei',  # 使用中文字体
-                fontSize=10,
-                spaceAfter=12,
-                alignment=1  # 居中
-            ))
-
-            styles.add(ParagraphStyle(
-                name='Question',
-                parent=styles['Normal'],
-                fontName='SimHei',
-                fontSize=10,
-                spaceAfter=6,
-                leftIndent=20
-            ))
-
-            styles.add(ParagraphStyle(
-                name='Answer',
-                parent=styles['Normal'],
-                fontName='SimHei',
-                fontSize=10,
-                spaceAfter=6,
-                leftIndent=40
-            ))
-
-            # 构建PDF内容
-            story = list()
-
-            # 添加标题
-            story.append(Paragraph("面试报告", styles['Title']))
-            story.append(Spacer(1, 12))
-
-            # 添加面试信息
-            story.append(Paragraph(f"面试ID: {interview_id}", styles['Custom']))
-            story.append(Paragraph(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Custom']))
-            story.append(Spacer(1, 12))
-
-            # 添加对话历史
-            story.append(Paragraph("面试对话记录", styles['Heading1']))
-            for i, msg in enumerate(self.full_history):
-                if msg['state'] in ['start', 'asking']:
-                    story.append(Paragraph(f"{i + 1}. 面试官：{msg['input']}", styles['Question']))
-                    story.append(Paragraph(f"应聘者：{msg['output']}", styles['Answer']))
-                    story.append(Paragraph(f"AI：{msg['ai']}", styles['Answer']))
-                else:
-                    story.append(Paragraph(f"{i + 1}. 面试官：{msg['input']}", styles['Question']))
-                    story.append(Paragraph(f"应聘者：{msg['output']}", styles['Answer']))
-                story.append(Spacer(1, 6))
-
-            # 构建PDF
-            doc.build(story)
-            print(f"PDF已生成: {path}")
-
-        except Exception as e:
-            print(f"生成PDF时出错: {str(e)}")
-            raise
+        render_report(path, interview_id, self.full_history)
 
     @property
     def full_history(self):
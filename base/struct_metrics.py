@@ -0,0 +1,222 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from base.utils import count_tokens
+
+# 当前所处的面试环节，由track_stage设置，llm回调据此归类指标
+current_stage: ContextVar[str] = ContextVar("current_stage", default="other")
+
+# 耗时（秒）和token数的分桶上界
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKENS_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Histogram:
+    """
+    按标签分组的直方图，记录各分桶的计数、总和与次数
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # 标签 -> [各分桶计数, 总和, 次数]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            item[0][index] += 1
+        item[1] += value
+        item[2] += 1
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表，按Prometheus文本格式输出
+    多worker部署时每个worker单独统计，由Prometheus按实例汇总
+    """
+
+    def __init__(self):
+        # 名称 -> (类型, 说明, 标签名, 直方图、{标签: 计数}或返回{标签: 当前值}的函数)
+        self._metrics: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, label_names: tuple, buckets: tuple = SECONDS_BUCKETS):
+        with self._lock:
+            self._metrics.setdefault(name, ("histogram", help_text, label_names, Histogram(buckets)))
+
+    def counter(self, name: str, help_text: str, label_names: tuple):
+        with self._lock:
+            self._metrics.setdefault(name, ("counter", help_text, label_names, {}))
+
+    def gauge(self, name: str, help_text: str, label_names: tuple, collect: Callable[[], dict]):
+        """
+        输出指标时调用collect读取当前值，重复注册时使用新的函数
+        """
+        with self._lock:
+            self._metrics[name] = ("gauge", help_text, label_names, collect)
+
+    def observe(self, name: str, value: float, *labels):
+        with self._lock:
+            self._metrics[name][3].observe(labels, value)
+
+    def inc(self, name: str, *labels, value: float = 1):
+        with self._lock:
+            values = self._metrics[name][3]
+            values[labels] = values.get(labels, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, label_names, data) in self._metrics.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "gauge":
+                    data = data()
+                if kind in ("counter", "gauge"):
+                    for labels, value in data.items():
+                        lines.append(f"{name}{self._labels(label_names, labels)} {value}")
+                    continue
+                for labels, (counts, total, count) in data.values.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(data.buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{self._labels(label_names, labels, le=bound)} {cumulative}")
+                    lines.append(f"{name}_bucket{self._labels(label_names, labels, le='+Inf')} {count}")
+                    lines.append(f"{name}_sum{self._labels(label_names, labels)} {total}")
+                    lines.append(f"{name}_count{self._labels(label_names, labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(label_names: tuple, labels: tuple, le=None) -> str:
+        pairs = list(zip(label_names, labels))
+        if le is not None:
+            pairs.append(("le", le))
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+@lru_cache(maxsize=None)
+def get_metrics() -> MetricsRegistry:
+    """
+    进程内共享的指标注册表，包含面试各环节和llm调用的指标
+    """
+    registry = MetricsRegistry()
+    registry.histogram("interview_stage_duration_seconds", "面试各环节的耗时", ("stage",))
+    registry.counter("interview_stage_errors_total", "面试各环节抛出异常的次数", ("stage",))
+    registry.histogram("llm_request_duration_seconds", "llm调用的耗时", ("stage",))
+    registry.histogram("llm_time_to_first_token_seconds", "流式输出首个token的耗时", ("stage",))
+    registry.histogram("llm_prompt_tokens", "每次llm调用的提示词token数", ("stage",), TOKENS_BUCKETS)
+    registry.histogram("llm_completion_tokens", "每次llm调用的输出token数", ("stage",), TOKENS_BUCKETS)
+    registry.counter("llm_errors_total", "llm调用失败的次数", ("stage",))
+    registry.counter("llm_parse_failures_total", "llm输出无法解析或缺少字段的次数", ("stage",))
+    registry.counter("llm_route_downgrades_total", "首选模型p95耗时超出预算而改用其他模型的次数", ("stage", "model"))
+    registry.counter("llm_route_fallbacks_total", "模型调用出错后使用下一个模型兜底的次数", ("stage", "model"))
+    registry.histogram("http_pool_wait_seconds", "llm请求等待连接池分配连接的耗时", ("client",))
+    registry.counter("http_connections_opened_total", "llm客户端新建的连接数，持续增长说明连接没有被复用", ("client",))
+    registry.histogram("llm_scheduler_wait_seconds", "llm调用排队等待的耗时", ("priority",))
+    registry.counter("llm_scheduler_rejections_total", "llm调用排队已满或排队超时而被拒绝的次数", ("priority",))
+    registry.counter("speculation_questions_total", "推测生成的问题被采用(committed)或丢弃(discarded)的次数", ("result",))
+    registry.counter("speculation_wasted_tokens_total", "被丢弃的推测生成消耗的token数", ())
+    return registry
+
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    记录一个面试环节的耗时，环节内的llm调用按该环节归类
+    """
+    token = current_stage.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        get_metrics().inc("interview_stage_errors_total", stage)
+        raise
+    finally:
+        get_metrics().observe("interview_stage_duration_seconds", time.perf_counter() - start, stage)
+        current_stage.reset(token)
+
+
+def record_parse_failure():
+    get_metrics().inc("llm_parse_failures_total", current_stage.get())
+
+
+class StageMetricsCallback(BaseCallbackHandler):
+    """
+    记录每次llm调用的耗时、首个token的耗时和token数，按调用时所处的面试环节归类
+    服务端没有返回用量信息时按提示词和输出文本估算token数
+    """
+    # 只做计数，直接在调用线程中执行，同时保证能读到调用方的面试环节
+    run_inline = True
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or get_metrics()
+        # run_id -> [面试环节, 开始时间, 是否已收到首个token, 提示词文本]
+        self._runs: dict = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, prompt: str):
+        with self._lock:
+            self._runs[run_id] = [current_stage.get(), time.perf_counter(), False, prompt]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._start(run_id, "".join(prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._start(run_id, "".join(str(m.content) for batch in messages for m in batch))
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[2]:
+                return
+            run[2] = True
+        self.registry.observe("llm_time_to_first_token_seconds", time.perf_counter() - run[1], run[0])
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, start, _, prompt = run
+        self.registry.observe("llm_request_duration_seconds", time.perf_counter() - start, stage)
+        prompt_tokens, completion_tokens = self._usage(response)
+        if prompt_tokens is None:
+            prompt_tokens = count_tokens(prompt)
+            completion_tokens = sum(count_tokens(g.text) for gs in response.generations for g in gs)
+        self.registry.observe("llm_prompt_tokens", prompt_tokens, stage)
+        self.registry.observe("llm_completion_tokens", completion_tokens, stage)
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.registry.inc("llm_errors_total", run[0])
+
+    @staticmethod
+    def _usage(response: LLMResult) -> tuple:
+        """
+        返回(提示词token数, 输出token数)，没有用量信息时返回(None, None)
+        """
+        usages = [getattr(getattr(g, "message", None), "usage_metadata", None)
+                  for gs in response.generations for g in gs]
+        usages = [u for u in usages if u]
+        if usages:
+            return sum(u.get("input_tokens", 0) for u in usages), sum(u.get("output_tokens", 0) for u in usages)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            return None, None
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
@@ -0,0 +1,176 @@
+import logging
+import threading
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+import config
+
+
+def report_history(full_history: list) -> list:
+    """
+    将完整对话记录整理为前端展示的格式
+    """
+    history = []
+    for msg in full_history:
+        if msg.get('stage') == "replying":
+            history.append({"question": msg['human_input'], "reply": "", "answer": msg['ai_output'], "ai": ""})
+        elif 'reply' in msg:
+            comment = f"{msg.get('ai_scoring', '')}分 {msg.get('ai_comment', '')}" if 'ai_scoring' in msg else ""
+            history.append({
+                "question": msg['human_input'],
+                "reply": msg['reply'],
+                "answer": msg['ai_output'],
+                "ai": comment
+            })
+    return history
+
+
+class ReportRenderContext:
+    """
+    进程内共享的报告渲染上下文：中文字体只注册一次，段落样式只构建一次
+    ReportLab嵌入TrueType字体时只写入用到的字形子集，生成单份报告只需要构建内容
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.font_name = self._register_fonts()
+        self.styles = self._build_styles(self.font_name)
+
+    @classmethod
+    def get(cls) -> "ReportRenderContext":
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def _register_fonts() -> str:
+        """
+        注册中文字体，返回报告使用的字体名
+        优先使用SimHei，其次使用config.TTF_FILE（微软雅黑），都不存在时使用ReportLab内置的中文字体
+        """
+        font_name = None
+        # 请确保系统中有SimHei.ttf或其他中文字体文件
+        # 如果没有，可以从Windows系统复制或下载中文字体文件
+        for name, path in [('微软雅黑', config.TTF_FILE), ('SimHei', 'SimHei.ttf')]:
+            try:
+                # ttc为字体集合，取第一个字体
+                pdfmetrics.registerFont(TTFont(name, path, subfontIndex=0))
+                font_name = name
+            except Exception as e:
+                logging.warning(f"注册字体失败: {name} {e}")
+        if font_name is None:
+            font_name = 'STSong-Light'
+            pdfmetrics.registerFont(UnicodeCIDFont(font_name))
+        return font_name
+
+    @staticmethod
+    def _build_styles(font_name: str):
+        # 获取样式
+        styles = getSampleStyleSheet()
+        # 修改标题样式
+        styles['Title'].fontName = font_name
+        styles['Title'].fontSize = 16
+        styles['Title'].spaceAfter = 20
+        styles['Title'].alignment = 1  # 居中
+
+        # 修改一级标题样式
+        styles['Heading1'].fontName = font_name
+        styles['Heading1'].fontSize = 14
+        styles['Heading1'].spaceAfter = 12
+        styles['Heading1'].spaceBefore = 12
+
+        styles.add(ParagraphStyle(
+            name='Custom',
+            parent=styles['Normal'],
+            fontName=font_name,  # 使用中文字体
+            fontSize=10,
+            spaceAfter=12,
+            alignment=1  # 居中
+        ))
+
+        styles.add(ParagraphStyle(
+            name='Question',
+            parent=styles['Normal'],
+            fontName=font_name,
+            fontSize=10,
+            spaceAfter=6,
+            leftIndent=20
+        ))
+
+        styles.add(ParagraphStyle(
+            name='Answer',
+            parent=styles['Normal'],
+            fontName=font_name,
+            fontSize=10,
+            spaceAfter=6,
+            leftIndent=40
+        ))
+        return styles
+
+
+def prepare_render():
+    """
+    预先注册字体和样式，用于在渲染进程启动后预热
+    """
+    ReportRenderContext.get()
+
+
+def render_report(path: str, interview_id: str, full_history: list):
+    """
+    把历史记录存入pdf中
+    """
+    try:
+        styles = ReportRenderContext.get().styles
+
+        # 创建PDF文档
+        doc = SimpleDocTemplate(
+            path,
+            pagesize=letter,
+            rightMargin=72,
+            leftMargin=72,
+            topMargin=72,
+            bottomMargin=18
+        )
+
+        # 构建PDF内容
+        story = list()
+
+        # 添加标题
+        story.append(Paragraph("面试报告", styles['Title']))
+        story.append(Spacer(1, 12))
+
+        # 添加面试信息
+        story.append(Paragraph(f"面试ID: {interview_id}", styles['Custom']))
+        story.append(Paragraph(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Custom']))
+        story.append(Spacer(1, 12))
+
+        # 添加对话历史，文本需要转义后才能作为Paragraph的标记内容
+        story.append(Paragraph("面试对话记录", styles['Heading1']))
+        for i, msg in enumerate(report_history(full_history)):
+            if msg['reply']:
+                story.append(Paragraph(f"{i + 1}. 面试官：{escape(msg['question'])}", styles['Question']))
+                story.append(Paragraph(f"应聘者：{escape(msg['reply'])}", styles['Answer']))
+                story.append(Paragraph(f"参考答案：{escape(msg['answer'])}", styles['Answer']))
+                story.append(Paragraph(f"AI：{escape(msg['ai'])}", styles['Answer']))
+            else:
+                story.append(Paragraph(f"{i + 1}. 应聘者：{escape(msg['question'])}", styles['Question']))
+                story.append(Paragraph(f"面试官：{escape(msg['answer'])}", styles['Answer']))
+            story.append(Spacer(1, 6))
+
+        # 构建PDF
+        doc.build(story)
+        print(f"PDF已生成: {path}")
+
+    except Exception as e:
+        print(f"生成PDF时出错: {str(e)}")
+        raise
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from langchain_community.document_loaders import PyPDFLoader
+
+from base.utils import count_tokens
+
+# 页码行，例如 "1"、"- 1 -"、"第1页"、"1/3"、"Page 1 of 3"
+PAGE_NUMBER_PATTERN = re.compile(r"^(-?\s*\d+\s*-?|第\s*\d+\s*页(\s*共\s*\d+\s*页)?|\d+\s*/\s*\d+|page\s*\d+(\s*of\s*\d+)?)$",
+                                 re.IGNORECASE)
+# 每页顶部/底部用于识别页眉页脚的行数
+EDGE_LINES = 2
+
+
+class ResumeLoader:
+    """
+    简历解析：逐页读取pdf，按token预算截断，去除页眉页脚和重复空白
+    解析结果按文件哈希缓存在内存和磁盘中，同一份简历不会重复解析
+    """
+
+    def __init__(self, cache_dir: str, max_tokens: int = 3000, max_entries: int = 256):
+        self.cache_dir = cache_dir
+        self.max_tokens = max_tokens
+        self.max_entries = max_entries
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def load(self, path: str, file_hash: Optional[str] = None) -> str:
+        """
+        返回简历文本，file_hash为空时计算文件哈希
+        """
+        key = f"{file_hash or self.file_hash(path)}_{self.max_tokens}"
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        cache_path = os.path.join(self.cache_dir, f"{key}.txt")
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        else:
+            text = self.extract(path)
+            # 先写临时文件再替换，避免并发读到不完整的缓存
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, cache_path)
+        with self._lock:
+            self._cache[key] = text
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return text
+
+    def extract(self, path: str) -> str:
+        """
+        逐页解析pdf，累计token数达到预算后不再解析后续页面
+        """
+        pages, tokens = [], 0
+        for document in PyPDFLoader(path).lazy_load():
+            lines = self._clean_lines(document.page_content)
+            pages.append(lines)
+            tokens += sum(count_tokens(line) for line in lines)
+            if tokens >= self.max_tokens:
+                break
+        return self._truncate(self._remove_headers(pages))
+
+    @staticmethod
+    def _clean_lines(text: str) -> list:
+        """
+        合并重复空白，去除空行和页码行
+        """
+        lines = []
+        for line in text.splitlines():
+            line = re.sub(r"\s+", " ", line).strip()
+            if line and not PAGE_NUMBER_PATTERN.match(line):
+                lines.append(line)
+        return lines
+
+    @staticmethod
+    def _remove_headers(pages: list) -> list:
+        """
+        去除页眉页脚：在多页顶部或底部重复出现的行
+        """
+        if len(pages) < 2:
+            return [line for lines in pages for line in lines]
+        edges = Counter(line for lines in pages for line in set(lines[:EDGE_LINES] + lines[-EDGE_LINES:]))
+        repeated = {line for line, num in edges.items() if num >= 2}
+        result = []
+        for lines in pages:
+            for i, line in enumerate(lines):
+                is_edge = i < EDGE_LINES or i >= len(lines) - EDGE_LINES
+                if not (is_edge and line in repeated):
+                    result.append(line)
+        return result
+
+    def _truncate(self, lines: list) -> str:
+        """
+        按token预算截断
+        """
+        result, tokens = [], 0
+        for line in lines:
+            tokens += count_tokens(line)
+            if tokens > self.max_tokens:
+                break
+            result.append(line)
+        return "\n".join(result)
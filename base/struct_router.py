@@ -0,0 +1,382 @@
+import logging
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, Generation, LLMResult
+
+import config
+from base.struct_cassette import apply_cassette
+from base.struct_http import get_http_clients
+from base.struct_metrics import current_stage, get_metrics
+from base.struct_scheduler import get_llm_scheduler
+from base.utils import count_tokens
+
+
+def create_openai_model(spec: str, **kwargs):
+    """
+    按"类型:模型名"创建模型客户端，类型为chat时创建ChatOpenAI，为completion时创建OpenAI
+    所有客户端共享同一个http连接池
+    """
+    from langchain_openai import OpenAI, ChatOpenAI
+
+    http_client, http_async_client = get_http_clients()
+    kwargs.setdefault("http_client", http_client)
+    kwargs.setdefault("http_async_client", http_async_client)
+    kind, _, name = spec.partition(":")
+    if kind == "chat":
+        return ChatOpenAI(temperature=0, streaming=True, model=name, max_tokens=512, timeout=config.LLM_TIMEOUT,
+                          stream_usage=True, **kwargs)
+    if kind == "completion":
+        return OpenAI(temperature=0, max_tokens=512, model=name, timeout=config.LLM_TIMEOUT, **kwargs)
+    raise ValueError(f"未知的模型类型: {spec}")
+
+
+class ModelRouter:
+    """
+    按面试环节选择模型
+    1. 每个环节配置依次尝试的模型，调用出错时使用下一个模型兜底
+    2. 统计每个模型最近window秒内的耗时，首选模型的p95超出该环节的预算时，优先使用预算内的模型
+    3. 降级后首选模型不再产生新样本，窗口内的慢样本过期后自动恢复使用首选模型
+    模型客户端按需创建，在所有会话之间共享；设置scheduler时每次调用先在调度器中排队
+    """
+
+    def __init__(self, routes: dict, slo: dict, factory: Callable[[str], Any] = create_openai_model,
+                 window: float = 60, min_samples: int = 10, scheduler=None):
+        self.routes = routes
+        self.slo = slo
+        self.factory = factory
+        self.window = window
+        self.min_samples = min_samples
+        self.scheduler = scheduler
+        self._models: dict[str, Any] = {}
+        # 模型 -> [(时间, 耗时)]
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self.downgrades: dict[str, int] = {}
+        self.fallbacks: dict[str, int] = {}
+
+    def model(self, spec: str):
+        with self._lock:
+            model = self._models.get(spec)
+            if model is None:
+                model = self._models[spec] = self.factory(spec)
+            return model
+
+    def observe(self, spec: str, seconds: float):
+        now = time.monotonic()
+        with self._lock:
+            samples = self._samples.setdefault(spec, deque())
+            samples.append((now, seconds))
+            self._prune(samples, now)
+
+    def _prune(self, samples: deque, now: float):
+        while samples and now - samples[0][0] > self.window:
+            samples.popleft()
+
+    def p95(self, spec: str) -> Optional[float]:
+        """
+        窗口内的p95耗时，样本数不足min_samples时返回None
+        """
+        with self._lock:
+            samples = self._samples.get(spec)
+            if not samples:
+                return None
+            self._prune(samples, time.monotonic())
+            if len(samples) < self.min_samples:
+                return None
+            values = sorted(s for _, s in samples)
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+    def candidates(self, stage: str, default: list) -> list:
+        """
+        返回本次调用依次尝试的模型：预算内的模型按配置顺序在前，超出预算的按p95从低到高在后
+        """
+        route = self.routes.get(stage) or default
+        budget = self.slo.get(stage)
+        if budget is None or len(route) == 1:
+            return route
+        p95 = {spec: self.p95(spec) for spec in route}
+        within = [spec for spec in route if p95[spec] is None or p95[spec] <= budget]
+        over = sorted((spec for spec in route if spec not in within), key=lambda spec: p95[spec])
+        ordered = within + over
+        if ordered[0] != route[0]:
+            self._count(self.downgrades, "llm_route_downgrades_total", stage, ordered[0])
+        return ordered
+
+    def failed(self, stage: str, spec: str, error: Exception, next_spec: Optional[str]):
+        if next_spec is None:
+            return
+        logging.warning(f"模型调用失败，使用{next_spec}兜底: {stage} {spec} {error}")
+        self._count(self.fallbacks, "llm_route_fallbacks_total", stage, next_spec)
+
+    def _count(self, counter: dict, metric: str, stage: str, spec: str):
+        with self._lock:
+            counter[stage] = counter.get(stage, 0) + 1
+        get_metrics().inc(metric, stage, spec)
+
+    def chat_model(self, **kwargs) -> "RoutedChatModel":
+        return RoutedChatModel(router=self, default_route=[config.CHAT_MODEL], **kwargs)
+
+    def completion_model(self, **kwargs) -> "RoutedLLM":
+        return RoutedLLM(router=self, default_route=[config.COMPLETION_MODEL], **kwargs)
+
+    def stats(self) -> dict:
+        specs = sorted({spec for route in self.routes.values() for spec in route} | set(self._samples))
+        with self._lock:
+            downgrades, fallbacks = dict(self.downgrades), dict(self.fallbacks)
+        return {
+            "p95": {spec: self.p95(spec) for spec in specs},
+            "downgrades": downgrades,
+            "fallbacks": fallbacks,
+        }
+
+
+def _chat_usage(message: BaseMessage) -> Optional[dict]:
+    # 聊天模型的用量转换为补全模型的token_usage格式
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    return {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0)}
+
+
+class _RoutedMixin:
+    """
+    依次尝试路由给出的模型，记录成功调用的耗时
+    被路由的模型不挂回调，回调统一挂在路由模型上，每次调用只触发一次
+    兜底重试占用同一个调度名额，调度器拒绝时直接抛出LLMBusyError，不再尝试其他模型
+    """
+
+    def _slot(self, prompt: str):
+        if self.router.scheduler is None:
+            return nullcontext()
+        return self.router.scheduler.slot(count_tokens(prompt) + config.LLM_COMPLETION_TOKENS_ESTIMATE)
+
+    def _aslot(self, prompt: str):
+        if self.router.scheduler is None:
+            return nullcontext()
+        return self.router.scheduler.aslot(count_tokens(prompt) + config.LLM_COMPLETION_TOKENS_ESTIMATE)
+
+    def _route(self) -> tuple[str, list]:
+        stage = current_stage.get()
+        return stage, self.router.candidates(stage, self.default_route)
+
+    def _attempt(self, stage: str, specs: list, call):
+        for i, spec in enumerate(specs):
+            start = time.perf_counter()
+            try:
+                result = call(self.router.model(spec))
+            except Exception as e:
+                next_spec = specs[i + 1] if i + 1 < len(specs) else None
+                self.router.failed(stage, spec, e, next_spec)
+                if next_spec is None:
+                    raise
+                continue
+            self.router.observe(spec, time.perf_counter() - start)
+            return result
+
+    async def _aattempt(self, stage: str, specs: list, call):
+        for i, spec in enumerate(specs):
+            start = time.perf_counter()
+            try:
+                result = await call(self.router.model(spec))
+            except Exception as e:
+                next_spec = specs[i + 1] if i + 1 < len(specs) else None
+                self.router.failed(stage, spec, e, next_spec)
+                if next_spec is None:
+                    raise
+                continue
+            self.router.observe(spec, time.perf_counter() - start)
+            return result
+
+    @property
+    def model_name(self) -> str:
+        # 关键词缓存等按模型名区分结果，使用当前环节的首选模型
+        return (self.router.routes.get(current_stage.get()) or self.default_route)[0]
+
+
+class RoutedChatModel(_RoutedMixin, BaseChatModel):
+    """
+    按面试环节路由的聊天模型，路由到补全模型时把消息拼接为文本
+    streaming为True时invoke也走流式输出，逐段触发on_llm_new_token，已经输出部分内容后不再切换模型
+    """
+    router: Any = None
+    default_route: list = []
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat"
+
+    @staticmethod
+    def _from_completion(result: LLMResult) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=result.generations[0][0].text))],
+                          llm_output=result.llm_output)
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            chunks = []
+            for chunk in self._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                chunks.append(chunk)
+            return generate_from_stream(iter(chunks))
+
+        def call(model):
+            if isinstance(model, BaseChatModel):
+                return model._generate(messages, stop=stop, **kwargs)
+            return self._from_completion(model._generate([get_buffer_string(messages)], stop=stop))
+
+        with self._slot(get_buffer_string(messages)):
+            return self._attempt(*self._route(), call)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            chunks = []
+            async for chunk in self._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                chunks.append(chunk)
+            return generate_from_stream(iter(chunks))
+
+        async def call(model):
+            if isinstance(model, BaseChatModel):
+                return await model._agenerate(messages, stop=stop, **kwargs)
+            return self._from_completion(await model._agenerate([get_buffer_string(messages)], stop=stop))
+
+        async with self._aslot(get_buffer_string(messages)):
+            return await self._aattempt(*self._route(), call)
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        with self._slot(get_buffer_string(messages)):
+            yield from self._stream_routes(messages, stop, run_manager, **kwargs)
+
+    def _stream_routes(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                       **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        stage, specs = self._route()
+        for i, spec in enumerate(specs):
+            model, start, started = self.router.model(spec), time.perf_counter(), False
+            try:
+                if isinstance(model, BaseChatModel):
+                    chunks = model._stream(messages, stop=stop, **kwargs)
+                else:
+                    result = self._from_completion(model._generate([get_buffer_string(messages)], stop=stop))
+                    chunks = [ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].text))]
+                # 逐段的回调由调用方（BaseChatModel.stream或_generate）触发，这里只产出片段
+                for chunk in chunks:
+                    started = True
+                    yield chunk
+            except Exception as e:
+                # 已经输出部分内容时无法切换模型
+                next_spec = specs[i + 1] if i + 1 < len(specs) and not started else None
+                self.router.failed(stage, spec, e, next_spec)
+                if next_spec is None:
+                    raise
+                continue
+            self.router.observe(spec, time.perf_counter() - start)
+            return
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async with self._aslot(get_buffer_string(messages)):
+            async for chunk in self._astream_routes(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+    async def _astream_routes(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                              **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        stage, specs = self._route()
+        for i, spec in enumerate(specs):
+            model, start, started = self.router.model(spec), time.perf_counter(), False
+            try:
+                if isinstance(model, BaseChatModel):
+                    async for chunk in model._astream(messages, stop=stop, **kwargs):
+                        started = True
+                        yield chunk
+                else:
+                    result = self._from_completion(await model._agenerate([get_buffer_string(messages)], stop=stop))
+                    started = True
+                    yield ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].text))
+            except Exception as e:
+                next_spec = specs[i + 1] if i + 1 < len(specs) and not started else None
+                self.router.failed(stage, spec, e, next_spec)
+                if next_spec is None:
+                    raise
+                continue
+            self.router.observe(spec, time.perf_counter() - start)
+            return
+
+
+class RoutedLLM(_RoutedMixin, BaseLLM):
+    """
+    按面试环节路由的补全模型，路由到聊天模型时把提示词作为一条用户消息
+    """
+    router: Any = None
+    default_route: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-llm"
+
+    @staticmethod
+    def _from_chat(result: ChatResult) -> LLMResult:
+        message = result.generations[0].message
+        usage = _chat_usage(message)
+        return LLMResult(generations=[[Generation(text=message.content)]],
+                         llm_output={"token_usage": usage} if usage else None)
+
+    @staticmethod
+    def _merge(results: list) -> LLMResult:
+        usage = {}
+        for result in results:
+            for name, value in ((result.llm_output or {}).get("token_usage") or {}).items():
+                if isinstance(value, (int, float)):
+                    usage[name] = usage.get(name, 0) + value
+        return LLMResult(generations=[g for result in results for g in result.generations],
+                         llm_output={"token_usage": usage} if usage else None)
+
+    def _generate(self, prompts: List[str], stop=None, run_manager=None, **kwargs: Any) -> LLMResult:
+        stage, specs = self._route()
+        results = []
+        for prompt in prompts:
+            def call(model):
+                if isinstance(model, BaseChatModel):
+                    return self._from_chat(model._generate([HumanMessage(content=prompt)], stop=stop))
+                return model._generate([prompt], stop=stop, **kwargs)
+
+            with self._slot(prompt):
+                results.append(self._attempt(stage, specs, call))
+        return self._merge(results)
+
+    async def _agenerate(self, prompts: List[str], stop=None, run_manager=None, **kwargs: Any) -> LLMResult:
+        stage, specs = self._route()
+        results = []
+        for prompt in prompts:
+            async def call(model):
+                if isinstance(model, BaseChatModel):
+                    return self._from_chat(await model._agenerate([HumanMessage(content=prompt)], stop=stop))
+                return await model._agenerate([prompt], stop=stop, **kwargs)
+
+            async with self._aslot(prompt):
+                results.append(await self._aattempt(stage, specs, call))
+        return self._merge(results)
+
+
+@lru_cache(maxsize=None)
+def get_model_router() -> ModelRouter:
+    """
+    进程内共享的模型路由，按config中的配置创建，开启录制/回放时模型客户端由磁带包装
+    """
+    # 相同前缀的请求带上同一个prompt_cache_key，兼容OpenAI接口的服务端据此路由到同一缓存
+    extra_body = {"prompt_cache_key": config.PROMPT_CACHE_KEY} if config.PROMPT_CACHE_KEY else None
+    return ModelRouter(config.MODEL_ROUTES, config.MODEL_SLO,
+                       lambda spec: apply_cassette(create_openai_model(spec, extra_body=extra_body)),
+                       config.ROUTER_WINDOW, config.ROUTER_MIN_SAMPLES, get_llm_scheduler())
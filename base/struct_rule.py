@@ -0,0 +1,117 @@
+import re
+from collections import deque
+from typing import Iterable, Optional
+
+# 结束面试的回答
+FINISH_WORDS = ("结束", "结束面试")
+# 表示不会、不了解的回答，只对较短的回答生效，避免误判"我不清楚细节，但是……"这类回答
+REFUSAL_PATTERN = re.compile(
+    r"^(我)?(真的|确实|暂时|目前)?(不知道|不清楚|不会|不了解|不懂|不记得|没(有)?(学过|用过|接触过|了解过|做过)|忘(记)?了|答不上来|跳过|pass|不太清楚|不太了解)"
+    r"[\s,，。.!！~…]*(这个|这道题|这个问题)?[\s,，。.!！~…]*$",
+    re.IGNORECASE
+)
+# 去除空白和标点后计算回答长度
+PUNCTUATION_PATTERN = re.compile(r"[\s\W_]+")
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick多模式匹配，一次扫描找出文本中出现的所有关键词（不区分大小写）
+    """
+
+    def __init__(self, words: Iterable[str]):
+        # 每个节点：子节点、失败指针、以该节点结尾的关键词
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[set] = [set()]
+        for word in words:
+            self._add(word)
+        self._build()
+
+    def _add(self, word: str):
+        node = 0
+        for ch in word.lower():
+            if ch not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[node][ch] = len(self._goto) - 1
+            node = self._goto[node][ch]
+        self._output[node].add(word)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] |= self._output[self._fail[child]]
+
+    def findall(self, text: str) -> set:
+        found, node = set(), 0
+        for ch in text.lower():
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._output[node]:
+                found |= self._output[node]
+        return found
+
+
+def keyword_matcher(keywords: Iterable[str]) -> AhoCorasick:
+    """
+    按面试关键词创建匹配器，单个字符的关键词（如"C"）几乎出现在任何文本中，不参与匹配
+    """
+    return AhoCorasick({w.strip() for w in keywords if len(w.strip()) >= 2})
+
+
+class AnswerRuleEngine:
+    """
+    基于规则评估应聘者的回答，只处理明显的情况（结束面试、未作答、表示不会、过短且不含关键词），
+    返回与llm评估相同格式的结果；无法判断时返回None，交由llm评估
+    """
+
+    def __init__(self, matcher: AhoCorasick, min_length: int = 4, short_length: int = 15,
+                 refusal_max_length: int = 20, refusal_pattern: re.Pattern = REFUSAL_PATTERN,
+                 finish_words: Iterable[str] = FINISH_WORDS):
+        self.min_length = min_length
+        self.short_length = short_length
+        self.refusal_max_length = refusal_max_length
+        self.refusal_pattern = refusal_pattern
+        self.finish_words = set(finish_words)
+        self.matcher = matcher
+
+    def evaluate(self, reply: str, correct_answer: str) -> Optional[dict]:
+        """
+        返回评估结果，rule字段为命中的规则名；没有命中任何规则时返回None
+        """
+        reply = reply.strip()
+        if reply in self.finish_words:
+            return {"rule": "finish", "finished": True}
+        length = len(PUNCTUATION_PATTERN.sub("", reply))
+        if length == 0:
+            return self._result("empty", 0, "应聘者未作答")
+        if len(reply) <= self.refusal_max_length and self.refusal_pattern.match(reply):
+            return self._result("refusal", 0, "应聘者表示不了解该问题")
+        if length < self.min_length:
+            return self._result("too_short", 10, "回答过于简短，未涉及问题要点")
+        if length < self.short_length:
+            # 标准答案涉及多个关键词，而简短的回答一个都没有提到
+            expected = self.matcher.findall(correct_answer)
+            if len(expected) >= 2 and not self.matcher.findall(reply):
+                return self._result("no_keyword", 20, f"回答简短且未涉及{'、'.join(sorted(expected)[:3])}等要点")
+        return None
+
+    @staticmethod
+    def _result(rule: str, scoring: int, comment: str) -> dict:
+        return {
+            "rule": rule,
+            "current_stage": "asking",
+            "current": "换一个问题继续提问",
+            "ai_scoring": scoring,
+            "ai_comment": comment
+        }
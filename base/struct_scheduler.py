@@ -0,0 +1,297 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+
+import config
+from base.struct_metrics import get_metrics
+
+# llm调用的优先级，数值越小越先执行
+# 进行中面试的每一轮对话
+PRIORITY_TURN = 0
+# 新面试的关键词提取和第一个问题
+PRIORITY_EXTRACTION = 1
+# 岗位预生成等后台任务
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_TURN: "turn", PRIORITY_EXTRACTION: "extraction", PRIORITY_BACKGROUND: "background"}
+
+# 当前llm调用的优先级，由llm_priority设置，排队时据此排序
+current_priority: ContextVar[int] = ContextVar("current_priority", default=PRIORITY_TURN)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """
+    设置范围内llm调用的优先级，范围内创建的异步任务继承该优先级
+    """
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class LLMBusyError(Exception):
+    """
+    llm调用排队已满或排队超时，retry_after为建议客户端重试前等待的秒数
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟的限额，按每秒限额/60匀速补充，限额为0时不限制
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """
+        取出amount个令牌前需要等待的秒数，超过容量的请求按容量计算
+        """
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, amount: float, now: float):
+        if self.capacity <= 0:
+            return
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    """
+    排队中的一次llm调用，同步调用用threading.Event唤醒，异步调用用所在事件循环的asyncio.Event唤醒
+    """
+
+    def __init__(self, priority: int, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.tokens = tokens
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class LLMScheduler:
+    """
+    llm调用的准入控制，进程内所有模型共享，对应同一个大模型服务商的限额
+    1. 同时进行的调用不超过max_concurrency，每分钟的请求数、token数不超过限额（令牌桶）
+    2. 超出限制的调用按优先级排队：进行中的面试 > 新面试的关键词提取 > 后台任务，同一优先级先到先得
+    3. 排队数达到max_queue或排队超过max_wait秒时抛出LLMBusyError，由接口返回429，避免请求堆积
+    token数按提示词和预估的输出长度计算；同步、异步调用共用同一个队列
+    """
+
+    def __init__(self, max_concurrency: int, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_queue: int = 128, max_wait: float = 10):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        # [(优先级, 序号, 排队的调用)]
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._running = 0
+        # 调用耗时的滑动平均，用于估算Retry-After
+        self._avg_duration = 1.0
+        self.rejected: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, priority: Optional[int] = None):
+        """
+        接口开始处理请求前检查排队是否已满，已满时直接拒绝，不做无用的准备工作
+        """
+        priority = current_priority.get() if priority is None else priority
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                raise self._busy(priority, "llm调用排队已满")
+
+    def _enqueue(self, tokens: int, priority: int, loop=None) -> _Waiter:
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                raise self._busy(priority, "llm调用排队已满")
+            waiter = _Waiter(priority, tokens, loop)
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+            self._dispatch()
+        return waiter
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        按优先级放行排在最前面的调用，返回队首还需等待令牌补充的秒数，因并发已满或队列为空而等待时返回None
+        调用方需持有锁
+        """
+        now = time.monotonic()
+        while self._queue and self._running < self.max_concurrency:
+            waiter = self._queue[0][2]
+            delay = max(self._requests.delay(1, now), self._tokens.delay(waiter.tokens, now))
+            if delay > 0:
+                return delay
+            heapq.heappop(self._queue)
+            self._requests.take(1, now)
+            self._tokens.take(waiter.tokens, now)
+            self._running += 1
+            waiter.granted = True
+            waiter.wake()
+            get_metrics().observe("llm_scheduler_wait_seconds", now - waiter.enqueued,
+                                  PRIORITY_NAMES.get(waiter.priority, str(waiter.priority)))
+        return None
+
+    def _timeout(self, waiter: _Waiter) -> Optional[float]:
+        """
+        返回本次等待的秒数，排队超时时抛出LLMBusyError
+        """
+        remaining = waiter.enqueued + self.max_wait - time.monotonic()
+        with self._lock:
+            delay = self._dispatch()
+            if waiter.granted:
+                return None
+            if remaining <= 0:
+                raise self._busy(waiter.priority, "llm调用排队超时")
+        return remaining if delay is None else min(delay, remaining)
+
+    def _abandon(self, waiter: _Waiter):
+        """
+        调用出错、超时或被取消时移出队列，已放行的归还并发名额
+        """
+        with self._lock:
+            if waiter.granted:
+                self._running -= 1
+            else:
+                self._queue = [item for item in self._queue if item[2] is not waiter]
+                heapq.heapify(self._queue)
+            self._dispatch()
+
+    def acquire(self, tokens: int, priority: Optional[int] = None):
+        priority = current_priority.get() if priority is None else priority
+        waiter = self._enqueue(tokens, priority)
+        try:
+            while not waiter.granted:
+                timeout = self._timeout(waiter)
+                if timeout is not None:
+                    waiter.event.wait(timeout)
+                    waiter.event.clear()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def aacquire(self, tokens: int, priority: Optional[int] = None):
+        priority = current_priority.get() if priority is None else priority
+        waiter = self._enqueue(tokens, priority, asyncio.get_running_loop())
+        try:
+            while not waiter.granted:
+                timeout = self._timeout(waiter)
+                if timeout is not None:
+                    try:
+                        await asyncio.wait_for(waiter.event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    waiter.event.clear()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def release(self, duration: Optional[float] = None):
+        with self._lock:
+            self._running -= 1
+            if duration is not None:
+                self._avg_duration = 0.9 * self._avg_duration + 0.1 * duration
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, tokens: int):
+        """
+        占用一个llm调用名额，范围结束时归还
+        """
+        self.acquire(tokens)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def aslot(self, tokens: int):
+        await self.aacquire(tokens)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def _busy(self, priority: int, reason: str) -> LLMBusyError:
+        """
+        按排在前面的调用数、平均耗时和请求额度估算重试等待时间，调用方需持有锁
+        """
+        ahead = sum(1 for item in self._queue if item[0] <= priority) + 1
+        drain = ahead / self.max_concurrency * self._avg_duration
+        refill = self._requests.delay(ahead, time.monotonic())
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        self.rejected[name] = self.rejected.get(name, 0) + 1
+        get_metrics().inc("llm_scheduler_rejections_total", name)
+        return LLMBusyError(reason, max(1, math.ceil(max(drain, refill))))
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def queued(self) -> dict:
+        """
+        各优先级排队的调用数
+        输出指标时在指标注册表的锁内调用，而放行调用时会在本对象的锁内记录指标，这里读取快照不加锁，避免死锁
+        """
+        counts = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, _ in list(self._queue):
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "max_concurrency": self.max_concurrency,
+                "queued": self.queued(),
+                "rejected": dict(self.rejected),
+                "avg_duration": round(self._avg_duration, 3),
+            }
+
+
+@lru_cache(maxsize=None)
+def get_llm_scheduler() -> LLMScheduler:
+    """
+    进程内共享的llm调度器，按config中的限额创建
+    多worker部署时每个worker单独限流，限额需要按worker数分摊
+    """
+    scheduler = LLMScheduler(config.LLM_MAX_CONCURRENCY, config.LLM_REQUESTS_PER_MINUTE,
+                             config.LLM_TOKENS_PER_MINUTE, config.LLM_QUEUE_MAX, config.LLM_QUEUE_TIMEOUT)
+    get_metrics().gauge("llm_scheduler_queued", "排队等待的llm调用数", ("priority",),
+                        lambda: {(name,): count for name, count in scheduler.queued().items()})
+    get_metrics().gauge("llm_scheduler_running", "正在进行的llm调用数", (),
+                        lambda: {(): scheduler.running})
+    return scheduler
@@ -0,0 +1,79 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from base.struct_rule import AhoCorasick
+
+# 英文单词（含C++、C#、.NET这类写法）和连续的中文
+TOKEN_PATTERN = re.compile(r"[a-z0-9_+#.]+|[一-鿿]+")
+
+
+class LexicalScorer:
+    """
+    本地词法评分，不调用llm，单次评分在毫秒级完成
+    1. 中文按相邻两字切分，英文按单词切分，计算回答与参考答案TF-IDF向量的余弦相似度
+    2. 文档频率由评估过的参考答案累计得到，"的是""一个"这类常见词的权重随之降低
+    3. 结合参考答案中面试关键词的覆盖率给出初步评分
+    """
+
+    def __init__(self, full_similarity: float = 0.6, coverage_weight: float = 0.3):
+        # 相似度达到full_similarity即视为满分
+        self.full_similarity = full_similarity
+        self.coverage_weight = coverage_weight
+        self._df: Counter = Counter()
+        self._num_docs = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text: str) -> list:
+        tokens = []
+        for part in TOKEN_PATTERN.findall(text.lower()):
+            if "一" <= part[0] <= "鿿":
+                tokens.extend([part] if len(part) == 1 else [part[i:i + 2] for i in range(len(part) - 1)])
+            else:
+                tokens.append(part)
+        return tokens
+
+    def observe(self, reference: str):
+        """
+        记录一份参考答案，更新文档频率
+        """
+        tokens = set(self.tokenize(reference))
+        with self._lock:
+            self._df.update(tokens)
+            self._num_docs += 1
+
+    def similarity(self, reply: str, reference: str) -> float:
+        reply_tf, reference_tf = Counter(self.tokenize(reply)), Counter(self.tokenize(reference))
+        if not reply_tf or not reference_tf:
+            return 0.0
+        vocab = list(reply_tf.keys() | reference_tf.keys())
+        with self._lock:
+            df = np.array([self._df[t] for t in vocab], dtype=float)
+            num_docs = self._num_docs
+        idf = np.log((num_docs + 1) / (df + 1)) + 1
+        # 词频取对数，避免重复的词主导相似度
+        a = np.array([1 + math.log(reply_tf[t]) if t in reply_tf else 0 for t in vocab]) * idf
+        b = np.array([1 + math.log(reference_tf[t]) if t in reference_tf else 0 for t in vocab]) * idf
+        return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    def score(self, reply: str, reference: str, matcher: Optional[AhoCorasick] = None) -> dict:
+        """
+        返回初步评分（0-100）、相似度，以及参考答案中的关键词和回答覆盖到的关键词
+        """
+        similarity = self.similarity(reply, reference)
+        expected = matcher.findall(reference) if matcher is not None else set()
+        covered = expected & matcher.findall(reply) if expected else set()
+        value = min(similarity / self.full_similarity, 1.0)
+        if expected:
+            value = (1 - self.coverage_weight) * value + self.coverage_weight * len(covered) / len(expected)
+        return {
+            "scoring": round(value * 100),
+            "similarity": round(similarity, 4),
+            "expected": sorted(expected),
+            "covered": sorted(covered),
+        }
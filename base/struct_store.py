@@ -0,0 +1,410 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import config
+
+
+class SessionConflictError(Exception):
+    """
+    保存会话状态时存储中的版本与预期不一致，说明其他worker已经更新了该会话
+    """
+
+
+class InterviewStore(ABC):
+    """
+    面试数据存储接口，保存面试信息（含提取的关键词）、对话记录、会话状态和报告信息
+    已完成的面试超过ttl后连同对话记录、会话状态、报告信息一起过期删除
+    """
+
+    def __init__(self, ttl: int = config.STORE_TTL, purge_interval: float = config.STORE_PURGE_INTERVAL):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+
+    def _expire_at(self, interview: dict) -> Optional[float]:
+        return time.time() + self.ttl if interview.get("status") == "completed" else None
+
+    @abstractmethod
+    def get_interview(self, interview_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_interview(self, interview_id: str, interview: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_interview(self, interview_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_turns(self, interview_id: str) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_turns(self, interview_id: str, turns: list):
+        """
+        保存对话记录（EnhanceConversationMemory.full_history），覆盖原有记录
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session(self, interview_id: str) -> Optional[tuple[int, dict]]:
+        """
+        返回(版本号, 会话状态)，不存在时返回None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session_version(self, interview_id: str) -> Optional[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_session(self, interview_id: str, state: dict, expected_version: Optional[int] = None) -> int:
+        """
+        保存会话状态并返回新的版本号，会话状态立即写入，不经过批量写入的缓冲区
+        expected_version为会话状态所基于的版本，新会话为None；存储中的版本不一致时抛出SessionConflictError，不覆盖
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_session(self, interview_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_report(self, report_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_report(self, report_id: str, report: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        """
+        删除已过期的面试，返回删除的面试数
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryStore(InterviewStore):
+    """
+    内存存储，进程重启后数据丢失，只能用于单进程部署或调试
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # interview_id -> (面试信息, 过期时间)
+        self._interviews: dict[str, tuple[str, Optional[float]]] = {}
+        self._turns: dict[str, str] = {}
+        # interview_id -> (版本号, 会话状态)
+        self._sessions: dict[str, tuple[int, str]] = {}
+        # report_id -> (interview_id, 报告信息)
+        self._reports: dict[str, tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    def get_interview(self, interview_id: str) -> Optional[dict]:
+        with self._lock:
+            item = self._interviews.get(interview_id)
+        if item is None or (item[1] is not None and item[1] < time.time()):
+            return None
+        return json.loads(item[0])
+
+    def put_interview(self, interview_id: str, interview: dict):
+        data = json.dumps(interview, ensure_ascii=False)
+        with self._lock:
+            self._interviews[interview_id] = (data, self._expire_at(interview))
+        if time.monotonic() - self._last_purge > self.purge_interval:
+            self.purge_expired()
+
+    def delete_interview(self, interview_id: str):
+        with self._lock:
+            self._delete(interview_id)
+
+    def _delete(self, interview_id: str):
+        self._interviews.pop(interview_id, None)
+        self._turns.pop(interview_id, None)
+        self._sessions.pop(interview_id, None)
+        for report_id in [k for k, (i, _) in self._reports.items() if i == interview_id]:
+            del self._reports[report_id]
+
+    def get_turns(self, interview_id: str) -> list:
+        with self._lock:
+            data = self._turns.get(interview_id)
+        return json.loads(data) if data else []
+
+    def put_turns(self, interview_id: str, turns: list):
+        data = json.dumps(turns, ensure_ascii=False)
+        with self._lock:
+            self._turns[interview_id] = data
+
+    def get_session(self, interview_id: str) -> Optional[tuple[int, dict]]:
+        with self._lock:
+            item = self._sessions.get(interview_id)
+        return (item[0], json.loads(item[1])) if item else None
+
+    def get_session_version(self, interview_id: str) -> Optional[int]:
+        with self._lock:
+            item = self._sessions.get(interview_id)
+        return item[0] if item else None
+
+    def put_session(self, interview_id: str, state: dict, expected_version: Optional[int] = None) -> int:
+        data = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            current = self._sessions[interview_id][0] if interview_id in self._sessions else None
+            if current != expected_version:
+                raise SessionConflictError(f"会话{interview_id}的版本为{current}，预期为{expected_version}")
+            version = (current or 0) + 1
+            self._sessions[interview_id] = (version, data)
+        return version
+
+    def delete_session(self, interview_id: str):
+        with self._lock:
+            self._sessions.pop(interview_id, None)
+
+    def get_report(self, report_id: str) -> Optional[dict]:
+        with self._lock:
+            item = self._reports.get(report_id)
+        return json.loads(item[1]) if item else None
+
+    def put_report(self, report_id: str, report: dict):
+        data = json.dumps(report, ensure_ascii=False)
+        with self._lock:
+            self._reports[report_id] = (report['interview_id'], data)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            self._last_purge = time.monotonic()
+            expired = [k for k, (_, expire_at) in self._interviews.items() if expire_at is not None and expire_at < now]
+            for interview_id in expired:
+                self._delete(interview_id)
+        return len(expired)
+
+
+class SQLiteStore(InterviewStore):
+    """
+    SQLite（WAL模式）存储，多个worker进程可以共享同一个数据库文件
+    1. 写入先放入缓冲区，同一条记录的多次写入只保留最后一次，由后台线程定期或缓冲区满时批量提交
+    2. 读取时优先读缓冲区，本进程内写入后立即可见
+    """
+
+    def __init__(self, path: str, flush_interval: float = config.STORE_FLUSH_INTERVAL,
+                 batch_size: int = config.STORE_BATCH_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # (表名, 主键) -> 待写入的记录，None表示删除
+        self._pending: dict[tuple[str, str], Optional[tuple]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS interviews ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, expire_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interviews_expire ON interviews(expire_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "interview_id TEXT NOT NULL, seq INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (interview_id, seq))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "interview_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "id TEXT PRIMARY KEY, interview_id TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_interview ON reports(interview_id)")
+        self._conn.commit()
+        self._thread = threading.Thread(target=self._run, name="store-flush", daemon=True)
+        self._thread.start()
+
+    def _put(self, table: str, key: str, value: Optional[tuple]):
+        with self._lock:
+            self._pending[(table, key)] = value
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _get(self, table: str, key: str):
+        """
+        返回(是否在缓冲区中, 缓冲区中的记录)
+        """
+        with self._lock:
+            if (table, key) in self._pending:
+                return True, self._pending[(table, key)]
+        return False, None
+
+    def get_interview(self, interview_id: str) -> Optional[dict]:
+        pending, value = self._get("interviews", interview_id)
+        if pending:
+            if value is None or (value[1] is not None and value[1] < time.time()):
+                return None
+            return json.loads(value[0])
+        with self._lock:
+            row = self._conn.execute("SELECT data, expire_at FROM interviews WHERE id = ?",
+                                     (interview_id,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def put_interview(self, interview_id: str, interview: dict):
+        self._put("interviews", interview_id, (json.dumps(interview, ensure_ascii=False), self._expire_at(interview)))
+
+    def delete_interview(self, interview_id: str):
+        self._put("interviews", interview_id, None)
+
+    def get_turns(self, interview_id: str) -> list:
+        pending, value = self._get("turns", interview_id)
+        if pending:
+            return json.loads(value[0]) if value else []
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM turns WHERE interview_id = ? ORDER BY seq",
+                                      (interview_id,)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def put_turns(self, interview_id: str, turns: list):
+        self._put("turns", interview_id, (json.dumps(turns, ensure_ascii=False),))
+
+    def get_session(self, interview_id: str) -> Optional[tuple[int, dict]]:
+        with self._lock:
+            row = self._conn.execute("SELECT version, data FROM sessions WHERE interview_id = ?",
+                                     (interview_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def get_session_version(self, interview_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE interview_id = ?",
+                                     (interview_id,)).fetchone()
+        return row[0] if row else None
+
+    def put_session(self, interview_id: str, state: dict, expected_version: Optional[int] = None) -> int:
+        data = json.dumps(state, ensure_ascii=False)
+        # 先提交缓冲区，保证其他worker恢复会话时也能读到面试信息和对话记录
+        self.flush()
+        with self._lock, self._conn:
+            # 只在版本与预期一致时写入（乐观锁），多个worker同时保存同一会话时后提交的一方失败
+            if expected_version is None:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (interview_id, version, data, updated_at) VALUES (?, 1, ?, ?)",
+                    (interview_id, data, time.time()))
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET version = version + 1, data = ?, updated_at = ? "
+                    "WHERE interview_id = ? AND version = ?",
+                    (data, time.time(), interview_id, expected_version))
+            if cursor.rowcount == 0:
+                raise SessionConflictError(f"会话{interview_id}已被其他worker更新，预期版本为{expected_version}")
+        return (expected_version or 0) + 1
+
+    def delete_session(self, interview_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE interview_id = ?", (interview_id,))
+
+    def get_report(self, report_id: str) -> Optional[dict]:
+        pending, value = self._get("reports", report_id)
+        if pending:
+            return json.loads(value[1]) if value else None
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_report(self, report_id: str, report: dict):
+        self._put("reports", report_id, (report['interview_id'], json.dumps(report, ensure_ascii=False)))
+
+    def flush(self):
+        """
+        在一个事务中写入缓冲区中的所有记录
+        持有锁直到提交完成，避免读取到既不在缓冲区、也尚未写入数据库的记录
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            now = time.time()
+            with self._conn:
+                for (table, key), value in self._pending.items():
+                    if table == "interviews":
+                        if value is None:
+                            self._delete([key])
+                        else:
+                            self._conn.execute(
+                                "INSERT OR REPLACE INTO interviews (id, data, updated_at, expire_at) VALUES (?, ?, ?, ?)",
+                                (key, value[0], now, value[1]))
+                    elif table == "turns":
+                        turns = json.loads(value[0]) if value else []
+                        # 对话回滚后记录可能变少，先删除多余的记录
+                        self._conn.execute("DELETE FROM turns WHERE interview_id = ? AND seq >= ?", (key, len(turns)))
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO turns (interview_id, seq, data) VALUES (?, ?, ?)",
+                            [(key, seq, json.dumps(turn, ensure_ascii=False)) for seq, turn in enumerate(turns)])
+                    elif table == "reports":
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO reports (id, interview_id, data, updated_at) VALUES (?, ?, ?, ?)",
+                            (key, value[0], value[1], now))
+            self._pending.clear()
+
+    def _delete(self, interview_ids: list):
+        """
+        删除面试及其对话记录、报告信息（调用方需持有锁）
+        """
+        rows = [(i,) for i in interview_ids]
+        self._conn.executemany("DELETE FROM turns WHERE interview_id = ?", rows)
+        self._conn.executemany("DELETE FROM reports WHERE interview_id = ?", rows)
+        self._conn.executemany("DELETE FROM sessions WHERE interview_id = ?", rows)
+        self._conn.executemany("DELETE FROM interviews WHERE id = ?", rows)
+
+    def purge_expired(self) -> int:
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM interviews WHERE expire_at < ?", (time.time(),)).fetchall()
+            with self._conn:
+                self._delete([i for i, in rows])
+        return len(rows)
+
+    def _run(self):
+        last_purge = time.monotonic()
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.monotonic() - last_purge > self.purge_interval:
+                    self.purge_expired()
+                    last_purge = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"保存面试数据失败: {str(e)}")
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self._conn.close()
+
+
+def create_store() -> InterviewStore:
+    """
+    按config.STORE_BACKEND创建存储
+    """
+    if config.STORE_BACKEND == "memory":
+        return MemoryStore()
+    if config.STORE_BACKEND == "sqlite":
+        return SQLiteStore(config.STORE_PATH)
+    raise ValueError(f"不支持的存储类型: {config.STORE_BACKEND}")
@@ -1,7 +1,13 @@
+import json
+
 from langchain.agents import tool
 
+from base.struct_bank import get_question_bank
+
 
 @tool
-def search_question():
-    """返回当前的时间"""
-    return ""
+def search_question(keyword: str) -> str:
+    """根据技术关键词从题库中检索面试题和参考答案，多个关键词用逗号分隔"""
+    keywords = [k for k in keyword.replace("，", ",").split(",") if k.strip()]
+    records = get_question_bank().search(keywords, limit=3)
+    return json.dumps([{"human": r['human'], "ai": r['ai']} for r in records], ensure_ascii=False)
@@ -1,15 +1,248 @@
 import json
 import logging
+import re
+from functools import lru_cache
 
 
-def load_json(jsons: str):
+# ```json ... ``` 代码块
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL | re.IGNORECASE)
+# 对象或数组结尾前多余的逗号
+TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+# 出现在json结构位置（键名、值的两侧）的中文引号
+OPEN_QUOTE_PATTERN = re.compile(r"([{,:\[]\s*)[“”]")
+CLOSE_QUOTE_PATTERN = re.compile(r"[“”](\s*[:,}\]])")
+# Python风格的布尔值和空值
+PY_LITERAL_PATTERN = re.compile(r"(:\s*)(True|False|None)\b")
+PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def load_json(jsons: str, partial: bool = False):
     """
     将llm返回的字符串类型的json格式数据变为字典返回
+    1. 优先直接解析第一个{到最后一个}之间的内容，字符串值中包含```代码块的合法json也能解析
+    2. 解析失败时去掉代码块标记后再解析，仍失败时依次修复常见问题：多余的逗号、中文引号、Python风格的布尔值，
+       最后补全被截断的json
+    3. partial为True时用于解析流式输出中尚未完整的json
+    无法解析时返回None
+    """
+    if not jsons:
+        return None
+    new_json = _json_span(jsons)
+    if new_json is not None:
+        try:
+            return json.loads(new_json)
+        except ValueError:
+            pass
+    fenced = FENCE_PATTERN.search(jsons)
+    if fenced:
+        jsons = fenced.group(1)
+        new_json = _json_span(jsons)
+        if new_json is not None:
+            try:
+                return json.loads(new_json)
+            except ValueError:
+                pass
+    if new_json is None:
+        if not partial:
+            logging.error(f"解析输出json数据错误：{jsons}")
+        return None
+    repaired = TRAILING_COMMA_PATTERN.sub(r"\1", new_json)
+    repaired = OPEN_QUOTE_PATTERN.sub(r'\1"', repaired)
+    repaired = CLOSE_QUOTE_PATTERN.sub(r'"\1', repaired)
+    repaired = PY_LITERAL_PATTERN.sub(lambda m: m.group(1) + PY_LITERALS[m.group(2)], repaired)
+    truncated = jsons.rfind("}") < jsons.find("{")
+    for candidate in (repaired, _complete_json(jsons[jsons.find("{"):] if truncated else repaired)):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    if not partial:
+        logging.error(f"解析输出json数据错误：{jsons}")
+    return None
+
+
+def _json_span(text: str):
+    """
+    返回第一个{到最后一个}之间的内容，没有}时返回第一个{之后的全部内容，没有{时返回None
+    """
+    s_index = text.find("{")
+    if s_index < 0:
+        return None
+    e_index = text.rfind("}") + 1
+    return text[s_index:e_index] if e_index > s_index else text[s_index:]
+
+
+def _complete_json(text: str) -> str:
+    """
+    补全被截断的json：闭合未结束的字符串，去掉末尾不完整的键值对，按嵌套顺序补上括号
+    """
+    # 每一层：[结束括号, 状态, 当前键的起始位置]，对象的状态为key/colon/value/comma，数组的状态为value/comma
+    stack, in_string, escaped = [], False, False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if stack:
+                    stack[-1][1] = "colon" if stack[-1][1] == "key" else "comma"
+        elif char == '"':
+            in_string = True
+            if stack and stack[-1][1] == "key":
+                stack[-1][2] = i
+        elif char in "{[":
+            stack.append(["}", "key", None] if char == "{" else ["]", "value", None])
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[:i + 1]
+            stack[-1][1] = "comma"
+        elif stack and char == ":":
+            stack[-1][1] = "value"
+        elif stack and char == ",":
+            stack[-1][1] = "key" if stack[-1][0] == "}" else "value"
+    if not stack:
+        return text
+    closer, state, key_start = stack[-1]
+    if in_string and state == "value":
+        text += '"'
+    elif closer == "}" and key_start is not None and (
+            in_string or state in ("colon", "value") or re.search(r":\s*[a-z-]+$", text)):
+        # 键不完整、没有值或值（true/false/null）被截断时去掉整个键
+        text = text[:key_start]
+    elif re.search(r"[a-z-]+$", text) and state != "comma":
+        text = re.sub(r"[a-z-]+$", "", text)
+    text = re.sub(r"[\s,]+$", "", text)
+    return text + "".join(closer for closer, _, _ in reversed(stack))
+
+
+def validate_json(data, schema: dict) -> tuple[dict, list]:
+    """
+    按schema校验llm输出的json，返回(转换后的数据, 缺失或不合法的字段)
+    schema为{字段: 类型}，类型为str/int/bool，或由可选值组成的tuple
+    """
+    if not isinstance(data, dict):
+        return {}, list(schema)
+    data, invalid = dict(data), []
+    for field, expected in schema.items():
+        value = data.get(field)
+        if value is None:
+            invalid.append(field)
+        elif isinstance(expected, tuple):
+            if value not in expected:
+                invalid.append(field)
+        elif expected is int:
+            try:
+                data[field] = int(float(value))
+            except (TypeError, ValueError):
+                invalid.append(field)
+        elif expected is bool:
+            if isinstance(value, str) and value.lower() in ("true", "false"):
+                data[field] = value.lower() == "true"
+            elif not isinstance(value, bool):
+                invalid.append(field)
+        elif expected is str:
+            if isinstance(value, (dict, list)):
+                invalid.append(field)
+            else:
+                data[field] = str(value)
+    return data, invalid
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(encoding_name: str):
+    """
+    加载并缓存tokenizer，加载失败时返回None
+    tiktoken首次使用时需要联网下载词表，离线环境下使用估算的token数是预期行为，可通过TIKTOKEN_CACHE_DIR预置词表
     """
     try:
-        s_index = jsons.find("{")
-        e_index = jsons.rfind("}") + 1
-        new_json = jsons[s_index:e_index]
-        return json.loads(new_json)
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
     except Exception as e:
-        logging.error(f"解析输出json数据错误：{jsons}")
\ No newline at end of file
+        logging.warning(f"加载tokenizer失败（离线环境属正常情况），使用估算的token数：{e}")
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """
+    统计文本的token数，无法加载tokenizer时按中文每字1个token、其他字符每4个1个token估算
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(re.findall(r"[\u4e00-\u9fff]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class JsonFieldStreamer:
+    """
+    从llm流式输出的json片段中增量解析指定字符串字段的值
+    每次feed只扫描新到达的字符，返回本次新解析出的字段内容
+    """
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field: str):
+        self.key = f'"{field}"'
+        self.buffer = ""
+        self.pos = 0
+        # key: 查找字段名 colon: 查找冒号 quote: 查找值的起始引号 value: 解析字段值 done: 解析完成
+        self.state = "key"
+        self.value = ""
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        out = []
+        buffer = self.buffer
+        while self.pos < len(buffer) and self.state != "done":
+            if self.state == "key":
+                index = buffer.find(self.key, self.pos)
+                if index < 0:
+                    # 字段名可能被截断在两个片段之间，保留末尾继续匹配
+                    self.pos = max(self.pos, len(buffer) - len(self.key) + 1)
+                    break
+                self.pos = index + len(self.key)
+                self.state = "colon"
+            elif self.state in ("colon", "quote"):
+                char = buffer[self.pos]
+                self.pos += 1
+                if char.isspace():
+                    continue
+                if self.state == "colon" and char == ":":
+                    self.state = "quote"
+                elif self.state == "quote" and char == '"':
+                    self.state = "value"
+                else:
+                    # 不是目标字段（例如出现在字符串中的同名文本），重新查找
+                    self.state = "key"
+            else:
+                char = buffer[self.pos]
+                if char == '"':
+                    self.pos += 1
+                    self.state = "done"
+                elif char == "\\":
+                    if self.pos + 1 >= len(buffer):
+                        break
+                    escape = buffer[self.pos + 1]
+                    if escape == "u":
+                        if self.pos + 6 > len(buffer):
+                            break
+                        out.append(chr(int(buffer[self.pos + 2:self.pos + 6], 16)))
+                        self.pos += 6
+                    else:
+                        out.append(self._ESCAPES.get(escape, escape))
+                        self.pos += 2
+                else:
+                    # 一次取出到下一个引号或转义符之前的全部字符
+                    end = self.pos
+                    while end < len(buffer) and buffer[end] not in '"\\':
+                        end += 1
+                    out.append(buffer[self.pos:end])
+                    self.pos = end
+        delta = "".join(out)
+        self.value += delta
+        return delta
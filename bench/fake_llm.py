@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import LLM
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# 生成问题时可选的技术关键词，提示词中没有关键词时使用
+DEFAULT_KEYWORDS = ["Python", "Redis", "MySQL", "Docker", "Kubernetes", "LangChain", "Kafka", "HTTP"]
+# 聊天提示词末尾的目标关键词列表
+TARGET_KEYWORD_PATTERN = re.compile(r"\[(\"[^\]]*\")\]")
+
+
+def _seed(text: str) -> int:
+    # 相同的提示词得到相同的输出，便于对比不同版本的测试结果
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _keywords(text: str) -> list:
+    match = TARGET_KEYWORD_PATTERN.findall(text)
+    if match:
+        try:
+            return json.loads(f"[{match[-1]}]") or DEFAULT_KEYWORDS
+        except ValueError:
+            pass
+    return DEFAULT_KEYWORDS
+
+
+def canned_output(text: str) -> str:
+    """
+    按提示词返回固定格式的输出，格式与各提示词模板要求的json一致
+    """
+    seed = _seed(text)
+    if "需要补全的字段" in text:
+        return "{}"
+    if "ai_scoring" in text:
+        # 评估应聘者回答（answer_template）
+        scoring = 40 + seed % 55
+        return json.dumps({
+            "current_stage": "asking",
+            "current": "请继续深入提问" if scoring >= 60 else "换一个问题继续提问",
+            "ai_scoring": scoring,
+            "ai_comment": f"回答覆盖了部分要点，评分{scoring}"
+        }, ensure_ascii=False)
+    if '"keywords"' in text or "分析简历" in text:
+        # 提取简历、岗位要求、岗位名称的关键词
+        start = seed % len(DEFAULT_KEYWORDS)
+        return json.dumps({"keywords": (DEFAULT_KEYWORDS[start:] + DEFAULT_KEYWORDS[:start])[:6]}, ensure_ascii=False)
+    if "应聘者问题" in text:
+        # 回答应聘者的问题（interview_template）
+        return json.dumps({"human": "贵公司的技术栈是怎样的？", "ai": "我们主要使用Python和Go，部署在Kubernetes上",
+                           "finished": seed % 2 == 0}, ensure_ascii=False)
+    if "新的摘要" in text:
+        # 折叠对话记录的摘要（summary_template），聊天提示词中的"此前的面试摘要"不会命中
+        return "应聘者回答了多个技术问题，整体表现中等。"
+    # 生成面试问题和参考答案（chat_template）
+    keywords = _keywords(text)
+    keyword = keywords[seed % len(keywords)]
+    return json.dumps({
+        "human": f"请解释{keyword}的核心原理，并结合项目说明你是如何使用它的？（#{seed % 1000}）",
+        "ai": f"{keyword}的核心原理包括其数据结构、并发模型与容错机制，项目中主要用于提升系统的吞吐量和可用性。"
+    }, ensure_ascii=False)
+
+
+def _chunks(text: str, chunk_size: int) -> list:
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    代替ChatOpenAI的本地聊天模型：首个token前等待latency秒，之后按tokens_per_second的速率流式输出
+    每个片段按chunk_size个字符计为一个token
+    """
+    latency: float = 0.3
+    tokens_per_second: float = 50
+    chunk_size: int = 4
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _output(self, messages: List[BaseMessage]) -> str:
+        return canned_output("\n".join(str(m.content) for m in messages))
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._output(messages)
+        time.sleep(self.latency + len(_chunks(text, self.chunk_size)) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        text = self._output(messages)
+        await asyncio.sleep(self.latency + len(_chunks(text, self.chunk_size)) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for i, piece in enumerate(_chunks(self._output(messages), self.chunk_size)):
+            if i:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for i, piece in enumerate(_chunks(self._output(messages), self.chunk_size)):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+class FakeCompletionModel(LLM):
+    """
+    代替OpenAI补全模型的本地模型，耗时与FakeChatModel的计算方式相同，不使用流式输出
+    """
+    latency: float = 0.3
+    tokens_per_second: float = 50
+    chunk_size: int = 4
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-completion"
+
+    def _delay(self, text: str) -> float:
+        return self.latency + len(_chunks(text, self.chunk_size)) / self.tokens_per_second
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        text = canned_output(prompt)
+        time.sleep(self._delay(text))
+        return text
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        text = canned_output(prompt)
+        await asyncio.sleep(self._delay(text))
+        return text
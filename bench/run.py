@@ -0,0 +1,222 @@
+"""
+离线压测：用本地模型代替ChatOpenAI/OpenAI，在进程内通过FastAPI应用跑完整的面试流程
+（开始面试 -> N次回答 -> 结束面试 -> 等待报告 -> 下载报告），逐级提高并发，
+输出各环节的p50/p99延迟、进程RSS峰值和吞吐量
+本地模型通过模型路由注入，模型路由、llm调度器的排队限流（按LLM_*配置）和兜底都在压测范围内
+
+示例：python bench/run.py --concurrency 1,4,16 --interviews 32 --answers 3 --latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 面试各环节，按流程顺序输出
+STAGES = ("start", "answer", "finish", "report", "download", "interview")
+# 足够长、且包含技术关键词，避免被规则引擎直接评分，每次回答都经过llm评估
+ANSWER = "GIL是CPython的全局解释器锁，同一时刻只有一个线程执行Python字节码，IO密集型任务可以用多线程，CPU密集型任务一般用多进程"
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def rss_mb() -> float:
+    """
+    当前进程的常驻内存（MB），无法读取/proc时使用峰值
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS上单位为字节，Linux上为KB
+    return maxrss / 1024 / 1024 if sys.platform == "darwin" else maxrss / 1024
+
+
+def histogram_quantile(buckets: tuple, counts: list, q: float) -> float:
+    """
+    按直方图分桶估算分位数，落在+Inf桶中时返回最大的上界
+    """
+    total = sum(counts)
+    if total == 0:
+        return 0.0
+    rank, cumulative, lower = q / 100 * total, 0, 0.0
+    for bound, count in zip(buckets, counts):
+        if cumulative + count >= rank and count:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return buckets[-1]
+
+
+def server_stages(registry, before: dict) -> tuple[dict, dict]:
+    """
+    服务端各面试环节在本级压测中的耗时分布（与before相减），同时返回当前的累计值
+    """
+    histogram = registry._metrics["interview_stage_duration_seconds"][3]
+    with registry._lock:
+        current = {labels[0]: (list(counts), count) for labels, (counts, _, count) in histogram.values.items()}
+    result = {}
+    for stage, (counts, count) in current.items():
+        prev_counts, prev_count = before.get(stage, ([0] * len(counts), 0))
+        delta = [a - b for a, b in zip(counts, prev_counts)]
+        if count - prev_count <= 0:
+            continue
+        # 超过最大上界的部分计入+Inf桶，不在counts中
+        result[stage] = {
+            "count": count - prev_count,
+            "p50": histogram_quantile(histogram.buckets, delta + [count - prev_count - sum(delta)], 50),
+            "p99": histogram_quantile(histogram.buckets, delta + [count - prev_count - sum(delta)], 99),
+        }
+    return result, current
+
+
+async def run_interview(client, answers: int, timings: dict, errors: dict, rss: dict):
+    """
+    跑完一场面试，记录各环节耗时和各环节结束时的进程RSS峰值
+    """
+    def record(stage: str, seconds: float):
+        timings[stage].append(seconds)
+        rss[stage] = max(rss[stage], rss_mb())
+
+    async def timed(stage: str, coro):
+        start = time.perf_counter()
+        response = await coro
+        record(stage, time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors[stage] += 1
+            raise RuntimeError(f"{stage}: {response.status_code} {response.text[:200]}")
+        return response
+
+    begin = time.perf_counter()
+    try:
+        response = await timed("start", client.post("/api/start-interview", data={
+            "job_description": "负责基于Python和LangChain的大模型应用开发，熟悉Redis、MySQL、Docker",
+            "job_title": "Python后端工程师",
+            "keywords": "",
+        }))
+        interview_id = response.json()["interview_id"]
+        for _ in range(answers):
+            response = await timed("answer", client.post("/api/submit-answer", json={
+                "interview_id": interview_id, "question": "", "answer": ANSWER}))
+            if response.json()["finished"]:
+                break
+        response = await timed("finish", client.post("/api/finish-interview", json={"interview_id": interview_id}))
+        report_id = response.json()["report_id"]
+        # 报告在后台生成，从结束面试到报告可下载的耗时计为report
+        start = time.perf_counter()
+        while True:
+            report = (await client.post("/api/get-report", json={"new_interviewId": report_id})).json()
+            if report["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        record("report", time.perf_counter() - start)
+        if report["status"] == "failed":
+            errors["report"] += 1
+            return
+        await timed("download", client.get(f"/api/download-report/{report_id}"))
+        record("interview", time.perf_counter() - begin)
+    except Exception as e:
+        errors["interview"] += 1
+        print(f"面试失败: {e}", file=sys.stderr)
+
+
+async def run_level(app, concurrency: int, interviews: int, answers: int) -> dict:
+    import httpx
+
+    timings, errors, rss = defaultdict(list), defaultdict(int), defaultdict(float)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(client):
+        async with semaphore:
+            await run_interview(client, answers, timings, errors, rss)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(interviews)))
+        elapsed = time.perf_counter() - start
+    requests = sum(len(timings[s]) for s in STAGES if s not in ("report", "interview"))
+    return {
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "interviews_per_second": len(timings["interview"]) / elapsed,
+        "requests_per_second": requests / elapsed,
+        "rss_mb": rss_mb(),
+        "stages": {s: {"count": len(timings[s]), "p50": percentile(timings[s], 50),
+                       "p99": percentile(timings[s], 99), "errors": errors[s], "rss_mb": rss[s]} for s in STAGES},
+    }
+
+
+def print_level(result: dict):
+    print(f"\n并发 {result['concurrency']}：耗时 {result['elapsed']:.2f}s，"
+          f"{result['interviews_per_second']:.2f} 场面试/s，{result['requests_per_second']:.2f} 请求/s，"
+          f"RSS {result['rss_mb']:.1f}MB")
+    print(f"  {'环节':<28}{'次数':>6}{'p50(s)':>10}{'p99(s)':>10}{'失败':>6}{'RSS(MB)':>10}")
+    for stage, item in result["stages"].items():
+        print(f"  {stage:<30}{item['count']:>6}{item['p50']:>10.3f}{item['p99']:>10.3f}{item['errors']:>6}"
+              f"{item['rss_mb']:>10.1f}")
+    for stage, item in result["server_stages"].items():
+        print(f"  {'server:' + stage:<30}{item['count']:>6}{item['p50']:>10.3f}{item['p99']:>10.3f}{'':>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模型对面试流程进行离线压测")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="逐级提高的并发数，逗号分隔")
+    parser.add_argument("--interviews", type=int, default=16, help="每一级并发跑的面试场数")
+    parser.add_argument("--answers", type=int, default=3, help="每场面试的回答次数")
+    parser.add_argument("--latency", type=float, default=0.3, help="模型输出首个token前的延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="模型流式输出的速率")
+    parser.add_argument("--keyword-cache", action="store_true", help="开启关键词缓存（默认关闭，每场面试都提取关键词）")
+    parser.add_argument("--output", default=None, help="结果另存为json文件")
+    args = parser.parse_args()
+
+    # 需要在导入config之前设置
+    os.environ.setdefault("AZ_API_KEY", "bench")
+    os.environ.setdefault("POLO_API_BASE", "http://127.0.0.1:9")
+    os.environ["KEYWORD_CACHE_ENABLED"] = "true" if args.keyword_cache else "false"
+    os.environ.setdefault("STORE_BACKEND", "memory")
+    sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "backend"), os.path.dirname(os.path.abspath(__file__))]
+    os.chdir(os.path.join(ROOT_DIR, "backend"))
+
+    import main as app_main
+    from base.struct_metrics import get_metrics
+    from fake_llm import FakeChatModel, FakeCompletionModel
+
+    # 在模型路由中用本地模型代替每个模型客户端，请求仍然经过路由、调度器和兜底
+    router = app_main.sessions.router
+    for spec in {spec for specs in router.routes.values() for spec in specs}:
+        model_class = FakeChatModel if spec.startswith("chat:") else FakeCompletionModel
+        router._models[spec] = model_class(latency=args.latency, tokens_per_second=args.tokens_per_second)
+
+    registry = get_metrics()
+    _, before = server_stages(registry, {})
+    results = []
+    print(f"RSS {rss_mb():.1f}MB")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        result = asyncio.run(run_level(app_main.app, concurrency, args.interviews, args.answers))
+        result["server_stages"], before = server_stages(registry, before)
+        print_level(result)
+        results.append(result)
+    app_main.report_jobs.shutdown()
+    app_main.store.close()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
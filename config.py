@@ -1,3 +1,4 @@
+import json
 import os
 
 # 基础配置
@@ -16,4 +17,143 @@ TTF_FILE = os.path.join(BASE_DIR, "frontend/msyh.ttc")
 ALLOWED_FILE_TYPES = ["application/pdf"]
 
 # 最大文件大小 (10MB)
-MAX_FILE_SIZE = 10 * 1024 * 1024
\ No newline at end of file
+MAX_FILE_SIZE = 10 * 1024 * 1024
+# 上传请求中除简历外表单字段的最大大小
+MAX_FORM_OVERHEAD = 1024 * 1024
+# 保存上传文件时每次读写的块大小
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# 面试会话配置
+# 单个进程同时保留的最大面试会话数，超出后按最近最少使用淘汰
+SESSION_MAX_NUM = int(os.getenv("SESSION_MAX_NUM", 500))
+# 面试会话空闲超时时间（秒）
+SESSION_TTL = int(os.getenv("SESSION_TTL", 2 * 60 * 60))
+
+# 大模型调用配置
+# 单个请求等待大模型的最长时间（秒）
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+# 检查客户端是否断开连接的间隔（秒）
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.5))
+# 简历/岗位要求/岗位名称每一路关键词提取的超时时间（秒）
+KEYWORD_BRANCH_TIMEOUT = float(os.getenv("KEYWORD_BRANCH_TIMEOUT", 20))
+# 提示词前缀缓存的路由键（prompt_cache_key），相同前缀的请求优先路由到同一缓存，为空时不传
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "")
+# llm调用录制/回放：off不使用，record录制真实调用到磁带，replay从磁带回放（不访问大模型服务）
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", os.path.join(BASE_DIR, "backend/static/cassettes/default.jsonl.gz"))
+# 回放耗时相对录制时的比例，1为原始耗时，0为不等待
+CASSETTE_TIME_SCALE = float(os.getenv("CASSETTE_TIME_SCALE", 1.0))
+# 回放时磁带中没有对应调用：true报错，false调用真实的大模型
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "true").lower() == "true"
+# 模型路由：模型写作"类型:模型名"，类型为chat（聊天模型）或completion（补全模型）
+CHAT_MODEL = os.getenv("CHAT_MODEL", "chat:gpt-4o-mini-2024-07-18")
+COMPLETION_MODEL = os.getenv("COMPLETION_MODEL", "completion:gpt-3.5-turbo-instruct")
+# 各面试环节依次尝试的模型，前一个出错时使用下一个，p95耗时超出预算时优先使用预算内的模型
+# 例如 {"answer_scoring": ["completion:gpt-3.5-turbo-instruct", "chat:gpt-4o-mini-2024-07-18"]}
+MODEL_ROUTES = {
+    "resume_analysis": [COMPLETION_MODEL],
+    "jd_parsing": [COMPLETION_MODEL],
+    "title_expansion": [COMPLETION_MODEL],
+    "question_generation": [CHAT_MODEL],
+    "answer_scoring": [COMPLETION_MODEL],
+    "candidate_qa": [CHAT_MODEL],
+    **json.loads(os.getenv("MODEL_ROUTES", "{}")),
+}
+# 各面试环节单次llm调用的p95耗时预算（秒），未配置的环节不按耗时降级
+MODEL_SLO = {
+    "resume_analysis": 15,
+    "jd_parsing": 10,
+    "title_expansion": 10,
+    "question_generation": 8,
+    "answer_scoring": 6,
+    "candidate_qa": 8,
+    **json.loads(os.getenv("MODEL_SLO", "{}")),
+}
+# 统计p95耗时的时间窗口（秒），窗口内样本数不足时不降级；降级后窗口内的慢样本过期即恢复使用首选模型
+ROUTER_WINDOW = float(os.getenv("ROUTER_WINDOW", 60))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", 10))
+# llm调用的准入控制，对应大模型服务商的限额，多worker部署时按worker数分摊
+# 同时进行的llm调用数
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+# 每分钟的请求数、token数限额，0表示不限制
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", 200000))
+# 计算token限额时每次调用预估的输出token数
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", 256))
+# 排队的llm调用数上限和最长排队时间（秒），超出后接口返回429
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", 128))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 10))
+# 所有llm客户端共享的http连接池
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+# 空闲连接保持的时间（秒）
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+# 安装了h2时使用HTTP/2，多个请求复用同一个连接
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# 关键词提取缓存配置
+KEYWORD_CACHE_ENABLED = os.getenv("KEYWORD_CACHE_ENABLED", "true").lower() == "true"
+KEYWORD_CACHE_PATH = os.path.join(BASE_DIR, "backend/static/cache/keywords.sqlite3")
+KEYWORD_CACHE_MAX_ENTRIES = int(os.getenv("KEYWORD_CACHE_MAX_ENTRIES", 10000))
+KEYWORD_CACHE_MAX_BYTES = int(os.getenv("KEYWORD_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# 规则评估：结束面试、未作答、表示不会、过短的回答直接由规则打分，不调用llm
+RULE_ENGINE_ENABLED = os.getenv("RULE_ENGINE_ENABLED", "true").lower() == "true"
+# 去除空白和标点后短于该长度的回答视为过短
+RULE_MIN_ANSWER_LENGTH = int(os.getenv("RULE_MIN_ANSWER_LENGTH", 4))
+# 短于该长度且没有提到标准答案中任何关键词的回答直接判为低分
+RULE_SHORT_ANSWER_LENGTH = int(os.getenv("RULE_SHORT_ANSWER_LENGTH", 15))
+# 回答评分模式：llm（由llm评分）、hint（本地评分作为参考写入评分提示词）、cheap（本地评分代替llm，用于大批量初筛）
+SCORING_MODE = os.getenv("SCORING_MODE", "llm")
+# 本地评分中回答与参考答案的相似度达到该值即视为满分
+SCORE_FULL_SIMILARITY = float(os.getenv("SCORE_FULL_SIMILARITY", 0.6))
+# cheap模式下本地评分达到该分数时继续深入提问，否则换一个问题
+SCORE_PASS_LINE = int(os.getenv("SCORE_PASS_LINE", 60))
+# 题库配置
+QUESTION_BANK_DIR = os.path.join(BASE_DIR, "backend/static/question_bank")
+# 第一个问题优先直接使用题库中的题目
+QUESTION_BANK_FIRST = os.getenv("QUESTION_BANK_FIRST", "true").lower() == "true"
+# 换一个问题时也优先直接使用题库中的题目
+QUESTION_BANK_FOLLOWING = os.getenv("QUESTION_BANK_FOLLOWING", "false").lower() == "true"
+# 由llm生成新问题时，作为参考附带的题库题目数
+QUESTION_BANK_CONTEXT = int(os.getenv("QUESTION_BANK_CONTEXT", 2))
+# 岗位批量预生成配置
+# 同时进行的llm调用数
+PREGENERATE_CONCURRENCY = int(os.getenv("PREGENERATE_CONCURRENCY", 4))
+# 最多为多少个关键词生成面试题
+PREGENERATE_MAX_KEYWORDS = int(os.getenv("PREGENERATE_MAX_KEYWORDS", 30))
+# 预生成接口的超时时间（秒）
+PREGENERATE_TIMEOUT = float(os.getenv("PREGENERATE_TIMEOUT", 600))
+# 评估回答的同时推测生成下一个问题，评估结果仍为继续提问时直接采用
+SPECULATIVE_QUESTION = os.getenv("SPECULATIVE_QUESTION", "false").lower() == "true"
+
+# 对话记忆配置
+# chat_history的token预算，超出后较早的对话折叠为摘要，0表示不限制
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", 0))
+# 始终原样保留的最近问答轮数
+MEMORY_KEEP_TURNS = int(os.getenv("MEMORY_KEEP_TURNS", 2))
+
+# 简历解析配置
+# 简历文本的token上限，达到上限后不再解析后续页面
+RESUME_MAX_TOKENS = int(os.getenv("RESUME_MAX_TOKENS", 3000))
+RESUME_CACHE_DIR = os.path.join(BASE_DIR, "backend/static/cache/resume")
+# 内存中缓存的简历文本数量
+RESUME_CACHE_MAX_NUM = int(os.getenv("RESUME_CACHE_MAX_NUM", 256))
+
+# 后台生成面试报告的进程数，ReportLab渲染受GIL限制，在独立进程中生成
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 2))
+# 等待其他worker生成的报告时轮询存储的间隔和最长等待时间（秒）
+REPORT_POLL_INTERVAL = float(os.getenv("REPORT_POLL_INTERVAL", 0.5))
+REPORT_WAIT_TIMEOUT = float(os.getenv("REPORT_WAIT_TIMEOUT", 120))
+
+# 面试数据存储配置
+# 存储类型：sqlite（多个worker共享）或memory（仅用于单进程调试）
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite")
+STORE_PATH = os.path.join(BASE_DIR, "backend/static/data/interviews.sqlite3")
+# 批量写入的间隔（秒）和缓冲区记录数上限
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", 0.5))
+STORE_BATCH_SIZE = int(os.getenv("STORE_BATCH_SIZE", 100))
+# 已完成面试的保留时间（秒），过期后删除面试信息、对话记录和报告信息
+STORE_TTL = int(os.getenv("STORE_TTL", 7 * 24 * 60 * 60))
+# 清理过期面试的间隔（秒）
+STORE_PURGE_INTERVAL = float(os.getenv("STORE_PURGE_INTERVAL", 10 * 60))
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models import FakeListChatModel, FakeListLLM
+
+from base.struct_metrics import track_stage
+from base.struct_router import ModelRouter
+
+
+class FailingLLM(FakeListLLM):
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        raise RuntimeError("服务不可用")
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        raise RuntimeError("服务不可用")
+
+
+def _router(models: dict, slo=None, **kwargs) -> ModelRouter:
+    routes = {"question": list(models)}
+    return ModelRouter(routes, slo or {}, models.__getitem__, **kwargs)
+
+
+def test_router_falls_back_to_next_model():
+    router = _router({"completion:a": FailingLLM(responses=["-"]), "completion:b": FakeListLLM(responses=["兜底"])})
+    with track_stage("question"):
+        assert router.completion_model().invoke("提问") == "兜底"
+    assert router.fallbacks == {"question": 1}
+    assert router.p95("completion:a") is None
+
+
+def test_router_chat_stream_falls_back_to_completion_model():
+    router = _router({"chat:a": FailingLLM(responses=["-"]), "completion:b": FakeListLLM(responses=["兜底"])})
+
+    async def stream():
+        with track_stage("question"):
+            return "".join([chunk.content async for chunk in router.chat_model().astream("提问")])
+
+    assert asyncio.run(stream()) == "兜底"
+    assert router.fallbacks == {"question": 1}
+
+
+def test_router_raises_when_all_models_fail():
+    router = _router({"completion:a": FailingLLM(responses=["-"]), "completion:b": FailingLLM(responses=["-"])})
+    with track_stage("question"), pytest.raises(RuntimeError):
+        router.completion_model().invoke("提问")
+    assert router.fallbacks == {"question": 1}
+
+
+def test_router_downgrades_slow_model_by_p95():
+    router = _router({"chat:a": FakeListChatModel(responses=["a"]), "completion:b": FakeListLLM(responses=["b"])},
+                     slo={"question": 2.0}, min_samples=3)
+    router.observe("chat:a", 0.5)
+    router.observe("chat:a", 3.0)
+    # 样本数不足时不降级
+    assert router.candidates("question", []) == ["chat:a", "completion:b"]
+    assert router.downgrades == {}
+    router.observe("chat:a", 3.5)
+    assert router.p95("chat:a") == 3.5
+    assert router.candidates("question", []) == ["completion:b", "chat:a"]
+    assert router.downgrades == {"question": 1}
+    with track_stage("question"):
+        assert router.chat_model().invoke("提问").content == "b"
+    # 未配置预算的环节不降级
+    assert router.candidates("summary", ["chat:a"]) == ["chat:a"]
+
+
+def test_router_recovers_after_slow_samples_expire():
+    router = _router({"chat:a": FakeListChatModel(responses=["a"]), "completion:b": FakeListLLM(responses=["b"])},
+                     slo={"question": 1.0}, window=0, min_samples=1)
+    router.observe("chat:a", 5.0)
+    assert router.candidates("question", []) == ["chat:a", "completion:b"]
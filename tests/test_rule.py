@@ -0,0 +1,22 @@
+from base.struct_rule import AhoCorasick, keyword_matcher
+
+
+def test_aho_corasick_finds_overlapping_keywords():
+    matcher = AhoCorasick(["he", "she", "his", "hers"])
+    assert matcher.findall("ushers") == {"he", "she", "hers"}
+    assert matcher.findall("this") == {"his"}
+
+
+def test_aho_corasick_keyword_inside_longer_keyword():
+    matcher = AhoCorasick(["Redis", "Redis集群", "集群模式"])
+    assert matcher.findall("我们用的是redis集群模式") == {"Redis", "Redis集群", "集群模式"}
+    assert matcher.findall("用过Redi") == set()
+
+
+def test_aho_corasick_is_case_insensitive_and_keeps_original_word():
+    assert AhoCorasick(["MySQL"]).findall("mysql的索引") == {"MySQL"}
+
+
+def test_keyword_matcher_ignores_single_characters():
+    matcher = keyword_matcher(["C", " Go ", "Java"])
+    assert matcher.findall("C语言和Go") == {"Go"}
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from base.struct_scheduler import (PRIORITY_BACKGROUND, PRIORITY_EXTRACTION, PRIORITY_TURN, LLMBusyError,
+                                   LLMScheduler, TokenBucket)
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_scheduler_grants_by_priority():
+    scheduler = LLMScheduler(max_concurrency=1)
+    scheduler.acquire(0)
+    order = []
+
+    def call(priority):
+        scheduler.acquire(0, priority)
+        order.append(priority)
+        scheduler.release()
+
+    threads = []
+    for priority in (PRIORITY_BACKGROUND, PRIORITY_EXTRACTION, PRIORITY_TURN):
+        threads.append(threading.Thread(target=call, args=(priority,)))
+        threads[-1].start()
+        _wait_until(lambda: sum(scheduler.queued().values()) == len(threads))
+    scheduler.release()
+    for thread in threads:
+        thread.join(2)
+    assert order == [PRIORITY_TURN, PRIORITY_EXTRACTION, PRIORITY_BACKGROUND]
+    assert scheduler.running == 0
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.delay(60, now) == 0
+    bucket.take(60, now)
+    assert bucket.delay(1, now) == pytest.approx(1.0)
+    assert bucket.delay(1, now + 0.5) == pytest.approx(0.5)
+    assert bucket.delay(1, now + 1) == 0
+    # 请求量超过容量时按容量计算，不会永远等待
+    assert bucket.delay(1000, now + 1) == pytest.approx(59.0)
+
+
+def test_token_bucket_zero_means_unlimited():
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 6, bucket.updated)
+    assert bucket.delay(10 ** 6, bucket.updated) == 0
+
+
+def test_scheduler_rejects_when_queue_full():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+    scheduler.acquire(0)
+    waiter = threading.Thread(target=lambda: (scheduler.acquire(0), scheduler.release()))
+    waiter.start()
+    _wait_until(lambda: scheduler.queued()["turn"] == 1)
+    with pytest.raises(LLMBusyError) as info:
+        scheduler.admit(PRIORITY_TURN)
+    # 前面还有1个排队的调用，加上自身，按平均耗时1秒估算
+    assert info.value.retry_after == 2
+    with pytest.raises(LLMBusyError):
+        scheduler.acquire(0, PRIORITY_BACKGROUND)
+    assert scheduler.rejected == {"turn": 1, "background": 1}
+    scheduler.release()
+    waiter.join(2)
+    assert scheduler.running == 0
+
+
+def test_scheduler_queue_timeout_uses_request_refill():
+    scheduler = LLMScheduler(max_concurrency=4, requests_per_minute=1, max_wait=0.05)
+    scheduler.acquire(0)
+    with pytest.raises(LLMBusyError) as info:
+        scheduler.acquire(0)
+    # 每分钟1个请求的额度已用完，重试前需要等额度补充
+    assert 55 <= info.value.retry_after <= 60
+    assert scheduler.queued()["turn"] == 0
+    assert scheduler.running == 1
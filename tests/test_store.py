@@ -0,0 +1,85 @@
+import pytest
+
+from base.struct_store import MemoryStore, SessionConflictError, SQLiteStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        kwargs.setdefault("purge_interval", 3600)
+        if request.param == "memory":
+            store = MemoryStore(**kwargs)
+        else:
+            store = SQLiteStore(str(tmp_path / "store.db"), flush_interval=3600, **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_store_put_get(make_store):
+    store = make_store()
+    turns = [{"human": "问题", "ai": "回答"}, {"human": "下一个问题", "ai": ""}]
+    store.put_interview("i1", {"status": "processing", "keywords": ["Redis"]})
+    store.put_turns("i1", turns)
+    store.put_report("r1", {"interview_id": "i1", "status": "completed"})
+    assert store.get_interview("i1") == {"status": "processing", "keywords": ["Redis"]}
+    assert store.get_turns("i1") == turns
+    assert store.get_report("r1") == {"interview_id": "i1", "status": "completed"}
+    assert store.get_interview("missing") is None
+    assert store.get_turns("missing") == []
+    assert store.get_report("missing") is None
+    store.flush()
+    assert store.get_turns("i1") == turns
+    store.delete_interview("i1")
+    assert store.get_interview("i1") is None
+
+
+def test_store_session_versions(make_store):
+    store = make_store()
+    assert store.get_session("i1") is None
+    assert store.put_session("i1", {"step": 1}) == 1
+    assert store.put_session("i1", {"step": 2}, expected_version=1) == 2
+    assert store.get_session("i1") == (2, {"step": 2})
+    assert store.get_session_version("i1") == 2
+    # 基于旧版本保存（其他worker已更新）时不覆盖
+    with pytest.raises(SessionConflictError):
+        store.put_session("i1", {"step": 3}, expected_version=1)
+    with pytest.raises(SessionConflictError):
+        store.put_session("i1", {"step": 3})
+    assert store.get_session("i1") == (2, {"step": 2})
+    store.delete_session("i1")
+    assert store.get_session_version("i1") is None
+
+
+def test_store_purges_completed_interviews(make_store):
+    store = make_store(ttl=-1)
+    store.put_interview("done", {"status": "completed"})
+    store.put_interview("running", {"status": "processing"})
+    store.put_turns("done", [{"human": "q", "ai": "a"}])
+    store.put_session("done", {"step": 1})
+    store.put_report("r1", {"interview_id": "done"})
+    assert store.get_interview("done") is None
+    assert store.purge_expired() == 1
+    assert store.get_turns("done") == []
+    assert store.get_session("done") is None
+    assert store.get_report("r1") is None
+    assert store.get_interview("running") == {"status": "processing"}
+
+
+def test_sqlite_store_persists_after_close(tmp_path):
+    path = str(tmp_path / "store.db")
+    store = SQLiteStore(path, flush_interval=3600)
+    store.put_interview("i1", {"status": "processing"})
+    store.put_session("i1", {"step": 1})
+    store.close()
+    store = SQLiteStore(path, flush_interval=3600)
+    try:
+        assert store.get_interview("i1") == {"status": "processing"}
+        assert store.get_session("i1") == (1, {"step": 1})
+    finally:
+        store.close()
@@ -0,0 +1,49 @@
+import json
+
+from base.utils import JsonFieldStreamer, load_json
+
+
+def test_load_json_keeps_code_block_inside_value():
+    data = {"human": "请实现一个装饰器", "ai": "示例：```python\ndef wrapper():\n    pass\n``` 结束"}
+    assert load_json(json.dumps(data, ensure_ascii=False)) == data
+
+
+def test_load_json_strips_fence():
+    assert load_json('好的\n```json\n{"human": "q", "ai": "a"}\n```') == {"human": "q", "ai": "a"}
+
+
+def test_load_json_repairs_common_errors():
+    assert load_json('```json\n{"a": 1, "b": True,}\n```') == {"a": 1, "b": True}
+
+
+def test_load_json_completes_truncated_output():
+    assert load_json('{"human": "q", "ai": "a', partial=True) == {"human": "q", "ai": "a"}
+
+
+def _stream(field, chunks):
+    streamer = JsonFieldStreamer(field)
+    deltas = [streamer.feed(chunk) for chunk in chunks]
+    return streamer.value, deltas
+
+
+def test_json_field_streamer_key_split_across_chunks():
+    value, deltas = _stream("ai", ['{"human": "q", "a', 'i"', ' : "你', '好"}'])
+    assert value == "你好"
+    assert deltas == ["", "", "你", "好"]
+
+
+def test_json_field_streamer_escaped_quotes():
+    answer = '他说"ai": "x"\n结束\\'
+    text = json.dumps({"human": "q", "ai": answer}, ensure_ascii=False)
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+    assert _stream("ai", chunks)[0] == answer
+
+
+def test_json_field_streamer_escape_split_at_boundary():
+    value, deltas = _stream("ai", ['{"ai": "a\\', '"b\\u4f', '60\\n"', '}'])
+    assert value == 'a"b你\n'
+    assert deltas == ["a", '"b', "你\n", ""]
+
+
+def test_json_field_streamer_ignores_key_inside_other_value():
+    assert _stream("ai", ['{"human": "\\"ai\\" 是什么", ', '"ai": "答案"}'])[0] == "答案"